@@ -0,0 +1,120 @@
+"""Measure the per-request CPU overhead of /query outside the LLM call.
+
+Usage (from the backend directory):
+    python bench_overhead.py --chunks 20000 --requests 1000
+    RETRIEVER=tfidf python bench_overhead.py
+
+Builds a synthetic corpus in-process and times every step a /query request
+runs besides the LLM call: retrieval, prompt assembly, source building and
+response serialization. The previous f-string prompt and the stdlib
+jsonable_encoder + JSONResponse serialization are timed alongside for
+comparison.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import main
+from utils.corpus import ChunkLocation, Corpus
+from utils.fast_json import FastJSONResponse, orjson
+
+
+def synthetic_corpus(n_chunks: int, chunk_words: int, seed: int) -> Corpus:
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(5000)] + ["revenue", "cost", "growth", "policy", "customer", "risk"]
+    corpus = Corpus()
+    for doc in range(0, n_chunks, 50):
+        chunks = [" ".join(rng.choices(vocabulary, k=chunk_words)) for _ in range(min(50, n_chunks - doc))]
+        locations = [ChunkLocation((f"Report {doc}", f"Section {i // 10}"), i // 5 + 1, i // 5 + 1) for i in range(len(chunks))]
+        corpus.add_chunks(chunks, {"filename": f"doc{doc}.pdf", "format": "pdf",
+                                   "upload_time": "2024-01-01T00:00:00Z", "tags": ["bench"]}, locations)
+    return corpus
+
+
+def legacy_prompt(context_chunks, query: str) -> str:
+    """The per-request f-string prompt assembly this benchmark compares against"""
+    context_text = "\n\n".join([f"Source {i+1}:\n{chunk}" for i, chunk in enumerate(context_chunks)])
+    return f"""You are a helpful AI assistant. Using ONLY the context provided below from uploaded documents, answer the user's question accurately and concisely.
+
+IMPORTANT RULES:
+1. Answer based STRICTLY on the provided context only
+2. Be accurate and concise
+3. If the context doesn't contain enough information, say "The documents do not contain enough information to answer this question."
+4. Never make up information
+
+CONTEXT:
+{context_text}
+
+QUESTION: {query}
+
+ANSWER:"""
+
+
+def main_benchmark() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.chunks, args.chunk_words, args.seed)
+    rng = random.Random(args.seed + 1)
+    questions = [f"what about {rng.choice(['revenue', 'cost', 'growth', 'policy', 'risk'])} term{rng.randrange(5000)}"
+                 for _ in range(args.requests)]
+    main.retrieve_for_query(questions[0], corpus, None)  # build lazy indexes outside the timings
+
+    timings = {name: [] for name in ("retrieve", "context", "prompt", "prompt (legacy f-string)", "sources",
+                                     "response (fast json)", "response (jsonable_encoder + json)")}
+    prompt_chars = 0
+    for question in questions:
+        started = time.perf_counter()
+        results = main.retrieve_for_query(question, corpus, None)
+        timings["retrieve"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        context = main.build_context(corpus, results)
+        timings["context"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        prompt = main.llm_integration.create_rag_prompt(context, question)
+        timings["prompt"].append(time.perf_counter() - started)
+        prompt_chars += len(prompt)
+
+        # The previous build_context returned each labelled entry as one string
+        joined = ["".join(entry) if not isinstance(entry, str) else entry for entry in context]
+        started = time.perf_counter()
+        legacy_prompt(joined, question)
+        timings["prompt (legacy f-string)"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        sources = main.build_sources(corpus, results, question)
+        timings["sources"].append(time.perf_counter() - started)
+
+        result = {"question": question, "answer": "A benchmark answer. " * 20, "sources": sources,
+                  "retrieved_chunks": len(results), "corpus_version": 1}
+        started = time.perf_counter()
+        FastJSONResponse(result)
+        timings["response (fast json)"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        JSONResponse(jsonable_encoder(result))
+        timings["response (jsonable_encoder + json)"].append(time.perf_counter() - started)
+
+    print(f"{args.requests} requests over {len(corpus)} chunks, retriever {main.RETRIEVER}, "
+          f"JSON encoder {'orjson' if orjson else 'stdlib'}, avg prompt {prompt_chars // args.requests} chars")
+    print(f"{'step':<38}{'mean µs':>10}{'p50 µs':>10}{'p95 µs':>10}")
+    for name, samples in timings.items():
+        samples_us = sorted(sample * 1e6 for sample in samples)
+        p95 = samples_us[min(len(samples_us) - 1, int(len(samples_us) * 0.95))]
+        print(f"{name:<38}{statistics.fmean(samples_us):>10.1f}{statistics.median(samples_us):>10.1f}{p95:>10.1f}")
+    overhead = sum(statistics.fmean(timings[name]) for name in ("retrieve", "context", "prompt", "sources", "response (fast json)"))
+    print(f"Per-request overhead outside the LLM call: {overhead * 1e3:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,111 @@
+"""Measure TF-IDF search latency against shard and thread counts.
+
+Usage (from the backend directory):
+    python bench_sharding.py --chunks 200000 --shards 1,4,8,16,32
+    python bench_sharding.py --threads 1,2,4,8,16,32 --queries 500
+
+Builds a synthetic corpus in-process, splits its TF-IDF index into each
+--shards count and times the same queries with each --threads pool size
+(default: powers of two up to the core count). Every sharded result is
+checked against the unsharded search. Sizing a node: pick the smallest
+thread count past which latency stops improving, with shards >= threads.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.corpus import Corpus
+from utils.sharded_index import ShardedIndex
+from utils.simple_retriever import corpus_index
+
+
+def synthetic_corpus(n_chunks: int, chunk_words: int, seed: int) -> Corpus:
+    """Same vocabulary as bench_overhead.py, without loading the app"""
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(5000)] + ["revenue", "cost", "growth", "policy", "customer", "risk"]
+    corpus = Corpus()
+    for doc in range(0, n_chunks, 50):
+        chunks = [" ".join(rng.choices(vocabulary, k=chunk_words)) for _ in range(min(50, n_chunks - doc))]
+        corpus.add_chunks(chunks, {"filename": f"doc{doc}.pdf", "format": "pdf"})
+    return corpus
+
+
+def counts_arg(value: str):
+    return [int(count) for count in value.split(",") if count.strip()]
+
+
+def default_threads():
+    cores = os.cpu_count() or 1
+    threads = [1]
+    while threads[-1] * 2 <= cores:
+        threads.append(threads[-1] * 2)
+    if threads[-1] != cores:
+        threads.append(cores)
+    return threads
+
+
+def same_results(expected, actual) -> bool:
+    """Equal up to the order of chunks with tied scores"""
+    if len(expected) != len(actual):
+        return False
+    if any(abs(e[1] - a[1]) > 1e-9 for e, a in zip(expected, actual)):
+        return False
+    # Ties at the cut-off may pick different chunks; every id above it must match
+    cutoff = expected[-1][1] if expected else 0
+    return {i for i, score in expected if score > cutoff + 1e-9} == {i for i, score in actual if score > cutoff + 1e-9}
+
+
+def main_benchmark() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--shards", type=counts_arg, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--threads", type=counts_arg, default=default_threads())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    corpus = synthetic_corpus(args.chunks, args.chunk_words, args.seed)
+    index = corpus_index(corpus)
+    rng = random.Random(args.seed + 1)
+    queries = [f"{rng.choice(['revenue', 'cost', 'growth', 'policy', 'risk'])} term{rng.randrange(5000)} term{rng.randrange(5000)}"
+               for _ in range(args.queries)]
+    expected = [index.search(query, args.k) for query in queries]  # also warms the query cache and IDF
+    print(f"{len(corpus)} chunks, {index.tfidf_matrix.nnz} stored counts, {args.queries} queries, k={args.k}, "
+          f"{os.cpu_count()} cores; built in {time.perf_counter() - started:.1f} s")
+
+    started = time.perf_counter()
+    for query in queries:
+        index.search(query, args.k)
+    baseline = (time.perf_counter() - started) / len(queries)
+    print(f"Unsharded search: {baseline * 1e3:.2f} ms/query")
+
+    print(f"{'shards':>7}{'threads':>9}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>9}  results")
+    for threads in args.threads:
+        executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        for n_shards in args.shards:
+            sharded = ShardedIndex(index, n_shards, executor)
+            samples = []
+            mismatches = 0
+            for query, unsharded in zip(queries, expected):
+                started = time.perf_counter()
+                results = sharded.search(query, args.k)
+                samples.append(time.perf_counter() - started)
+                mismatches += not same_results(unsharded, results)
+            samples_ms = sorted(sample * 1e3 for sample in samples)
+            p95 = samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))]
+            mean = statistics.fmean(samples_ms)
+            print(f"{sharded.n_shards:>7}{threads:>9}{mean:>10.2f}{statistics.median(samples_ms):>10.2f}{p95:>10.2f}"
+                  f"{baseline * 1e3 / mean:>8.2f}x  {'match' if not mismatches else f'{mismatches} differ'}")
+        if executor is not None:
+            executor.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
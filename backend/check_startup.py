@@ -0,0 +1,80 @@
+"""Measure time-to-first-healthy for the backend and fail if it exceeds a budget.
+
+Usage (from the backend directory, e.g. in CI):
+    python check_startup.py --budget 5.0
+    RETRIEVER=tfidf python check_startup.py --budget 8.0
+
+Starts the API in a subprocess with the current environment, polls /health
+until it answers, prints the server's startup report from /stats and exits
+non-zero when the budget is exceeded or the server never becomes healthy.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import requests
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", "5")),
+                        help="maximum seconds from process start to first healthy response")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up after this many seconds")
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+    try:
+        healthy_after = None
+        while time.perf_counter() - started < args.timeout:
+            if server.poll() is not None:
+                print(f"❌ Server exited with code {server.returncode} before becoming healthy")
+                return 1
+            try:
+                if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    healthy_after = time.perf_counter() - started
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+
+        if healthy_after is None:
+            print(f"❌ Server not healthy after {args.timeout:.0f}s")
+            return 1
+
+        report = requests.get(f"{base_url}/stats", timeout=5).json().get("startup", {})
+        print(f"Core imports:  {report.get('core_imports_ms', 0):.1f} ms")
+        for component, elapsed in report.get("backend_imports_ms", {}).items():
+            print(f"  {component:<24} {elapsed:.1f} ms")
+        print(f"App ready:     {report.get('ready_ms', 0):.1f} ms")
+        print(f"First healthy: {healthy_after * 1000:.1f} ms (budget {args.budget * 1000:.0f} ms)")
+
+        if healthy_after > args.budget:
+            print("❌ Startup budget exceeded")
+            return 1
+        print("✅ Startup within budget")
+        return 0
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
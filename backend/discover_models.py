@@ -1,44 +1,29 @@
 import os
 import requests
 from dotenv import load_dotenv
+from utils.model_router import fetch_models
 
 load_dotenv()
 
+GROQ_API_BASE = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1").rstrip("/")
+
 def discover_available_models():
-    """Discover available Groq models"""
+    """Discover available Groq chat models (the same list the backend's model router uses)"""
     api_key = os.getenv('GROQ_API_KEY')
     
     if not api_key:
         print("❌ GROQ_API_KEY not found in .env file")
         return []
     
-    url = "https://api.groq.com/openai/v1/models"
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
     try:
         print("🔍 Discovering available models...")
-        response = requests.get(url, headers=headers, timeout=30)
+        models = fetch_models(GROQ_API_BASE, api_key, timeout=30)
         
-        if response.status_code == 200:
-            models_data = response.json()
-            available_models = []
-            
-            print("✅ Available models:")
-            for model in models_data.get('data', []):
-                model_id = model.get('id', '')
-                if model_id:
-                    print(f"   - {model_id}")
-                    available_models.append(model_id)
-            
-            return available_models
-        else:
-            print(f"❌ Failed to fetch models: {response.status_code}")
-            print(f"Response: {response.text}")
-            return []
+        print("✅ Available models:")
+        for model in models:
+            print(f"   - {model['id']} (context window: {model['context_window'] or 'unknown'})")
+        
+        return [model['id'] for model in models]
             
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -51,7 +36,7 @@ def test_specific_models():
     if not api_key:
         return
     
-    url = "https://api.groq.com/openai/v1/chat/completions"
+    url = f"{GROQ_API_BASE}/chat/completions"
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -115,9 +100,8 @@ if __name__ == "__main__":
     
     if working_models:
         print(f"\n🎉 Working models found: {working_models}")
-        print(f"\n💡 Update your groq_integration.py with one of these models:")
-        for model in working_models:
-            print(f'   self.model = "{model}"')
+        print(f"\n💡 Route across them by setting GROQ_MODELS in your .env, fastest-preferred first:")
+        print(f"   GROQ_MODELS={','.join(working_models)}")
     else:
         print("\n❌ No working models found. Please check:")
         print("   - Your Groq API key is valid")
@@ -1,19 +1,54 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+STARTUP_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 import os
+import sys
+import asyncio
+import hmac
+import itertools
 import shutil
-from typing import List
+import tempfile
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 import uvicorn
 from dotenv import load_dotenv
 import requests
 import json
+import logging
+from utils.reranker import create_reranker
+from utils.query_cache import query_cache, load_query_history, QueryHistoryLog
+from utils.corpus import ChunkLocation, Corpus
+from utils.corpus_store import CorpusSnapshotStore, SharedCorpus
+from utils.backends import backends
+from utils.single_flight import SingleFlight
+from utils.rate_limiter import LLMScheduler, RateLimitExceeded, PRIORITIES, estimate_tokens
+from utils.model_router import ModelRouter, fetch_models
+from utils.highlight import query_terms, highlight_spans, snippet_window
+from utils.conversation import ConversationSession, ConversationStore, looks_like_follow_up, term_coverage
+from utils.parsers import Block, detect_format, paragraph_blocks
+from utils.splitters import chunk_blocks
+from utils.snapshot_archive import SnapshotError, read_snapshot, write_snapshot
+from utils.profiling import QueryProfiler, QueryTrace, current_trace, run_traced, trace_count, trace_stage
+from utils.prompts import ContextEntry, rag_prompt
+from utils.fast_json import FastJSONResponse, dumps_line
+from utils.grounding import GroundingChecker
+
+CORE_IMPORT_MS = (time.perf_counter() - STARTUP_STARTED) * 1000
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(
     title="RAG Knowledge Base with Groq",
     description="Working RAG system with Groq AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -25,183 +60,578 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple storage
-documents_store = []
 UPLOAD_DIR = "uploaded_documents"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-class SimpleGroqIntegration:
-    def __init__(self):
-        self.api_key = os.getenv('GROQ_API_KEY')
-        self.api_url = "https://api.groq.com/openai/v1/chat/completions"
-        self.model = "llama-3.1-8b-instant"
-    
-    def create_rag_prompt(self, context_chunks: List[str], query: str) -> str:
-        """Create RAG prompt with context and query"""
-        context_text = "\n\n".join([f"Source {i+1}:\n{chunk}" for i, chunk in enumerate(context_chunks)])
-        
-        prompt = f"""You are a helpful AI assistant. Using ONLY the context provided below from uploaded documents, answer the user's question accurately and concisely.
+# Second-stage reranking: first-stage retrieval returns RERANK_CANDIDATES
+# chunks which are rescored down to TOP_K within RERANK_BUDGET_MS
+TOP_K = 3
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+reranker = create_reranker(
+    os.getenv("RERANKER", "proximity"),
+    candidate_pool=RERANK_CANDIDATES,
+    time_budget_ms=float(os.getenv("RERANK_BUDGET_MS", "50"))
+)
+
+# Pluggable components; only the configured ones are imported (see
+# utils/backends.py). Document parsers are resolved per format on first
+# upload; PDFs use PDF_PARSER, other formats the parser of the same name
+# (utils/parsers.py maps extensions and MIME types to formats).
+RETRIEVER = os.getenv("RETRIEVER", "keyword")
+SPLITTER = os.getenv("SPLITTER", "words")
+PDF_PARSER = os.getenv("PDF_PARSER", "pymupdf")
+retrieve = backends.resolve("retriever", RETRIEVER)
+chunk_text = backends.resolve("splitter", SPLITTER)
+
+# Structure-aware chunking (utils/splitters.py:chunk_blocks): documents are
+# cut into sections at headings (at most SECTION_CHARS each) and sections
+# into CHUNK_CHARS chunks of whole paragraphs, list items and table rows;
+# SPLITTER only cuts blocks too long for one chunk. Retrieval searches the
+# small chunks and, with EXPAND_TO_SECTION, the LLM sees their parent sections.
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "500"))
+SECTION_CHARS = int(os.getenv("SECTION_CHARS", "2000"))
+EXPAND_TO_SECTION = os.getenv("EXPAND_TO_SECTION", "true").lower() not in ("0", "false", "no")
+
+# Sharded TF-IDF search (utils/sharded_index.py). With RETRIEVER=tfidf and
+# INDEX_SHARDS > 1 the index is split into up to INDEX_SHARDS row blocks of
+# at least SHARD_MIN_CHUNKS chunks, searched in parallel on SEARCH_THREADS
+# threads (default: one per core) and merged into the same top-k as the
+# unsharded index. The split copies the count matrix, doubling its memory.
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+index_sharding = None
+if INDEX_SHARDS > 1:
+    if RETRIEVER == "tfidf":
+        from utils.sharded_index import IndexSharding
+        index_sharding = IndexSharding(
+            INDEX_SHARDS,
+            threads=int(os.getenv("SEARCH_THREADS", "0")) or None,
+            min_shard_chunks=int(os.getenv("SHARD_MIN_CHUNKS", "10000"))
+        )
+        retrieve = index_sharding.retrieve
+    else:
+        logger.warning(f"INDEX_SHARDS only applies to RETRIEVER=tfidf, not {RETRIEVER}; searching unsharded")
 
-IMPORTANT RULES:
-1. Answer based STRICTLY on the provided context only
-2. Be accurate and concise
-3. If the context doesn't contain enough information, say "The documents do not contain enough information to answer this question."
-4. Never make up information
+# Tiered corpus storage (utils/tiered_store.py). With TIERED_STORAGE on, a
+# corpus larger than TIER_HOT_SHARDS shards of TIER_SHARD_CHUNKS chunks is
+# written zlib-compressed to TIER_DIR and only TIER_HOT_SHARDS shards (the
+# newest uploads at first, then the most searched) stay in memory. A
+# per-shard term index routes each query to the shards holding its terms,
+# loading at most TIER_ROUTE_SHARDS cold ones; each load evicts the
+# resident shard whose hit count, halved every TIER_HALF_LIFE_S, is lowest.
+TIERED_STORAGE = os.getenv("TIERED_STORAGE", "false").lower() in ("1", "true", "yes")
+corpus_tiering = None
+if TIERED_STORAGE:
+    from utils.tiered_store import CorpusTiering
+    corpus_tiering = CorpusTiering(
+        os.getenv("TIER_DIR", "corpus_tiers"),
+        shard_chunks=int(os.getenv("TIER_SHARD_CHUNKS", "2048")),
+        hot_shards=int(os.getenv("TIER_HOT_SHARDS", "8")),
+        route_shards=int(os.getenv("TIER_ROUTE_SHARDS", "2")),
+        half_life_s=float(os.getenv("TIER_HALF_LIFE_S", "600"))
+    )
+    retrieve = corpus_tiering.wrap(retrieve)
 
-CONTEXT:
-{context_text}
+# Optional OCR for scanned PDFs (utils/ocr.py): pages without a text layer
+# are rendered at OCR_DPI and recognized by OCR_ENGINE ("tesseract", or the
+# local "stub" stand-in) in a pool of OCR_WORKERS processes. Results are
+# cached by page-image hash in OCR_CACHE_DIR, so re-uploading a scan only
+# OCRs the pages that changed.
+OCR_ENGINE = os.getenv("OCR_ENGINE")
+ocr_stage = None
+if OCR_ENGINE:
+    from utils.ocr import OCRStage
+    backends.resolve("ocr", OCR_ENGINE)
+    ocr_stage = OCRStage(
+        OCR_ENGINE,
+        cache_dir=os.getenv("OCR_CACHE_DIR", "ocr_cache"),
+        max_workers=int(os.getenv("OCR_WORKERS", "2")),
+        dpi=int(os.getenv("OCR_DPI", "200"))
+    )
 
-QUESTION: {query}
+# Query vectors are cached in the shared query cache; past questions are
+# optionally logged to QUERY_HISTORY_FILE and replayed into it at startup.
+# Questions are buffered and written every QUERY_HISTORY_FLUSH_SECONDS off
+# the event loop; the file keeps roughly the last QUERY_HISTORY_MAX_LINES.
+QUERY_HISTORY_FILE = os.getenv("QUERY_HISTORY_FILE")
+QUERY_WARMUP_TOP_N = int(os.getenv("QUERY_WARMUP_TOP_N", "100"))
+QUERY_HISTORY_FLUSH_SECONDS = float(os.getenv("QUERY_HISTORY_FLUSH_SECONDS", "5"))
+query_history = QueryHistoryLog(
+    QUERY_HISTORY_FILE,
+    max_lines=int(os.getenv("QUERY_HISTORY_MAX_LINES", "10000"))
+) if QUERY_HISTORY_FILE else None
 
-ANSWER:"""
-        return prompt
+# With WORKERS > 1 every upload publishes a versioned corpus snapshot to
+# CORPUS_SNAPSHOT_DIR; the other workers load it (in the threadpool) before
+# answering their next request
+WORKERS = int(os.getenv("WORKERS", "1"))
+CORPUS_SNAPSHOT_DIR = os.getenv("CORPUS_SNAPSHOT_DIR") or ("corpus_snapshots" if WORKERS > 1 else None)
+
+# Portable corpus archives (utils/snapshot_archive.py) bootstrap replicas
+# without re-ingesting: GET /admin/snapshot downloads one, POST
+# /admin/restore loads one, and RESTORE_SNAPSHOT names an archive restored
+# at startup while no corpus is loaded. When ADMIN_TOKEN is set, /admin
+# requests must send it in the X-Admin-Token header.
+RESTORE_SNAPSHOT = os.getenv("RESTORE_SNAPSHOT")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Query profiling (utils/profiling.py). Every query records stage timings;
+# requests with an X-Profile header, or a PROFILE_SAMPLE_RATE fraction of
+# them, get the trace back under "profile", and X-Profile: stacks also
+# samples the worker's stack every PROFILE_STACK_INTERVAL_MS (collapsed
+# format for flamegraph.pl / speedscope). Queries slower than SLOW_QUERY_MS
+# are logged and, with SLOW_QUERY_LOG set, appended to it as JSONL.
+query_profiler = QueryProfiler(
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    slow_query_ms=float(os.getenv("SLOW_QUERY_MS")) if os.getenv("SLOW_QUERY_MS") else None,
+    slow_log_path=os.getenv("SLOW_QUERY_LOG"),
+    stack_interval_ms=float(os.getenv("PROFILE_STACK_INTERVAL_MS", "5"))
+)
+
+# LLM calls go through a token-bucket scheduler sized to the Groq quotas
+# (requests and tokens per minute). Calls that can't start within
+# LLM_QUEUE_DEADLINE_S are rejected with 503 + Retry-After; 429s pause the
+# scheduler and are retried up to LLM_MAX_RETRIES times within that deadline.
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "256"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+llm_scheduler = LLMScheduler(
+    requests_per_minute=float(os.getenv("GROQ_RPM", "30")),
+    tokens_per_minute=float(os.getenv("GROQ_TPM", "6000")),
+    max_wait_seconds=float(os.getenv("LLM_QUEUE_DEADLINE_S", "10"))
+)
+
+SYSTEM_PROMPT = "You are a helpful assistant that provides accurate answers based only on the given context."
+
+# Answers are routed across GROQ_MODELS (comma-separated preference list;
+# empty means every discovered chat model) by utils/model_router.py: fastest
+# healthy model first, falling back on errors and timeouts, and racing a
+# second model after LLM_HEDGE_AFTER_MS when set. GROQ_API_BASE can point at
+# mock_groq_server.py for local testing.
+GROQ_API_BASE = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1").rstrip("/")
+GROQ_MODELS = [model.strip() for model in os.getenv("GROQ_MODELS", "llama-3.1-8b-instant,llama-3.3-70b-versatile").split(",") if model.strip()]
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS")) if os.getenv("LLM_HEDGE_AFTER_MS") else None
+
+class LLMAPIError(Exception):
+    """Non-success response from the LLM API; the router falls back to the next model"""
+
+class SimpleGroqIntegration:
+    def __init__(self, scheduler: LLMScheduler, router: ModelRouter):
+        self.api_key = os.getenv('GROQ_API_KEY')
+        self.scheduler = scheduler
+        self.router = router
+        self.api_url = f"{GROQ_API_BASE}/chat/completions"
+    
+    def create_rag_prompt(self, context_chunks: List[ContextEntry], query: str,
+                          history: Optional[List[Tuple[str, str]]] = None) -> str:
+        """Create RAG prompt with context, condensed conversation history and query.
+        
+        The template's static text is compiled once (utils/prompts.py); the
+        context entries are spliced in without intermediate copies.
+        """
+        return rag_prompt(context_chunks, query, history)
     
-    def generate_answer(self, prompt: str) -> str:
-        """Generate answer using Groq API"""
+    def generate_answer(self, prompt: str, priority: int = PRIORITIES["normal"]) -> str:
+        """Generate answer using Groq API.
+        
+        Raises RateLimitExceeded when the call can't be scheduled within the
+        queue deadline, so callers can answer 503 instead of an error string.
+        """
         if not self.api_key:
             return "❌ Error: GROQ_API_KEY not found"
         
+        estimated_tokens = self._estimate_tokens(prompt)
+        deadline = time.monotonic() + self.scheduler.max_wait_seconds
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "system", 
-                        "content": "You are a helpful assistant that provides accurate answers based only on the given context."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.1,
-                "max_tokens": 1024
-            }
-            
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                return f"❌ API Error: {response.status_code} - {response.text}"
+            model, answer = self.router.run(
+                lambda model: self._complete(model, prompt, estimated_tokens, priority, deadline),
+                estimated_tokens
+            )
+            return answer
                 
+        except RateLimitExceeded:
+            raise
+        except LLMAPIError as e:
+            return f"❌ {str(e)}"
         except Exception as e:
             return f"❌ Error: {str(e)}"
+    
+    def rewrite_query(self, question: str, n: int = 2) -> List[str]:
+        """Up to n rephrasings of a search question, at low priority (empty if the call failed)"""
+        prompt = f"""Rewrite the search question below in {n} different ways, using other words a document might use for the same things. Reply with one rewrite per line and nothing else.
 
-llm_integration = SimpleGroqIntegration()
+QUESTION: {question}"""
+        answer = self.generate_answer(prompt, PRIORITIES["low"])
+        if answer.startswith("❌"):
+            return []
+        return [line for line in answer.splitlines() if line.strip()][:n]
+    
+    def generate_answer_stream(self, prompt: str, priority: int = PRIORITIES["normal"]) -> Iterator[str]:
+        """Generate answer using Groq API, yielding text as it arrives.
+        
+        Models are only switched before the first token. Raises
+        RateLimitExceeded before the first chunk if the call can't be
+        scheduled within the queue deadline.
+        """
+        if not self.api_key:
+            yield "❌ Error: GROQ_API_KEY not found"
+            return
+        
+        estimated_tokens = self._estimate_tokens(prompt)
+        deadline = time.monotonic() + self.scheduler.max_wait_seconds
+        try:
+            model, deltas = self.router.run(
+                lambda model: self._open_stream(model, prompt, estimated_tokens, priority, deadline),
+                estimated_tokens
+            )
+            yield from deltas
+                        
+        except RateLimitExceeded:
+            raise
+        except LLMAPIError as e:
+            yield f"❌ {str(e)}"
+        except Exception as e:
+            yield f"❌ Error: {str(e)}"
+    
+    def _complete(self, model: str, prompt: str, estimated_tokens: int, priority: int, deadline: float) -> str:
+        """One chat completion on one model, retrying 429s within the deadline"""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.scheduler.acquire(estimated_tokens, priority, deadline)
+            response = requests.post(self.api_url, headers=self._headers(), json=self._request_body(prompt, model), timeout=LLM_TIMEOUT_S)
+            self.scheduler.update_from_headers(response.headers, response.status_code)
+            
+            if response.status_code == 429:
+                continue
+            if response.status_code != 200:
+                raise LLMAPIError(f"API Error: {response.status_code} - {response.text}")
+            result = response.json()
+            self._record_usage(estimated_tokens, result.get('usage'))
+            return result['choices'][0]['message']['content']
+        raise RateLimitExceeded(self.scheduler.retry_after())
+    
+    def _open_stream(self, model: str, prompt: str, estimated_tokens: int, priority: int, deadline: float) -> Iterator[str]:
+        """Start a streamed completion on one model and wait for its first token.
+        
+        Waiting for the first token makes failures before any output fall
+        back to another model, and makes the router's latency time-to-first-token.
+        """
+        body = dict(self._request_body(prompt, model), stream=True)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.scheduler.acquire(estimated_tokens, priority, deadline)
+            response = requests.post(self.api_url, headers=self._headers(), json=body, stream=True, timeout=LLM_TIMEOUT_S)
+            self.scheduler.update_from_headers(response.headers, response.status_code)
+            
+            if response.status_code == 429:
+                response.close()
+                continue
+            if response.status_code != 200:
+                error = LLMAPIError(f"API Error: {response.status_code} - {response.text}")
+                response.close()
+                raise error
+            deltas = self._iter_deltas(response, estimated_tokens)
+            first = next(deltas, None)
+            return itertools.chain([first] if first else [], deltas)
+        raise RateLimitExceeded(self.scheduler.retry_after())
+    
+    def _iter_deltas(self, response: requests.Response, estimated_tokens: int) -> Iterator[str]:
+        with response:
+            # Server-sent events: "data: {json}" lines, ending with "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                payload = line[len("data: "):]
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                # Groq reports usage on the last chunk under x_groq
+                self._record_usage(estimated_tokens, chunk.get('usage') or chunk.get('x_groq', {}).get('usage'))
+                delta = chunk['choices'][0]['delta'].get('content') if chunk.get('choices') else None
+                if delta:
+                    yield delta
+    
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Tokens to reserve for a call: the prompt plus an expected completion"""
+        return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt) + LLM_COMPLETION_TOKENS
+    
+    def _record_usage(self, estimated_tokens: int, usage: Optional[dict]):
+        if usage and usage.get('total_tokens'):
+            self.scheduler.record_usage(estimated_tokens, usage['total_tokens'])
+    
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def _request_body(self, prompt: str, model: str) -> dict:
+        return {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system", 
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.1,
+            "max_tokens": 1024
+        }
+
+model_router = ModelRouter(
+    GROQ_MODELS,
+    discover=(lambda: fetch_models(GROQ_API_BASE, os.getenv('GROQ_API_KEY'))) if os.getenv('GROQ_API_KEY') else None,
+    hedge_after_ms=LLM_HEDGE_AFTER_MS,
+    # A primary and a hedge for every call the scheduler can have in flight
+    max_workers=2 * llm_scheduler.concurrency(LLM_TIMEOUT_S)
+)
+llm_integration = SimpleGroqIntegration(llm_scheduler, model_router)
+
+# Multi-query expansion (utils/query_expansion.py). With QUERY_EXPANSION on,
+# questions of at most QUERY_EXPANSION_MAX_TERMS content terms are also
+# retrieved as synonym reformulations (built-in groups plus SYNONYMS_FILE),
+# a pseudo-relevance-feedback variant and, with QUERY_EXPANSION_LLM, LLM
+# rephrasings. Variants are retrieved concurrently and fused with the
+# original results; those not done QUERY_EXPANSION_BUDGET_MS after the
+# original retrieval are left out. LLM rephrasings are cached per question
+# and only requested while the fastest model's observed latency fits that
+# budget.
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "false").lower() in ("1", "true", "yes")
+query_expander = None
+if QUERY_EXPANSION:
+    from utils.query_expansion import QueryExpander, load_synonyms
+    query_expander = QueryExpander(
+        retrieve,
+        synonyms=load_synonyms(os.getenv("SYNONYMS_FILE")),
+        rewriter=llm_integration.rewrite_query if os.getenv("QUERY_EXPANSION_LLM", "false").lower() in ("1", "true", "yes") else None,
+        budget_ms=float(os.getenv("QUERY_EXPANSION_BUDGET_MS", "50")),
+        max_variants=int(os.getenv("QUERY_EXPANSION_VARIANTS", "4")),
+        max_query_terms=int(os.getenv("QUERY_EXPANSION_MAX_TERMS", "8")),
+        rewrite_latency_ms=model_router.fastest_latency_ms
+    )
+
+def ocr_missing_pages(file_path: str, pages: List[Tuple[Optional[int], str]]) -> List[Tuple[Optional[int], str]]:
+    """Fill in the text of PDF pages that have no text layer using the OCR stage"""
+    missing = [page for page, text in pages if page and not text.strip()]
+    if not missing:
+        return pages
+    from utils.pdf_parser import render_pdf_pages
+    recognized = ocr_stage.ocr_images(render_pdf_pages(file_path, missing, ocr_stage.dpi))
+    return [(page, text if text.strip() else recognized.get(page, "")) for page, text in pages]
 
-def extract_text_from_file(file_path: str) -> str:
-    """Extract text from file with better error handling"""
+def extract_pdf_blocks(file_path: str) -> Iterator[Block]:
+    """The paragraphs of each PDF page as blocks, OCR'ing pages without a text layer when enabled"""
     try:
-        if file_path.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                if content.strip():
-                    return content
-                else:
-                    return f"Empty text file: {os.path.basename(file_path)}"
-                    
-        elif file_path.endswith('.pdf'):
-            try:
-                import fitz
-                doc = fitz.open(file_path)
-                text = ""
-                for page_num, page in enumerate(doc):
-                    page_text = page.get_text()
-                    if page_text.strip():
-                        text += f"Page {page_num + 1}:\n{page_text}\n\n"
-                doc.close()
-                
-                if text.strip():
-                    return text
-                else:
-                    return f"PDF file contains no extractable text: {os.path.basename(file_path)}"
-                    
-            except ImportError:
-                return f"PDF file: {os.path.basename(file_path)} (install pymupdf for text extraction)"
-            except Exception as e:
-                return f"Error reading PDF {os.path.basename(file_path)}: {str(e)}"
-                
+        parse_pdf = backends.resolve("parser", PDF_PARSER)
+        pages = parse_pdf(file_path)
+        if ocr_stage:
+            pages = ocr_missing_pages(file_path, pages)
+        pages = [(page, text) for page, text in pages if text.strip()]
+        
+        if pages:
+            for page, text in pages:
+                yield from paragraph_blocks(text, page)
         else:
-            return f"Unsupported file type: {os.path.basename(file_path)}"
+            yield Block(f"PDF file contains no extractable text: {os.path.basename(file_path)}")
             
+    except ImportError:
+        yield Block(f"PDF file: {os.path.basename(file_path)} (install pymupdf for text extraction)")
     except Exception as e:
-        return f"Error reading file {os.path.basename(file_path)}: {str(e)}"
-def chunk_text(text: str, chunk_size: int = 500) -> List[str]:
-    """Split text into chunks"""
-    words = text.split()
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for word in words:
-        if current_length + len(word) > chunk_size and current_chunk:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-            current_length = len(word)
-        else:
-            current_chunk.append(word)
-            current_length += len(word) + 1  # +1 for space
+        yield Block(f"Error reading PDF {os.path.basename(file_path)}: {str(e)}")
+
+def extract_blocks_from_file(file_path: str, document_format: Optional[str] = None) -> Iterator[Block]:
+    """Stream the structural blocks of a file from its registered parser (utils/parsers.py).
     
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
+    The format is detected from the extension unless given. Unreadable,
+    empty and unsupported files yield a single block describing the problem.
+    """
+    name = os.path.basename(file_path)
+    document_format = document_format or detect_format(file_path)
+    if document_format is None:
+        yield Block(f"Unsupported file type: {name}")
+        return
+    if document_format == "pdf":
+        yield from extract_pdf_blocks(file_path)
+        return
     
-    return chunks
+    try:
+        empty = True
+        for block in backends.resolve("parser", document_format)(file_path):
+            if block.text.strip():
+                empty = False
+                yield block
+        if empty:
+            yield Block(f"Empty {document_format} file: {name}")
+    except Exception as e:
+        yield Block(f"Error reading file {name}: {str(e)}")
 
-def simple_retrieve(query: str, chunks: List[str], k: int = 3) -> List[tuple]:
-    """Simple keyword-based retrieval with proper scoring"""
-    query_words = set(query.lower().split())
-    scored_chunks = []
+def ingest_file(corpus: Corpus, file_path: str, document_format: str, metadata: dict) -> int:
+    """Parse and chunk one file into the corpus a section at a time; returns the chunks added.
     
-    for chunk in chunks:
-        chunk_words = set(chunk.lower().split())
-        common_words = query_words.intersection(chunk_words)
-        
-        # Calculate similarity score (0 to 1)
-        if query_words:
-            score = len(common_words) / len(query_words)
-        else:
-            score = 0.1  # Default score for empty query
-        
-        # Ensure score is between 0 and 1
-        score = max(0.1, min(1.0, score))
-        scored_chunks.append((chunk, score))
+    Each chunk's "page" metadata is the first page it covers; its heading
+    path, page range and parent section are kept in corpus.locations.
+    """
+    added = 0
+    blocks = extract_blocks_from_file(file_path, document_format)
+    for section in chunk_blocks(blocks, chunk_size=CHUNK_CHARS, section_size=SECTION_CHARS, split=chunk_text):
+        section_id = corpus.add_section(section.text)
+        for chunk in section.chunks:
+            location = ChunkLocation(section.heading_path, chunk.page_start, chunk.page_end, section_id)
+            added += len(corpus.add_chunks([chunk.text], {**metadata, "page": chunk.page_start}, [location]))
+    return added
+
+shared_corpus = SharedCorpus(
+    Corpus,
+    CorpusSnapshotStore(CORPUS_SNAPSHOT_DIR) if CORPUS_SNAPSHOT_DIR else None
+)
+
+async def pin_corpus() -> Tuple[Corpus, int]:
+    """The newest corpus and its version for a request.
+    
+    When another worker published a newer snapshot it is unpickled in the
+    threadpool first; concurrent requests wait for that one load.
+    """
+    if shared_corpus.stale():
+        return await run_in_threadpool(shared_corpus.pinned)
+    return shared_corpus.loaded
+
+startup_report = {}
+history_flusher = {}
+
+@app.on_event("startup")
+async def warm_query_cache():
+    """Preload the most frequent historical queries into the query cache.
+    
+    Uses the warm_up(queries, top_n) function of the configured retriever's
+    module (keyword token sets, hashed TF-IDF query vectors), if it has one.
+    """
+    history = load_query_history(QUERY_HISTORY_FILE)
+    if not history:
+        return
+    module = sys.modules[backends.resolve("retriever", RETRIEVER).__module__]
+    warm_up = getattr(module, "warm_up", None)
+    if warm_up is None:
+        return
+    loaded = await run_in_threadpool(warm_up, history, QUERY_WARMUP_TOP_N)
+    print(f"🔥 Warmed {RETRIEVER} query cache with {loaded} historical queries")
+
+@app.on_event("startup")
+async def restore_startup_snapshot():
+    """Load RESTORE_SNAPSHOT unless a corpus was already published.
+    
+    With WORKERS > 1 the snapshot store's lock lets only the first worker
+    restore; the others pick the published version up like any other.
+    """
+    if not RESTORE_SNAPSHOT:
+        return
+    started = time.perf_counter()
+    restored = {}
     
-    # Sort by score and return top k
-    scored_chunks.sort(key=lambda x: x[1], reverse=True)
-    return scored_chunks[:k]
+    def load():
+        with open(RESTORE_SNAPSHOT, "rb") as f:
+            restored["corpus"], restored["manifest"] = read_snapshot(f)
+        return restored["corpus"]
+    
+    version = await run_in_threadpool(shared_corpus.publish_initial, load)
+    if version is None:
+        return
+    print(f"📦 Restored {len(restored['corpus'])} chunks from {RESTORE_SNAPSHOT} as corpus v{version} "
+          f"in {time.perf_counter() - started:.2f}s (snapshot of {restored['manifest']['created_at']})")
+
+@app.on_event("startup")
+async def warm_up_reranker():
+    """Load the reranker's model (cross-encoder) now rather than inside the first query's RERANK_BUDGET_MS"""
+    if reranker:
+        await run_in_threadpool(reranker.warm_up)
+
+@app.on_event("startup")
+async def report_startup_time():
+    """Record how long startup took and what each configured backend cost to import"""
+    startup_report.update({
+        "core_imports_ms": round(CORE_IMPORT_MS, 2),
+        "backend_imports_ms": backends.import_report(),
+        "ready_ms": round((time.perf_counter() - STARTUP_STARTED) * 1000, 2)
+    })
+    print(f"⏱️ Startup report: {json.dumps(startup_report)}")
+
+@app.on_event("startup")
+async def start_history_flusher():
+    """Write buffered query history every QUERY_HISTORY_FLUSH_SECONDS"""
+    if not query_history:
+        return
+    
+    async def flush_periodically():
+        while True:
+            await asyncio.sleep(QUERY_HISTORY_FLUSH_SECONDS)
+            try:
+                await run_in_threadpool(query_history.flush)
+            except OSError as e:
+                logger.warning(f"Could not write query history: {e}")
+    
+    history_flusher["task"] = asyncio.create_task(flush_periodically())
+
+@app.on_event("shutdown")
+async def flush_query_history():
+    if not query_history:
+        return
+    task = history_flusher.pop("task", None)
+    if task:
+        task.cancel()
+    await run_in_threadpool(query_history.flush)
+
+@app.on_event("shutdown")
+async def stop_ocr_workers():
+    if ocr_stage:
+        ocr_stage.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "🚀 RAG Knowledge Base with Groq AI is running!"}
 
 @app.get("/health")
 async def health_check():
+    corpus, version = await pin_corpus()
     return {
         "status": "healthy", 
         "llm_provider": "Groq",
-        "documents_loaded": len(documents_store)
+        "documents_loaded": len(corpus),
+        "corpus_version": version
     }
 
+def parse_upload_metadata(tags: str, metadata: str) -> dict:
+    """Parse the comma-separated tags and JSON metadata form fields"""
+    try:
+        extra = json.loads(metadata) if metadata.strip() else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="metadata must be a JSON object")
+    if not isinstance(extra, dict):
+        raise HTTPException(status_code=400, detail="metadata must be a JSON object")
+    
+    extra["tags"] = [tag.strip() for tag in tags.split(",") if tag.strip()] + list(extra.get("tags", []))
+    return extra
+
 @app.post("/upload")
-async def upload_documents(files: List[UploadFile] = File(...)):
-    """Upload and process documents"""
-    global documents_store
-    documents_store = []  # Clear previous documents
+async def upload_documents(files: List[UploadFile] = File(...), tags: str = Form(""), metadata: str = Form("")):
+    """Upload and process documents.
     
+    Every chunk gets source, file_type, page, uploaded_at and upload_year
+    metadata plus the optional tags and JSON metadata form fields, all of
+    which can be used as /query filters.
+    """
     try:
         if not files:
             raise HTTPException(status_code=400, detail="No files provided")
         
+        extra_metadata = parse_upload_metadata(tags, metadata)
+        uploaded_at = datetime.now(timezone.utc)
+        
         file_paths = []
+        formats = []
         
         for file in files:
-            if not file.filename.lower().endswith(('.pdf', '.txt')):
+            document_format = detect_format(file.filename, file.content_type)
+            if document_format is None:
                 raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
             
             # Save file
@@ -209,82 +639,571 @@ async def upload_documents(files: List[UploadFile] = File(...)):
             with open(file_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
             file_paths.append(file_path)
+            formats.append(document_format)
         
-        # Process documents
-        all_chunks = []
-        for file_path in file_paths:
+        # Process documents into a fresh corpus (replaces previous documents)
+        new_corpus = Corpus()
+        for file_path, document_format in zip(file_paths, formats):
             print(f"Processing: {file_path}")
-            text = extract_text_from_file(file_path)
-            if text.strip():
-                chunks = chunk_text(text)
-                all_chunks.extend(chunks)
+            # Parsing (and OCR) is blocking; keep it off the event loop
+            await run_in_threadpool(ingest_file, new_corpus, file_path, document_format, {
+                "source": os.path.basename(file_path),
+                "file_type": os.path.splitext(file_path)[1].lstrip(".").lower() or document_format,
+                "uploaded_at": uploaded_at.isoformat(),
+                "upload_year": uploaded_at.year,
+                **extra_metadata
+            })
         
-        documents_store = all_chunks
+        # Publishing pickles the corpus for the other workers; keep it off the event loop
+        version = await run_in_threadpool(shared_corpus.publish, new_corpus)
         
         return {
             "message": f"✅ Successfully processed {len(files)} files",
-            "chunks_created": len(all_chunks),
+            "chunks_created": len(new_corpus),
+            "corpus_version": version,
             "file_paths": file_paths
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
-@app.post("/query")
-async def query_knowledge_base(query: dict):
-    """Query the knowledge base"""
+def parse_query_request(query: dict, corpus: Corpus, version: int):
+    """Validate a /query body against the corpus version it will be answered from (see pin_corpus).
+    
+    Returns (question, filters, corpus, corpus version, candidate ids, LLM priority).
+    """
+    if not len(corpus):
+        raise HTTPException(status_code=400, detail="Please upload documents first")
+    
+    user_query = query.get("question", "").strip()
+    if not user_query:
+        raise HTTPException(status_code=400, detail="Question is required")
+    
+    # Metadata filters resolve to candidate ids before scoring
+    filters = query.get("filters")
+    if filters is not None and not isinstance(filters, dict):
+        raise HTTPException(status_code=400, detail="filters must be an object")
     try:
-        if not documents_store:
-            raise HTTPException(status_code=400, detail="Please upload documents first")
-        
-        user_query = query.get("question", "").strip()
-        if not user_query:
-            raise HTTPException(status_code=400, detail="Question is required")
-        
-        # Retrieve relevant chunks with scores
-        relevant_chunks_with_scores = simple_retrieve(user_query, documents_store, k=3)
-        
-        if not relevant_chunks_with_scores:
-            return {
-                "question": user_query,
-                "answer": "❌ No relevant information found in the uploaded documents.",
-                "sources": []
-            }
-        
-        # Generate answer
-        prompt = llm_integration.create_rag_prompt([chunk for chunk, score in relevant_chunks_with_scores], user_query)
-        answer = llm_integration.generate_answer(prompt)
-        
-        # Prepare sources with similarity scores
-        sources = [
-            {
-                "source_id": i+1,
-                "content": chunk[:500] + "..." if len(chunk) > 500 else chunk,
-                "similarity_score": f"{score:.3f}",
-                "content_length": len(chunk)
-            } 
-            for i, (chunk, score) in enumerate(relevant_chunks_with_scores)
-        ]
+        candidate_ids = corpus.candidate_ids(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # LLM queue priority: "high", "normal" (default) or "low"
+    priority = query.get("priority", "normal")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of: {', '.join(PRIORITIES)}")
+    
+    if query_history:
+        query_history.record(user_query)
+    
+    return user_query, filters, corpus, version, candidate_ids, PRIORITIES[priority]
+
+def coalescing_key(user_query: str, filters: Optional[dict], version: int) -> tuple:
+    """Requests with equal keys share one retrieval and LLM call"""
+    return (query_cache.normalize(user_query), json.dumps(filters, sort_keys=True, default=str), version)
+
+def session_coalescing_key(user_query: str, filters: Optional[dict], version: int,
+                           session: Optional[ConversationSession]) -> tuple:
+    """coalescing_key, scoped to the conversation for session requests.
+    
+    Answers in a session depend on its history, so only repeats within the
+    same session (a double submit, a UI rerun) share the work and record
+    a single turn.
+    """
+    key = coalescing_key(user_query, filters, version)
+    return key + (session.session_id,) if session else key
+
+def first_stage_retrieve(user_query: str, corpus: Corpus, k: int, candidate_ids) -> List[tuple]:
+    """First-stage (chunk, score, chunk_id) candidates, over several reformulations with QUERY_EXPANSION"""
+    if query_expander:
+        return query_expander.retrieve_expanded(user_query, corpus, k, candidate_ids)
+    return retrieve(user_query, corpus, k=k, candidate_ids=candidate_ids)
+
+def retrieve_for_query(user_query: str, corpus: Corpus, candidate_ids) -> List[tuple]:
+    """Retrieve relevant (chunk, score, chunk_id) tuples"""
+    trace_count("candidates", len(corpus) if candidate_ids is None else len(candidate_ids))
+    if candidate_ids is not None and len(candidate_ids) == 0:
+        return []
+    if reranker:
+        with trace_stage("retrieve"):
+            candidates = first_stage_retrieve(user_query, corpus, RERANK_CANDIDATES, candidate_ids)
+        trace_count("retrieved", len(candidates))
+        with trace_stage("rerank"):
+            return reranker.rerank(user_query, candidates, k=TOP_K)
+    with trace_stage("retrieve"):
+        return first_stage_retrieve(user_query, corpus, TOP_K, candidate_ids)
+
+def retrieve_in_session(user_query: str, corpus: Corpus, version: int, filters: Optional[dict],
+                        candidate_ids, session: ConversationSession) -> List[tuple]:
+    """Retrieve for a conversation turn, reusing the session's candidate pool for follow-ups.
+    
+    Follow-up questions (pronouns like "it", "they", or a leading "and") get
+    terms carried over from recent questions, so "what drove it?" keeps its
+    subject. If most of the resulting terms (CONVERSATION_REUSE_COVERAGE) are
+    found in the previous turn's candidates, only that pool is re-scored;
+    otherwise a full retrieval runs and its candidates replace the pool.
+    """
+    search_query = user_query
+    if session.turns and looks_like_follow_up(user_query):
+        search_query = " ".join([user_query] + session.carried_terms(user_query))
+    
+    pool_key = (version, json.dumps(filters, sort_keys=True, default=str))
+    pool = session.cached_candidates(pool_key)
+    if pool is not None and term_coverage(search_query, (corpus.chunks[i] for i in pool)) >= CONVERSATION_REUSE_COVERAGE:
+        conversations.record_retrieval(session, reused=True)
+        return retrieve_for_query(search_query, corpus, pool)
+    
+    conversations.record_retrieval(session, reused=False)
+    trace_count("candidates", len(corpus) if candidate_ids is None else len(candidate_ids))
+    if candidate_ids is not None and len(candidate_ids) == 0:
+        return []
+    with trace_stage("retrieve"):
+        candidates = first_stage_retrieve(search_query, corpus, RERANK_CANDIDATES, candidate_ids)
+    trace_count("retrieved", len(candidates))
+    session.remember_candidates([candidate[2] for candidate in candidates], pool_key)
+    if not reranker:
+        return candidates[:TOP_K]
+    with trace_stage("rerank"):
+        return reranker.rerank(search_query, candidates, k=TOP_K)
+
+def build_sources(corpus: Corpus, relevant_chunks_with_scores: List[tuple], user_query: str) -> List[dict]:
+    """Prepare sources with similarity scores.
+    
+    Each source carries a SNIPPET_CHARS window around its best query-term
+    matches rather than the whole chunk. snippet_start/snippet_end and the
+    highlight spans are character offsets into the full chunk text, which
+    clients fetch from /chunks/{chunk_id} only when needed.
+    """
+    terms = query_terms(user_query)
+    sources = []
+    for i, (chunk, score, chunk_id) in enumerate(relevant_chunks_with_scores):
+        spans = highlight_spans(chunk, terms)
+        start, end = snippet_window(chunk, spans, SNIPPET_CHARS)
+        sources.append({
+            "source_id": i+1,
+            "chunk_id": chunk_id,
+            "snippet": chunk[start:end],
+            "snippet_start": start,
+            "snippet_end": end,
+            "highlights": [[s, e] for s, e in spans if s >= start and e <= end],
+            "similarity_score": f"{score:.3f}",
+            "content_length": len(chunk),
+            "location": corpus.location(chunk_id),
+            "metadata": corpus.metadata[chunk_id]
+        })
+    return sources
+
+def build_context(corpus: Corpus, relevant_chunks_with_scores: List[tuple]) -> List[ContextEntry]:
+    """Prompt context for the retrieved chunks, one entry per source.
+    
+    With EXPAND_TO_SECTION each chunk is replaced by its parent section
+    (small-to-big); a section already included for an earlier source isn't
+    repeated, that source keeps just its chunk. Entries are labelled with
+    their pages and, for sections, their heading path (chunk texts start
+    with it already); a labelled entry is a (label, text) pair
+    so the text is passed on from the corpus without being copied.
+    """
+    context = []
+    included_sections = set()
+    for chunk, _, chunk_id in relevant_chunks_with_scores:
+        location = corpus.locations[chunk_id]
+        text = chunk
+        if EXPAND_TO_SECTION and location.section_id is not None and location.section_id not in included_sections:
+            included_sections.add(location.section_id)
+            text = corpus.sections[location.section_id]
         
+        # Chunk texts already start with their heading path (utils/splitters.py)
+        label = [" > ".join(location.heading_path)] if location.heading_path and text is not chunk else []
+        if location.page_start is not None:
+            label.append(f"page {location.page_start}" if location.page_start == location.page_end
+                         else f"pages {location.page_start}-{location.page_end}")
+        context.append((f"[{', '.join(label)}]\n", text) if label else text)
+    return context
+
+# Characters of each source returned inline with an answer
+SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "300"))
+
+NO_RESULTS_ANSWER = "❌ No relevant information found in the uploaded documents."
+
+# Answer grounding check (utils/grounding.py). Each sentence of a generated
+# answer is scored against the sources it was generated from by term and
+# bigram overlap, without another LLM call; responses carry the per-sentence
+# scores and supporting source ids under "grounding", and sentences scoring
+# below GROUNDING_THRESHOLD are marked unsupported.
+GROUNDING_CHECK = os.getenv("GROUNDING_CHECK", "true").lower() not in ("0", "false", "no")
+grounding_checker = GroundingChecker(threshold=float(os.getenv("GROUNDING_THRESHOLD", "0.5"))) if GROUNDING_CHECK else None
+
+def check_grounding(answer: str, context: List[ContextEntry]) -> Optional[dict]:
+    """Grounding report of an answer against its prompt context (source ids as in "sources")"""
+    if not grounding_checker or answer.startswith("❌"):
+        return None
+    with trace_stage("grounding"):
+        report = grounding_checker.check(
+            answer, [(i + 1, entry if isinstance(entry, str) else entry[-1]) for i, entry in enumerate(context)]
+        )
+    trace_count("unsupported_sentences", report["unsupported_sentences"])
+    return report
+
+def answer_query(user_query: str, corpus: Corpus, version: int, candidate_ids,
+                 priority: int = PRIORITIES["normal"], session: Optional[ConversationSession] = None,
+                 filters: Optional[dict] = None) -> dict:
+    """Retrieve and generate a complete answer (blocking; run in the threadpool)"""
+    if session:
+        relevant_chunks_with_scores = retrieve_in_session(user_query, corpus, version, filters, candidate_ids, session)
+    else:
+        relevant_chunks_with_scores = retrieve_for_query(user_query, corpus, candidate_ids)
+    session_fields = {"session_id": session.session_id} if session else {}
+    
+    if not relevant_chunks_with_scores:
+        if session:
+            session.add_turn(user_query, NO_RESULTS_ANSWER)
+            conversations.save(session)
         return {
             "question": user_query,
-            "answer": answer,
-            "sources": sources,
-            "retrieved_chunks": len(relevant_chunks_with_scores)
+            "answer": NO_RESULTS_ANSWER,
+            "sources": [],
+            "corpus_version": version,
+            **session_fields
         }
+    
+    # Generate answer
+    with trace_stage("prompt"):
+        context = build_context(corpus, relevant_chunks_with_scores)
+        prompt = llm_integration.create_rag_prompt(context, user_query, session.history() if session else None)
+    trace_count("prompt_tokens", estimate_tokens(prompt))
+    with trace_stage("llm"):
+        answer = llm_integration.generate_answer(prompt, priority)
+    if session:
+        session.add_turn(user_query, answer)
+        conversations.save(session)
+    
+    with trace_stage("sources"):
+        sources = build_sources(corpus, relevant_chunks_with_scores, user_query)
+    grounding = check_grounding(answer, context)
+    return {
+        "question": user_query,
+        "answer": answer,
+        "sources": sources,
+        "retrieved_chunks": len(relevant_chunks_with_scores),
+        "corpus_version": version,
+        **({"grounding": grounding} if grounding else {}),
+        **session_fields
+    }
+
+async def stream_answer_events(user_query: str, corpus: Corpus, version: int, candidate_ids,
+                               priority: int = PRIORITIES["normal"], session: Optional[ConversationSession] = None,
+                               filters: Optional[dict] = None, trace: Optional[QueryTrace] = None) -> AsyncIterator[str]:
+    """NDJSON events: one "sources" event, "token" events as the answer arrives, then "done".
+    
+    If the LLM call is shed by the rate limiter an "error" event with status
+    503 and retry_after replaces the tokens, since headers are already sent.
+    A profiled trace is returned in the "done" event.
+    """
+    trace = trace or QueryTrace(user_query)
+    current_trace.set(trace)
+    status = 200
+    try:
+        if session:
+            relevant_chunks_with_scores = await run_in_threadpool(
+                retrieve_in_session, user_query, corpus, version, filters, candidate_ids, session
+            )
+        else:
+            relevant_chunks_with_scores = await run_in_threadpool(retrieve_for_query, user_query, corpus, candidate_ids)
+        with trace.stage("sources"):
+            sources = build_sources(corpus, relevant_chunks_with_scores, user_query)
+        yield dumps_line({
+            "type": "sources",
+            "question": user_query,
+            "sources": sources,
+            "corpus_version": version,
+            **({"session_id": session.session_id} if session else {})
+        })
         
+        answer_parts = []
+        context = []
+        if not relevant_chunks_with_scores:
+            answer_parts.append(NO_RESULTS_ANSWER)
+            yield dumps_line({"type": "token", "text": NO_RESULTS_ANSWER})
+        else:
+            with trace.stage("prompt"):
+                context = build_context(corpus, relevant_chunks_with_scores)
+                prompt = llm_integration.create_rag_prompt(context, user_query, session.history() if session else None)
+            trace.count("prompt_tokens", estimate_tokens(prompt))
+            try:
+                with trace.stage("llm"):
+                    async for text in iterate_in_threadpool(llm_integration.generate_answer_stream(prompt, priority)):
+                        if not answer_parts:
+                            trace.count("first_token_ms", round((time.perf_counter() - trace.started) * 1000, 2))
+                        answer_parts.append(text)
+                        yield dumps_line({"type": "token", "text": text})
+            except RateLimitExceeded as e:
+                status = 503
+                answer_parts = []
+                yield dumps_line({"type": "error", "status": 503, "detail": str(e), "retry_after": e.retry_after})
+        
+        if session and answer_parts:
+            session.add_turn(user_query, "".join(answer_parts))
+            conversations.save(session)
+        done = {"type": "done", "retrieved_chunks": len(relevant_chunks_with_scores)}
+        grounding = check_grounding("".join(answer_parts), context) if answer_parts and context else None
+        if grounding:
+            done["grounding"] = grounding
+        if trace.profiled:
+            done["profile"] = trace.to_dict()
+        yield dumps_line(done)
+    except Exception:
+        status = 500
+        logger.exception(f"Error streaming answer to {user_query[:80]!r}")
+        raise
+    finally:
+        query_profiler.record(trace, version, "/query/stream", status)
+
+# Server-side conversation sessions (utils/conversation.py). A /query body
+# with a session_id from POST /sessions gets the session's condensed history
+# in the prompt and reuses its cached candidates for follow-up questions.
+# Sessions idle for SESSION_IDLE_TTL_S are evicted; at most MAX_SESSIONS are
+# kept. With a corpus snapshot directory (WORKERS > 1) sessions are files in
+# its "sessions" subdirectory, so every worker sees every conversation.
+CONVERSATION_REUSE_COVERAGE = float(os.getenv("CONVERSATION_REUSE_COVERAGE", "0.6"))
+conversations = ConversationStore(
+    max_sessions=int(os.getenv("MAX_SESSIONS", "1000")),
+    idle_ttl_seconds=float(os.getenv("SESSION_IDLE_TTL_S", "1800")),
+    max_turns=int(os.getenv("SESSION_MAX_TURNS", "6")),
+    max_candidates=RERANK_CANDIDATES,
+    directory=os.path.join(CORPUS_SNAPSHOT_DIR, "sessions") if CORPUS_SNAPSHOT_DIR else None
+)
+
+def resolve_session(query: dict) -> Optional[ConversationSession]:
+    """The conversation named by the body's session_id, if any"""
+    session_id = query.get("session_id")
+    if session_id is None:
+        return None
+    session = conversations.get(str(session_id))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired; create a new one with POST /sessions")
+    return session
+
+# Identical concurrent questions against the same corpus version share one
+# in-progress retrieval and LLM call (per worker); within a conversation
+# only repeats from the same session are shared
+in_flight = SingleFlight()
+
+@app.post("/query")
+async def query_knowledge_base(query: dict, x_profile: Optional[str] = Header(None)):
+    """Query the knowledge base.
+    
+    Send X-Profile: 1 to get the request's stage timings under "profile",
+    or X-Profile: stacks to also get sampled stacks of the worker thread.
+    """
+    trace = QueryTrace(str(query.get("question", "")), query_profiler.wants_profile(x_profile))
+    current_trace.set(trace)
+    version = shared_corpus.version
+    status = 200
+    try:
+        with trace.stage("parse"):
+            # Pin one corpus version for the whole request
+            corpus, version = await pin_corpus()
+            user_query, filters, corpus, version, candidate_ids, priority = parse_query_request(query, corpus, version)
+            session = resolve_session(query)
+        if trace.profiled:
+            # Profiled requests need their own trace, so they aren't coalesced
+            sample_stacks = (x_profile or "").strip().lower() == "stacks"
+            result = await run_in_threadpool(run_traced, trace, sample_stacks, query_profiler.stack_interval_s,
+                                             answer_query, user_query, corpus, version, candidate_ids, priority,
+                                             session, filters)
+        else:
+            async def compute():
+                # Runs for the first request only; its trace holds the work stages
+                return await run_in_threadpool(answer_query, user_query, corpus, version, candidate_ids, priority,
+                                               session, filters), trace
+            
+            result, leader_trace = await in_flight.do(session_coalescing_key(user_query, filters, version, session), compute)
+            if leader_trace is not trace:
+                trace.adopt(leader_trace)
+        if trace.profiled:
+            result = {**result, "profile": trace.to_dict()}
+        # Plain JSON types only, so skip FastAPI's jsonable_encoder pass
+        return FastJSONResponse(result)
+        
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except RateLimitExceeded as e:
+        status = 503
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
+        status = 500
+        logger.exception(f"Error answering {trace.question[:80]!r}")
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    finally:
+        query_profiler.record(trace, version, "/query", status)
+
+@app.post("/query/stream")
+async def stream_query(query: dict, x_profile: Optional[str] = Header(None)):
+    """Query the knowledge base and stream the answer as NDJSON events.
+    
+    A request for a question that is already streaming attaches to that
+    stream, replaying what was sent so far. With an X-Profile header the
+    stage timings are sent in the "done" event.
+    """
+    corpus, version = await pin_corpus()
+    user_query, filters, corpus, version, candidate_ids, priority = parse_query_request(query, corpus, version)
+    session = resolve_session(query)
+    trace = QueryTrace(user_query, query_profiler.wants_profile(x_profile))
+    if trace.profiled:
+        events = stream_answer_events(user_query, corpus, version, candidate_ids, priority, session, filters, trace)
+        return StreamingResponse(events, media_type="application/x-ndjson")
+    events = in_flight.stream(
+        ("stream",) + session_coalescing_key(user_query, filters, version, session),
+        lambda: stream_answer_events(user_query, corpus, version, candidate_ids, priority, session, filters, trace)
+    )
+    return StreamingResponse(events, media_type="application/x-ndjson")
+
+@app.post("/sessions")
+async def create_session():
+    """Start a conversation; pass the returned session_id with /query requests"""
+    session = conversations.create()
+    return {"session_id": session.session_id, "idle_ttl_seconds": conversations.idle_ttl_seconds}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Condensed history and retrieval cache state of a conversation"""
+    session = conversations.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {
+        **session.summary(),
+        "history": [{"question": question, "answer": answer} for question, answer in session.history()]
+    }
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """End a conversation and free its state"""
+    if not conversations.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"message": "Session deleted"}
+
+@app.get("/chunks/{chunk_id}")
+async def get_chunk(chunk_id: int, version: Optional[int] = None, start: int = 0, length: Optional[int] = None,
+                    include_section: bool = False):
+    """Full text of a chunk, or the [start, start + length) character range of it.
+    
+    Pass the corpus_version from the /query response to get a 409 instead of
+    a different chunk if documents were re-uploaded in between. With
+    include_section the full text of the chunk's parent section is added.
+    """
+    corpus, current_version = await pin_corpus()
+    if version is not None and version != current_version:
+        raise HTTPException(status_code=409, detail=f"Corpus changed (version {current_version}); re-run the query")
+    if not 0 <= chunk_id < len(corpus):
+        raise HTTPException(status_code=404, detail=f"Chunk {chunk_id} not found")
+    
+    text = corpus.chunks[chunk_id]
+    start = max(0, min(start, len(text)))
+    end = len(text) if length is None else min(len(text), start + max(0, length))
+    return {
+        "chunk_id": chunk_id,
+        "corpus_version": current_version,
+        "content": text[start:end],
+        "start": start,
+        "end": end,
+        "content_length": len(text),
+        "location": corpus.location(chunk_id),
+        **({"section_text": corpus.section_text(chunk_id)} if include_section else {}),
+        "metadata": corpus.metadata[chunk_id]
+    }
+
+def require_admin(token: Optional[str]):
+    if ADMIN_TOKEN and not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/snapshot")
+async def download_snapshot(x_admin_token: Optional[str] = Header(None)):
+    """Download the current corpus as a versioned, checksummed .tar.gz archive"""
+    require_admin(x_admin_token)
+    corpus, version = await pin_corpus()
+    if RETRIEVER == "tfidf":
+        # Ship the TF-IDF counts so replicas don't re-vectorize every chunk
+        from utils.simple_retriever import corpus_index
+        await run_in_threadpool(corpus_index, corpus)
+    
+    fd, path = tempfile.mkstemp(prefix="corpus-snapshot-", suffix=".tar.gz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            manifest = await run_in_threadpool(write_snapshot, corpus, f, version)
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/gzip",
+        filename=f"corpus-v{version}.tar.gz",
+        headers={"X-Snapshot-Chunks": str(manifest["chunks"]), "X-Corpus-Version": str(version)},
+        background=BackgroundTask(os.remove, path)
+    )
+
+@app.post("/admin/restore")
+async def restore_snapshot(file: UploadFile = File(...), x_admin_token: Optional[str] = Header(None)):
+    """Replace the corpus with a snapshot archive; nothing changes unless it verifies"""
+    require_admin(x_admin_token)
+    started = time.perf_counter()
+    try:
+        corpus, manifest = await run_in_threadpool(read_snapshot, file.file)
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    version = await run_in_threadpool(shared_corpus.publish, corpus)
+    
+    return {
+        "message": f"✅ Restored {len(corpus)} chunks",
+        "chunks_restored": len(corpus),
+        "sections_restored": len(corpus.sections),
+        "corpus_version": version,
+        "snapshot": {
+            "created_at": manifest["created_at"],
+            "format_version": manifest["format_version"],
+            "source_corpus_version": manifest["corpus_version"],
+            "indexes": manifest["indexes"]
+        },
+        "restore_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
 
 @app.get("/stats")
 async def get_stats():
     """Get system statistics"""
+    corpus, _ = await pin_corpus()
     return {
-        "documents_processed": len(documents_store),
-        "status": "ready" if documents_store else "waiting_for_documents"
+        "documents_processed": len(corpus),
+        "status": "ready" if len(corpus) else "waiting_for_documents",
+        "corpus": shared_corpus.get_stats(),
+        "backends": {"retriever": RETRIEVER, "splitter": SPLITTER, "pdf_parser": PDF_PARSER},
+        "chunking": {
+            "chunk_chars": CHUNK_CHARS,
+            "section_chars": SECTION_CHARS,
+            "expand_to_section": EXPAND_TO_SECTION,
+            "sections": len(corpus.sections)
+        },
+        "startup": startup_report,
+        "reranker": reranker.get_stats() if reranker else None,
+        "query_expansion": query_expander.get_stats() if query_expander else None,
+        "tiers": corpus_tiering.get_stats(corpus) if corpus_tiering else None,
+        "index_shards": index_sharding.get_stats(corpus) if index_sharding else None,
+        "query_cache": query_cache.get_stats(),
+        "coalescing": in_flight.get_stats(),
+        "profiling": query_profiler.get_stats(),
+        "conversations": conversations.get_stats(),
+        "llm_scheduler": llm_scheduler.get_stats(),
+        "llm_models": model_router.get_stats(),
+        "ocr": ocr_stage.get_stats() if ocr_stage else None
     }
 
 if __name__ == "__main__":
     print("🚀 Starting RAG Knowledge Base with Groq AI...")
     print("📚 API will be available at: http://localhost:8000")
     print("🔑 Make sure you have set GROQ_API_KEY in .env file")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WORKERS > 1:
+        # Workers import the app themselves and share state via snapshots
+        print(f"👥 Running {WORKERS} workers sharing corpus snapshots in {CORPUS_SNAPSHOT_DIR}")
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""Local stand-in for the Groq OpenAI-compatible API, for testing model routing.
+
+Usage (from the backend directory):
+    python mock_groq_server.py --port 9000 \
+        --models "fast-model:50:0,slow-model:1500:0,flaky-model:100:0.5"
+    GROQ_API_BASE=http://127.0.0.1:9000/openai/v1 GROQ_API_KEY=test \
+        GROQ_MODELS=flaky-model,slow-model,fast-model python main.py
+
+Each model is "id:latency_ms:error_rate[:context_window]". Requests take
+latency_ms, fail with a 500 at error_rate, and return a canned answer naming
+the model, streamed as server-sent events when "stream" is set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+DEFAULT_MODELS = "llama-3.1-8b-instant:200:0:131072,llama-3.3-70b-versatile:800:0:131072"
+
+app = FastAPI(title="Mock Groq API")
+models = {}
+
+
+def parse_models(spec: str) -> dict:
+    parsed = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model_id, latency_ms, error_rate, *rest = entry.split(":")
+        parsed[model_id] = {
+            "latency_ms": float(latency_ms),
+            "error_rate": float(error_rate),
+            "context_window": int(rest[0]) if rest else 8192
+        }
+    return parsed
+
+
+def rate_limit_headers() -> dict:
+    return {
+        "x-ratelimit-limit-tokens": "6000",
+        "x-ratelimit-remaining-tokens": "6000",
+        "x-ratelimit-reset-tokens": "0s"
+    }
+
+
+@app.get("/openai/v1/models")
+async def list_models():
+    return {
+        "object": "list",
+        "data": [
+            {"id": model_id, "object": "model", "active": True, "context_window": config["context_window"]}
+            for model_id, config in models.items()
+        ]
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(body: dict):
+    config = models.get(body.get("model"))
+    if config is None:
+        raise HTTPException(status_code=404, detail=f"The model `{body.get('model')}` does not exist")
+
+    await asyncio.sleep(config["latency_ms"] / 1000)
+    if random.random() < config["error_rate"]:
+        return JSONResponse({"error": {"message": "mock upstream failure"}}, status_code=500)
+
+    answer = f"Answer from {body['model']}."
+    prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5}
+
+    if body.get("stream"):
+        async def events():
+            for word in answer.split(" "):
+                chunk = {"id": "mock", "created": int(time.time()), "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield f"data: {json.dumps({'choices': [], 'x_groq': {'usage': usage}})}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream", headers=rate_limit_headers())
+
+    return JSONResponse({
+        "id": "mock",
+        "object": "chat.completion",
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": usage
+    }, headers=rate_limit_headers())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--models", default=os.getenv("MOCK_MODELS", DEFAULT_MODELS),
+                        help="comma-separated id:latency_ms:error_rate[:context_window]")
+    args = parser.parse_args()
+    models.update(parse_models(args.models))
+    print(f"🧪 Mock Groq API on http://127.0.0.1:{args.port}/openai/v1 serving {list(models)}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -9,8 +9,10 @@ load_dotenv()
 class GroqIntegration:
     def __init__(self):
         self.api_key = os.getenv('GROQ_API_KEY')
-        self.api_url = "https://api.groq.com/openai/v1/chat/completions"
-        self.model = "llama-3.1-8b-instant"  # ✅ Updated working model
+        api_base = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1").rstrip("/")
+        self.api_url = f"{api_base}/chat/completions"
+        # First preferred model; the backend routes across all of GROQ_MODELS
+        self.model = os.getenv("GROQ_MODELS", "llama-3.1-8b-instant").split(",")[0].strip()
     
     def create_rag_prompt(self, context: List[Tuple[str, float]], query: str) -> str:
         """Create RAG prompt with context and query"""
@@ -0,0 +1,91 @@
+"""Export, restore and verify corpus snapshot archives.
+
+Usage (from the backend directory):
+    python snapshot.py export corpus.tar.gz --url http://primary:8000
+    python snapshot.py restore corpus.tar.gz --url http://replica:8000
+    python snapshot.py verify corpus.tar.gz
+
+export downloads GET /admin/snapshot, restore uploads to POST /admin/restore
+(both send ADMIN_TOKEN as X-Admin-Token when it is set) and verify reads
+an archive locally, checking every member against the manifest. A replica
+can also restore at startup with RESTORE_SNAPSHOT=corpus.tar.gz.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import requests
+from utils.snapshot_archive import SnapshotError, read_snapshot
+
+
+def admin_headers() -> dict:
+    token = os.getenv("ADMIN_TOKEN")
+    return {"X-Admin-Token": token} if token else {}
+
+
+def export_snapshot(args) -> int:
+    started = time.perf_counter()
+    with requests.get(f"{args.url}/admin/snapshot", headers=admin_headers(), stream=True, timeout=args.timeout) as response:
+        if response.status_code != 200:
+            print(f"❌ Snapshot failed ({response.status_code}): {response.text}")
+            return 1
+        tmp_path = f"{args.archive}.part"
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(response.raw, f)
+        os.replace(tmp_path, args.archive)
+    size_mb = os.path.getsize(args.archive) / 1e6
+    print(f"✅ Saved {response.headers.get('X-Snapshot-Chunks', '?')} chunks "
+          f"(corpus v{response.headers.get('X-Corpus-Version', '?')}) to {args.archive}: "
+          f"{size_mb:.1f} MB in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def restore_snapshot(args) -> int:
+    with open(args.archive, "rb") as f:
+        response = requests.post(f"{args.url}/admin/restore", headers=admin_headers(),
+                                 files={"file": (os.path.basename(args.archive), f, "application/gzip")},
+                                 timeout=args.timeout)
+    if response.status_code != 200:
+        print(f"❌ Restore failed ({response.status_code}): {response.text}")
+        return 1
+    result = response.json()
+    print(f"✅ Restored {result['chunks_restored']} chunks as corpus v{result['corpus_version']} "
+          f"in {result['restore_ms']:.0f} ms")
+    return 0
+
+
+def verify_snapshot(args) -> int:
+    started = time.perf_counter()
+    try:
+        with open(args.archive, "rb") as f:
+            corpus, manifest = read_snapshot(f)
+    except SnapshotError as e:
+        print(f"❌ {e}")
+        return 1
+    print(json.dumps({key: value for key, value in manifest.items() if key != "members"}, indent=2))
+    print(f"✅ {len(corpus)} chunks verified in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    for name, handler, remote in (("export", export_snapshot, True), ("restore", restore_snapshot, True),
+                                  ("verify", verify_snapshot, False)):
+        command = subcommands.add_parser(name)
+        command.add_argument("archive", help="snapshot archive path (.tar.gz)")
+        if remote:
+            command.add_argument("--url", default=os.getenv("API_BASE_URL", "http://localhost:8000"),
+                                 help="backend base URL")
+            command.add_argument("--timeout", type=float, default=600.0)
+        command.set_defaults(handler=handler)
+    args = parser.parse_args()
+    if getattr(args, "url", None):
+        args.url = args.url.rstrip("/")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
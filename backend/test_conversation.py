@@ -0,0 +1,36 @@
+from utils.conversation import ConversationSession, looks_like_follow_up
+
+
+def test_standalone_questions_are_not_follow_ups():
+    for question in [
+        "What is the difference between revenue and profit?",
+        "Which policy covers refunds that exceed 30 days?",
+        "Is there a fee?",
+        "What does this policy say about travel expenses?",
+        "Is it possible to cancel a subscription after the annual renewal date?",
+        "How do they calculate overtime pay for weekend shifts in the warehouse?",
+    ]:
+        assert not looks_like_follow_up(question), question
+
+
+def test_follow_up_questions():
+    for question in [
+        "And in 2023?",
+        "also for Europe",
+        "What about operating costs?",
+        "How about last quarter?",
+        "What drove it?",
+        "How do they compare?",
+        "Why did those change?",
+    ]:
+        assert looks_like_follow_up(question), question
+
+
+def test_standalone_question_gets_no_carried_terms():
+    session = ConversationSession("s1")
+    session.add_turn("What was the 2024 revenue of Acme?", "Acme reported revenue of $10M in 2024.")
+    question = "What is the difference between revenue and profit?"
+    assert not looks_like_follow_up(question)
+    follow_up = "And in 2023?"
+    assert looks_like_follow_up(follow_up)
+    assert {"2024", "revenue", "acme"} <= set(session.carried_terms(follow_up))
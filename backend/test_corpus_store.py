@@ -0,0 +1,68 @@
+import tempfile
+import threading
+from utils.corpus import Corpus
+from utils.corpus_store import CorpusSnapshotStore, SharedCorpus
+
+
+def make_corpus(*chunks):
+    corpus = Corpus()
+    corpus.add_chunks(list(chunks), {"source": "test.txt"})
+    return corpus
+
+
+def test_other_worker_serves_new_version_on_next_request():
+    directory = tempfile.mkdtemp()
+    publisher = SharedCorpus(Corpus, CorpusSnapshotStore(directory))
+    reader = SharedCorpus(Corpus, CorpusSnapshotStore(directory))
+
+    version = publisher.publish(make_corpus("revenue grew", "costs fell"))
+    corpus, pinned_version = reader.pinned()
+    assert pinned_version == version
+    assert list(corpus.chunks) == ["revenue grew", "costs fell"]
+
+    version = publisher.publish(make_corpus("new upload"))
+    assert reader.stale()
+    corpus, pinned_version = reader.pinned()
+    assert pinned_version == version
+    assert list(corpus.chunks) == ["new upload"]
+    assert not reader.stale()
+
+
+def test_concurrent_requests_load_a_snapshot_once():
+    directory = tempfile.mkdtemp()
+    publisher = SharedCorpus(Corpus, CorpusSnapshotStore(directory))
+    reader = SharedCorpus(Corpus, CorpusSnapshotStore(directory))
+    version = publisher.publish(make_corpus("revenue grew"))
+
+    loads = []
+    load = reader.store.load
+    reader.store.load = lambda v: (loads.append(v), load(v))[1]
+    barrier = threading.Barrier(8)
+    pinned = []
+
+    def request():
+        barrier.wait()
+        pinned.append(reader.pinned()[1])
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pinned == [version] * 8
+    assert loads == [version]
+
+
+def test_publish_initial_runs_once_across_workers():
+    directory = tempfile.mkdtemp()
+    workers = [SharedCorpus(Corpus, CorpusSnapshotStore(directory)) for _ in range(4)]
+    builds = []
+
+    def build():
+        builds.append(1)
+        return make_corpus("restored")
+
+    results = [worker.publish_initial(build) for worker in workers]
+    assert results == [1, None, None, None]
+    assert len(builds) == 1
+    assert all(worker.pinned()[1] == 1 for worker in workers)
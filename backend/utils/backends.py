@@ -0,0 +1,84 @@
+import importlib
+import threading
+import time
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# kind -> name -> "module:attribute". Nothing is imported until a backend is
+# resolved, so deployments only pay for the components they configure.
+DEFAULT_BACKENDS = {
+    "retriever": {
+        "keyword": "utils.keyword_retriever:retrieve_from_corpus",
+        "tfidf": "utils.simple_retriever:retrieve_from_corpus",
+    },
+    "splitter": {
+        "words": "utils.splitters:chunk_text",
+        "recursive": "utils.splitters:recursive_chunk_text",
+    },
+    "parser": {
+        "pymupdf": "utils.pdf_parser:extract_pdf_pages",
+        "text": "utils.parsers:parse_text",
+        "markdown": "utils.parsers:parse_markdown",
+        "html": "utils.parsers:parse_html",
+        "docx": "utils.parsers:parse_docx",
+        "csv": "utils.parsers:parse_csv",
+        "jsonl": "utils.parsers:parse_jsonl",
+        "email": "utils.parsers:parse_email",
+    },
+    "embedder": {
+        "local": "utils.local_embedding:HashedNgramEmbedder",
+    },
+    "ocr": {
+        "tesseract": "utils.ocr:tesseract_ocr",
+        "stub": "utils.ocr:local_stub_ocr",
+    },
+}
+
+
+class BackendRegistry:
+    """Resolves configured backends on demand and records their import cost"""
+
+    def __init__(self, backends: Dict[str, Dict[str, str]] = None):
+        source = backends if backends is not None else DEFAULT_BACKENDS
+        self._targets = {kind: dict(entries) for kind, entries in source.items()}
+        self._resolved: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self.import_times: Dict[str, float] = {}
+
+    def register(self, kind: str, name: str, target: str):
+        """Register a "module:attribute" target under a backend kind"""
+        self._targets.setdefault(kind, {})[name] = target
+
+    def names(self, kind: str) -> List[str]:
+        return sorted(self._targets.get(kind, {}))
+
+    def resolve(self, kind: str, name: str) -> Any:
+        """Import (once) and return the backend registered as kind/name"""
+        key = (kind, name)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        target = self._targets.get(kind, {}).get(name)
+        if target is None:
+            raise ValueError(f"Unknown {kind} backend: {name} (available: {', '.join(self.names(kind))})")
+
+        with self._lock:
+            if key not in self._resolved:
+                module_name, _, attribute = target.partition(":")
+                start = time.perf_counter()
+                module = importlib.import_module(module_name)
+                backend = getattr(module, attribute) if attribute else module
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self.import_times[f"{kind}:{name}"] = round(elapsed_ms, 2)
+                logger.info(f"Loaded {kind} backend '{name}' in {elapsed_ms:.1f} ms")
+                self._resolved[key] = backend
+        return self._resolved[key]
+
+    def import_report(self) -> Dict[str, float]:
+        """Import time in ms of every backend resolved so far"""
+        return dict(self.import_times)
+
+
+backends = BackendRegistry()
@@ -0,0 +1,280 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Iterable, List, Optional, Tuple
+from .highlight import STOPWORDS, query_terms
+from .reranker import tokenize
+
+
+# Openings that continue the previous turn ("and in 2023?", "what about costs?")
+FOLLOW_UP_OPENINGS = (("and",), ("also",), ("but",), ("so",), ("then",), ("what", "about"), ("how", "about"),
+                      ("what", "else"))
+
+# Pronouns whose referent is usually in the previous turn ("what drove it?").
+# "this", "that" and "there" are left out: they are just as often
+# determiners, relative pronouns or existentials in standalone questions.
+FOLLOW_UP_PRONOUNS = frozenset("it its they them their those these he she his her".split())
+
+# A question with a pronoun and more content terms than this names its own subject
+FOLLOW_UP_MAX_TERMS = 2
+
+
+def looks_like_follow_up(question: str) -> bool:
+    """Whether the question opens with a connective, or leans on a pronoun with little else to search for"""
+    tokens = tokenize(question)
+    if any(tuple(tokens[:len(opening)]) == opening for opening in FOLLOW_UP_OPENINGS):
+        return True
+    if not FOLLOW_UP_PRONOUNS.intersection(tokens):
+        return False
+    content = [token for token in tokens if token not in STOPWORDS and token not in FOLLOW_UP_PRONOUNS]
+    return len(content) <= FOLLOW_UP_MAX_TERMS
+
+
+def _valid_session_id(session_id: str) -> bool:
+    """Session ids are uuid4 hex; anything else never names a session file"""
+    return len(session_id) == 32 and all(c in "0123456789abcdef" for c in session_id)
+
+
+def term_coverage(question: str, chunks: Iterable[str]) -> float:
+    """Fraction of the question's terms that occur in the chunks (1.0 if it has none)"""
+    terms = query_terms(question)
+    if not terms:
+        return 1.0
+    found = set()
+    for chunk in chunks:
+        found.update(terms.intersection(tokenize(chunk)))
+        if len(found) == len(terms):
+            break
+    return len(found) / len(terms)
+
+
+class ConversationSession:
+    """Condensed history and cached retrieval candidates of one conversation.
+
+    Memory is bounded: only the last `max_turns` question/answer pairs are
+    kept (answers truncated to `answer_chars`), and the candidate pool holds
+    at most `max_candidates` chunk ids from the last full retrieval.
+    """
+
+    def __init__(self, session_id: str, max_turns: int = 6, max_candidates: int = 50, answer_chars: int = 300):
+        self.session_id = session_id
+        self.max_candidates = max_candidates
+        self.answer_chars = answer_chars
+        self.turns: deque = deque(maxlen=max_turns)
+        self.candidate_ids: List[int] = []
+        self.pool_key: Optional[tuple] = None
+        self.last_used = time.monotonic()
+        self.full_retrievals = 0
+        self.reused_retrievals = 0
+
+    def add_turn(self, question: str, answer: str):
+        answer = " ".join(answer.split())
+        if len(answer) > self.answer_chars:
+            answer = answer[:self.answer_chars].rsplit(" ", 1)[0] + " …"
+        self.turns.append((question, answer))
+
+    def history(self) -> List[Tuple[str, str]]:
+        return list(self.turns)
+
+    def remember_candidates(self, candidate_ids: Iterable[int], pool_key: tuple):
+        """Keep the candidate pool of a full retrieval for follow-up questions"""
+        self.candidate_ids = list(candidate_ids)[:self.max_candidates]
+        self.pool_key = pool_key
+
+    def cached_candidates(self, pool_key: tuple) -> Optional[List[int]]:
+        """The cached pool if it was retrieved under the same corpus version and filters"""
+        if self.candidate_ids and self.pool_key == pool_key:
+            return self.candidate_ids
+        return None
+
+    def carried_terms(self, question: str, turns: int = 2) -> List[str]:
+        """Terms of recent questions missing from this one, in first-seen order"""
+        present = query_terms(question)
+        carried = []
+        for previous, _ in list(self.turns)[-turns:]:
+            for term in tokenize(previous):
+                if term not in STOPWORDS and term not in present and term not in carried:
+                    carried.append(term)
+        return carried
+
+    def summary(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "turns": len(self.turns),
+            "cached_candidates": len(self.candidate_ids),
+            "full_retrievals": self.full_retrievals,
+            "reused_retrievals": self.reused_retrievals,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1)
+        }
+
+
+class ConversationStore:
+    """Server-side conversation sessions with LRU capping and idle eviction.
+
+    At most `max_sessions` are kept; the least recently used one is dropped
+    when a new session would exceed that, and sessions idle for longer than
+    `idle_ttl_seconds` are evicted on access.
+
+    With a `directory` (the corpus snapshot directory when running several
+    workers) every session is a pickle file there, read on each lookup and
+    rewritten by `save()`, so a follow-up can land on any worker. Last use
+    is then the file's mtime. Counters in get_stats() stay per worker.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl_seconds: float = 1800, max_turns: int = 6,
+                 max_candidates: int = 50, answer_chars: int = 300, directory: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.session_options = {"max_turns": max_turns, "max_candidates": max_candidates, "answer_chars": answer_chars}
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.full_retrievals = 0
+        self.reused_retrievals = 0
+
+    def _evict_idle(self, now: float):
+        # Sessions are ordered by last use, so idle ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_ttl_seconds:
+                break
+            del self._sessions[session.session_id]
+            self.evicted_idle += 1
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"session-{session_id}.pkl")
+
+    def _session_files(self) -> List[Tuple[float, str]]:
+        """(mtime, path) of the stored sessions, least recently used first"""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith("session-") and name.endswith(".pkl"):
+                path = os.path.join(self.directory, name)
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    pass  # deleted by another worker
+        return sorted(files)
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _prune_files(self):
+        files = self._session_files()
+        cutoff = time.time() - self.idle_ttl_seconds
+        while files and files[0][0] < cutoff:
+            self.evicted_idle += self._remove(files.pop(0)[1])
+        while len(files) > self.max_sessions:
+            self.evicted_lru += self._remove(files.pop(0)[1])
+
+    def save(self, session: ConversationSession):
+        """Persist a session after a turn; a no-op for in-memory stores"""
+        if not self.directory:
+            return
+        session_id = session.session_id
+        if not _valid_session_id(session_id):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-session-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(session_id))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+    def _load(self, session_id: str) -> Optional[ConversationSession]:
+        if not _valid_session_id(session_id):
+            return None
+        path = self._path(session_id)
+        try:
+            idle = time.time() - os.path.getmtime(path)
+            if idle > self.idle_ttl_seconds:
+                self.evicted_idle += self._remove(path)
+                return None
+            with open(path, "rb") as f:
+                session = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        session.last_used = time.monotonic()
+        # Mark it used for the other workers' idle eviction
+        os.utime(path)
+        return session
+
+    def create(self) -> ConversationSession:
+        session = ConversationSession(uuid.uuid4().hex, **self.session_options)
+        if self.directory:
+            with self._lock:
+                self.save(session)
+                self._prune_files()
+                self.created += 1
+            return session
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted_lru += 1
+            self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        """Look up a session and mark it used; None if unknown or expired"""
+        if self.directory:
+            return self._load(session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def record_retrieval(self, session: ConversationSession, reused: bool):
+        with self._lock:
+            if reused:
+                session.reused_retrievals += 1
+                self.reused_retrievals += 1
+            else:
+                session.full_retrievals += 1
+                self.full_retrievals += 1
+
+    def delete(self, session_id: str) -> bool:
+        if self.directory:
+            return _valid_session_id(session_id) and self._remove(self._path(session_id))
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            if self.directory:
+                self._prune_files()
+                active = len(self._session_files())
+            else:
+                self._evict_idle(time.monotonic())
+                active = len(self._sessions)
+            return {
+                "active": active,
+                "shared": bool(self.directory),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "created": self.created,
+                "evicted_idle": self.evicted_idle,
+                "evicted_lru": self.evicted_lru,
+                "full_retrievals": self.full_retrievals,
+                "reused_retrievals": self.reused_retrievals
+            }
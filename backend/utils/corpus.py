@@ -0,0 +1,81 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from .metadata_index import MetadataIndex
+
+
+def tokenize_words(text: str) -> frozenset:
+    """Word set used for keyword matching"""
+    return frozenset(text.lower().split())
+
+
+class ChunkLocation(NamedTuple):
+    """Where a chunk came from: its heading path, page range and parent section"""
+    heading_path: Tuple[str, ...] = ()
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    section_id: Optional[int] = None
+
+
+class Corpus:
+    """Chunk store with per-chunk metadata and a bitmap metadata index.
+
+    Chunk ids are positions in `chunks`; `tokens`, `metadata`, `locations`
+    and the metadata index are kept aligned with them. `sections` holds the
+    parent texts chunks point to for small-to-big retrieval. The tokenizer must be a
+    module-level function so corpus snapshots can be pickled.
+    """
+
+    def __init__(self, tokenizer: Callable[[str], frozenset] = tokenize_words):
+        self.tokenizer = tokenizer
+        self.chunks: List[str] = []
+        self.tokens: List[frozenset] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.locations: List[ChunkLocation] = []
+        self.sections: List[str] = []
+        self.metadata_index = MetadataIndex()
+        # Retriever-specific derived indexes, rebuilt lazily in each process
+        self.indexes: Dict[str, Any] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["indexes"] = {}
+        return state
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def add_chunks(self, chunks: List[str], metadata: Dict[str, Any],
+                   locations: Optional[List[ChunkLocation]] = None) -> List[int]:
+        """Add chunks sharing the same metadata and return their ids"""
+        ids = []
+        for i, chunk in enumerate(chunks):
+            chunk_metadata = dict(metadata)
+            ids.append(self.metadata_index.add(chunk_metadata))
+            self.chunks.append(chunk)
+            self.tokens.append(self.tokenizer(chunk))
+            self.metadata.append(chunk_metadata)
+            self.locations.append(locations[i] if locations else ChunkLocation())
+        return ids
+
+    def add_section(self, text: str) -> int:
+        """Store a parent section text and return its id"""
+        self.sections.append(text)
+        return len(self.sections) - 1
+
+    def section_text(self, chunk_id: int) -> Optional[str]:
+        """Text of the section a chunk belongs to, if it has one"""
+        section_id = self.locations[chunk_id].section_id
+        return self.sections[section_id] if section_id is not None else None
+
+    def location(self, chunk_id: int) -> Dict[str, Any]:
+        """JSON-friendly location of a chunk for API responses"""
+        location = self.locations[chunk_id]
+        return {
+            "heading_path": list(location.heading_path),
+            "page_range": [location.page_start, location.page_end] if location.page_start is not None else None,
+            "section_id": location.section_id
+        }
+
+    def candidate_ids(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Chunk ids matching the filters, or None to search everything"""
+        return self.metadata_index.filter_ids(filters)
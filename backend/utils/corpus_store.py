@@ -0,0 +1,225 @@
+import os
+import re
+import pickle
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-host publishing is not serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATTERN = re.compile(r"^corpus-(\d+)\.pkl$")
+
+
+class CorpusSnapshotStore:
+    """Versioned corpus snapshots in a directory shared by all workers.
+
+    Each publish writes `corpus-<version>.pkl` and then atomically replaces
+    the `CURRENT` file holding the version number, so readers only ever see
+    a fully written snapshot.
+    """
+
+    def __init__(self, directory: str, keep: int = 3):
+        self.directory = directory
+        self.keep = keep
+        self.current_path = os.path.join(directory, "CURRENT")
+        self.lock_path = os.path.join(directory, ".lock")
+        os.makedirs(directory, exist_ok=True)
+
+    def snapshot_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"corpus-{version:08d}.pkl")
+
+    @contextmanager
+    def _publish_lock(self):
+        """Serialize publishers across processes"""
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def current_version(self) -> int:
+        """Latest published version, 0 if nothing was published yet"""
+        try:
+            with open(self.current_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def publish(self, corpus) -> int:
+        """Write a new snapshot, make it current and return its version"""
+        data = pickle.dumps(corpus, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._publish_lock():
+            version = self._publish_locked(data)
+        logger.info(f"Published corpus snapshot v{version} ({len(data)} bytes)")
+        return version
+
+    def publish_initial(self, build: Callable[[], object]) -> Optional[Tuple[object, int]]:
+        """Publish build()'s corpus as the first version, unless one exists.
+
+        The check and the publish happen under the publish lock, so when
+        several workers start at once only one of them runs build(). Returns
+        (corpus, version), or None if a version was already published.
+        """
+        with self._publish_lock():
+            if self.current_version():
+                return None
+            corpus = build()
+            data = pickle.dumps(corpus, protocol=pickle.HIGHEST_PROTOCOL)
+            version = self._publish_locked(data)
+        logger.info(f"Published initial corpus snapshot v{version} ({len(data)} bytes)")
+        return corpus, version
+
+    def _publish_locked(self, data: bytes) -> int:
+        version = self.current_version() + 1
+        self._write_atomic(self.snapshot_path(version), data)
+        self._write_atomic(self.current_path, str(version).encode())
+        self._prune(version)
+        return version
+
+    def load(self, version: int):
+        with open(self.snapshot_path(version), "rb") as f:
+            return pickle.load(f)
+
+    def versions(self) -> List[int]:
+        return sorted(
+            int(match.group(1))
+            for match in map(SNAPSHOT_PATTERN.match, os.listdir(self.directory))
+            if match
+        )
+
+    def _prune(self, current: int):
+        """Drop old snapshots; a few are kept for workers still loading them"""
+        for version in self.versions():
+            if version <= current - self.keep:
+                try:
+                    os.remove(self.snapshot_path(version))
+                except OSError:
+                    pass
+
+
+class SharedCorpus:
+    """This worker's view of the corpus, hot-swapped to the newest snapshot.
+
+    Without a store it just holds the corpus in memory (single process).
+    With a store, `pinned()` compares the published version counter and,
+    when another worker published a newer one, loads it before returning,
+    so a worker never answers from an older version than the one published
+    before the request. One caller unpickles the snapshot while concurrent
+    callers wait for it; the web app calls `pinned()` from the threadpool
+    whenever `stale()` says a load is due, so the event loop never blocks.
+    """
+
+    def __init__(self, factory: Callable[[], object], store: Optional[CorpusSnapshotStore] = None):
+        self.store = store
+        # (corpus, version), replaced as one reference so the two always match
+        self._state = (factory(), 0)
+        self._lock = threading.Lock()
+        # Held while a snapshot is unpickled; later callers wait on it
+        self._load_lock = threading.Lock()
+        self.swaps = 0
+
+    @property
+    def version(self) -> int:
+        return self._state[1]
+
+    @property
+    def loaded(self) -> Tuple[object, int]:
+        """The (corpus, version) this worker holds now, without checking for a newer one"""
+        return self._state
+
+    def stale(self) -> bool:
+        """Whether a newer version was published than the one loaded here"""
+        return self.store is not None and self.store.current_version() > self.version
+
+    def current(self):
+        return self.pinned()[0]
+
+    def pinned(self) -> Tuple[object, int]:
+        """The newest corpus and its version, taken together; loads a newer snapshot first (blocking)"""
+        if self.stale():
+            with self._load_lock:
+                # Whoever held the lock may have loaded it already
+                latest = self.store.current_version()
+                if latest > self.version:
+                    self._swap(latest)
+        return self._state
+
+    def _swap(self, version: int):
+        try:
+            corpus = self.store.load(version)
+        except FileNotFoundError:
+            # Already pruned by a faster publisher; pick up the newest one
+            version = self.store.current_version()
+            corpus = self.store.load(version)
+        with self._lock:
+            # A publish from this worker may have overtaken the load
+            if version > self.version:
+                # Single reference assignment; in-flight requests keep their old object
+                self._state = (corpus, version)
+                self.swaps += 1
+                logger.info(f"Worker {os.getpid()} switched to corpus v{version} ({len(corpus)} chunks)")
+
+    def publish(self, corpus) -> int:
+        """Make a freshly built corpus current for this and every other worker.
+
+        Pickles the corpus when there is a store; call it off the event loop.
+        """
+        if self.store is None:
+            self._state = (corpus, self.version + 1)
+            return self.version
+        version = self.store.publish(corpus)
+        self._adopt(corpus, version)
+        return version
+
+    def publish_initial(self, build: Callable[[], object]) -> Optional[int]:
+        """Publish build()'s corpus unless a corpus was already published.
+
+        With a store only one worker runs build(), even if all start at
+        once. Returns the new version, or None if nothing was published.
+        """
+        if self.store is None:
+            if self.version:
+                return None
+            return self.publish(build())
+        published = self.store.publish_initial(build)
+        if published is None:
+            return None
+        corpus, version = published
+        self._adopt(corpus, version)
+        return version
+
+    def _adopt(self, corpus, version: int):
+        with self._lock:
+            if version > self.version:
+                self._state = (corpus, version)
+
+    def get_stats(self) -> dict:
+        return {
+            "version": self.version,
+            "shared": self.store is not None,
+            "swaps": self.swaps,
+            "pid": os.getpid()
+        }
@@ -1,56 +1,119 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import faiss
 import numpy as np
 import os
-from typing import List
+import tempfile
+import weakref
+from typing import List, Optional
 import requests
 import json
+from .backends import backends
 from .pdf_parser import DocumentParser
+from .splitters import recursive_chunk_text
+
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+
+# Supported vector storage types. "float16" halves and "int8" quarters the
+# resident size of the index; int8 uses FAISS's per-dimension scalar quantizer.
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+# "local" embeds offline with hashed n-grams (utils.local_embedding);
+# "huggingface" calls the Inference API per chunk
+EMBEDDING_BACKENDS = ("local", "huggingface")
+
+HF_MODEL_ID = "hf:all-MiniLM-L6-v2"
+HF_FEATURE_EXTRACTION_URL = "https://api-inference.huggingface.co/pipeline/feature-extraction/sentence-transformers/all-MiniLM-L6-v2"
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
 
 class EmbeddingManager:
-    def __init__(self):
+    def __init__(self, vector_dtype: str = "float32", vectors_path: Optional[str] = None,
+                 embedding_backend: str = "local"):
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {vector_dtype}")
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unsupported embedding backend: {embedding_backend}")
         self.parser = DocumentParser()
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
         self.index = None
         self.chunks = []
+        self.vector_dtype = vector_dtype
+        # Full-precision copy of quantized vectors, memory-mapped from disk and
+        # only touched when rescoring a shortlist. A vectors_path is managed by
+        # the caller; without one a temporary file is used, deleted when the
+        # index is replaced or the manager is garbage collected
+        self.vectors_path = vectors_path
+        self.full_vectors = None
+        self._temp_vectors: Optional[weakref.finalize] = None
+        self.embedding_backend = embedding_backend
+        # The local model embeds chunks offline; with the remote backend it
+        # re-embeds the whole corpus if any API call fails
+        self.embedding_model = backends.resolve("embedder", "local")(dimension=EMBEDDING_DIM)
+        # Backend whose vector space the current index is in; queries must be
+        # embedded by the same one (see encode_queries)
+        self.index_backend = embedding_backend
+        self.model_id = self.embedding_model.model_id if embedding_backend == "local" else HF_MODEL_ID
     
     def chunk_text(self, text: str) -> List[str]:
         """Split text into manageable chunks"""
-        chunks = self.text_splitter.split_text(text)
-        return chunks
+        return recursive_chunk_text(text, chunk_size=1000, chunk_overlap=200)
+    
+    def _use_backend(self, backend: str):
+        self.index_backend = backend
+        self.model_id = self.embedding_model.model_id if backend == "local" else HF_MODEL_ID
+    
+    def generate_embeddings(self, chunks: List[str]) -> np.ndarray:
+        """Embed chunks with the configured backend"""
+        if self.embedding_backend == "huggingface":
+            embeddings = self._generate_remote_embeddings(chunks)
+            if embeddings is not None:
+                self._use_backend("huggingface")
+                return embeddings
+            # Local and API vectors live in different spaces, so one failed
+            # call means the whole index (and its queries) goes local
+            print("Warning: Hugging Face API failed for some chunks; embedding the whole corpus locally")
+        self._use_backend("local")
+        print(f"Generating embeddings locally ({self.embedding_model.model_id})...")
+        return self.embedding_model.encode(chunks)
     
-    def generate_embeddings(self, chunks: List[str]) -> List[List[float]]:
-        """Generate embeddings using Hugging Face Inference API - FREE"""
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries in the vector space of the current index"""
+        if self.index_backend == "huggingface":
+            embeddings = self._generate_remote_embeddings(queries)
+            if embeddings is None:
+                raise RuntimeError("Hugging Face API failed to embed the query")
+            return embeddings
+        return self.embedding_model.encode(queries)
+    
+    def _remote_embedding(self, text: str) -> Optional[list]:
+        # Using all-MiniLM-L6-v2 model via Hugging Face Inference API
+        response = requests.post(
+            HF_FEATURE_EXTRACTION_URL,
+            headers={"Authorization": "Bearer hf_your_token_here"},  # Optional for public models
+            json={"inputs": text, "options": {"wait_for_model": True}}
+        )
+        embedding = response.json() if response.status_code == 200 else None
+        return embedding[0] if isinstance(embedding, list) and len(embedding) > 0 else None
+    
+    def _generate_remote_embeddings(self, chunks: List[str]) -> Optional[np.ndarray]:
+        """Generate embeddings using Hugging Face Inference API - FREE; None if any call fails"""
         print("Generating embeddings using Hugging Face API...")
-        embeddings = []
+        # Rows are written straight into a preallocated matrix instead of
+        # building a list of Python float lists first
+        embeddings = np.empty((len(chunks), EMBEDDING_DIM), dtype=np.float32)
         
         for i, chunk in enumerate(chunks):
             try:
-                # Using all-MiniLM-L6-v2 model via Hugging Face Inference API
-                response = requests.post(
-                    "https://api-inference.huggingface.co/pipeline/feature-extraction/sentence-transformers/all-MiniLM-L6-v2",
-                    headers={"Authorization": "Bearer hf_your_token_here"},  # Optional for public models
-                    json={"inputs": chunk, "options": {"wait_for_model": True}}
-                )
-                
-                if response.status_code == 200:
-                    embedding = response.json()
-                    if isinstance(embedding, list) and len(embedding) > 0:
-                        embeddings.append(embedding[0])
-                    else:
-                        # Fallback: simple random embeddings (for testing)
-                        embeddings.append(np.random.randn(384).tolist())
-                else:
-                    # Fallback for free usage without API key
-                    embeddings.append(self._create_simple_embedding(chunk))
-                    
+                embedding = self._remote_embedding(chunk)
             except Exception as e:
-                print(f"Warning: Using fallback embedding for chunk {i}: {e}")
-                embeddings.append(self._create_simple_embedding(chunk))
+                print(f"Warning: Hugging Face API failed for chunk {i}: {e}")
+                return None
+            if embedding is None:
+                print(f"Warning: Hugging Face API returned no embedding for chunk {i}")
+                return None
+            embeddings[i] = embedding
             
             # Progress indicator
             if (i + 1) % 10 == 0:
@@ -58,34 +121,74 @@ class EmbeddingManager:
         
         return embeddings
     
-    def _create_simple_embedding(self, text: str) -> List[float]:
-        """Create a simple embedding fallback when API fails"""
-        # Simple hash-based embedding for fallback (not semantic, but works)
-        import hashlib
-        hash_obj = hashlib.md5(text.encode())
-        hash_hex = hash_obj.hexdigest()
+    def create_vector_store(self, embeddings: np.ndarray):
+        """Create FAISS vector store, optionally scalar-quantized"""
+        import faiss
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dimension = embeddings.shape[1]
         
-        # Convert hash to 384-dimensional vector (matching all-MiniLM-L6-v2)
-        embedding = []
-        for i in range(0, min(384 * 8, len(hash_hex)), 8):
-            hex_val = hash_hex[i:i+8]
-            try:
-                num = int(hex_val, 16) / 0xFFFFFFFF
-            except:
-                num = 0.5
-            embedding.append(num)
+        if self.vector_dtype == "float32":
+            self.index = faiss.IndexFlatL2(dimension)
+            self.full_vectors = None
+            self._release_temp_vectors()
+        else:
+            if self.vector_dtype == "float16":
+                quantizer_type = faiss.ScalarQuantizer.QT_fp16
+            else:
+                # QT_8bit learns a min/range per dimension during training
+                quantizer_type = faiss.ScalarQuantizer.QT_8bit
+            self.index = faiss.IndexScalarQuantizer(dimension, quantizer_type, faiss.METRIC_L2)
+            if not self.index.is_trained:
+                self.index.train(embeddings)
+            self._store_full_vectors(embeddings)
+        
+        self.index.add(embeddings)
+    
+    def _store_full_vectors(self, embeddings: np.ndarray):
+        """Write full-precision vectors to a memory-mapped file for rescoring"""
+        if not self.vectors_path or self._temp_vectors is not None:
+            # A fresh temporary file per index, so searches still reading the
+            # previous index's mapping never see it truncated
+            self._release_temp_vectors()
+            fd, self.vectors_path = tempfile.mkstemp(prefix="embeddings_", suffix=".f32")
+            os.close(fd)
+            self._temp_vectors = weakref.finalize(self, _remove_file, self.vectors_path)
         
-        # Pad if needed
-        while len(embedding) < 384:
-            embedding.append(0.0)
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='w+', shape=embeddings.shape)
+        vectors[:] = embeddings
+        vectors.flush()
+        del vectors
         
-        return embedding[:384]
+        self.full_vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=embeddings.shape)
     
-    def create_vector_store(self, embeddings: List[List[float]]):
-        """Create FAISS vector store"""
-        dimension = len(embeddings[0])
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(np.array(embeddings).astype('float32'))
+    def _release_temp_vectors(self):
+        """Delete the temporary vectors file of the previous index, if this manager created one"""
+        if self._temp_vectors is not None:
+            self.full_vectors = None
+            self._temp_vectors()
+            self._temp_vectors = None
+            self.vectors_path = None
+    
+    def rescore(self, query_vector: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Exact L2 distances between the query and the given rows in full precision"""
+        if self.full_vectors is None:
+            rows = np.vstack([self.index.reconstruct(int(i)) for i in ids])
+        else:
+            # Read rows in file order, then restore the caller's order
+            order = np.argsort(ids)
+            rows = np.empty((len(ids), self.full_vectors.shape[1]), dtype=np.float32)
+            rows[order] = self.full_vectors[ids[order]]
+        
+        diff = rows - query_vector.reshape(1, -1)
+        return np.einsum('ij,ij->i', diff, diff)
+    
+    def vector_memory_bytes(self) -> int:
+        """Resident size of the stored vectors"""
+        if self.index is None:
+            return 0
+        if self.vector_dtype == "float32":
+            return self.index.ntotal * self.index.d * 4
+        return self.index.ntotal * self.index.code_size
     
     def process_documents(self, file_paths: List[str]):
         """Process multiple documents and create embeddings"""
@@ -116,9 +219,15 @@ class EmbeddingManager:
     def save_index(self, file_path: str):
         """Save FAISS index to file"""
         if self.index:
+            import faiss
             faiss.write_index(self.index, file_path)
     
     def load_index(self, file_path: str, chunks: List[str]):
         """Load FAISS index from file"""
+        import faiss
         self.index = faiss.read_index(file_path)
-        self.chunks = chunks
\ No newline at end of file
+        self.chunks = chunks
+        
+        if self.vector_dtype != "float32" and self.vectors_path and os.path.exists(self.vectors_path):
+            shape = (self.index.ntotal, self.index.d)
+            self.full_vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=shape)
@@ -0,0 +1,45 @@
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    # orjson is a declared requirement; the stdlib encoder only keeps
+    # bare checkouts (scripts, tests) working and is several times slower
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Encode the non-JSON values that turn up in metadata and stats"""
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    if hasattr(obj, "tolist"):  # NumPy arrays and scalars
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    """UTF-8 JSON bytes of obj (orjson, or the slower stdlib fallback)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_line(obj: Any) -> bytes:
+    """One NDJSON line"""
+    return dumps(obj) + b"\n"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with `dumps`.
+
+    Returned directly from a handler it also skips FastAPI's
+    jsonable_encoder pass, which walks (and copies) the whole payload;
+    the content must then be plain JSON types.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,106 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+from .highlight import STOPWORDS
+from .reranker import tokenize
+
+# Sentence ends: terminal punctuation followed by whitespace, or a line break
+# (list items and table rows in answers are usually one claim per line)
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+LIST_MARKER = re.compile(r"(?:[-*•]|\d+[.)])\s+")
+
+# Answers that decline to answer make no claim to check
+NO_CLAIM_MARKERS = ("not contain enough information", "no relevant information")
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the sentences of text, list markers excluded"""
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    sentences = []
+    for start, end in spans:
+        marker = LIST_MARKER.match(text, start, end)
+        if marker:
+            start = marker.end()
+        if text[start:end].strip():
+            sentences.append((start, end))
+    return sentences
+
+
+def content_terms(tokens: Sequence[str]) -> List[str]:
+    return [token for token in tokens if token not in STOPWORDS]
+
+
+def bigrams(tokens: Sequence[str]) -> set:
+    return set(zip(tokens, tokens[1:]))
+
+
+class GroundingChecker:
+    """Scores how well each answer sentence is supported by the retrieved sources.
+
+    A sentence's support against a source is a blend of the share of its
+    content terms found in the source and the share of its word bigrams
+    found there (which rewards copied phrasing and keeps number/unit pairs
+    together); its score is the best over the sources. No model call, so a
+    typical answer is checked in well under a millisecond per source.
+    """
+
+    def __init__(self, threshold: float = 0.5, phrase_weight: float = 0.4, min_terms: int = 2):
+        self.threshold = threshold
+        self.phrase_weight = phrase_weight
+        self.min_terms = min_terms
+
+    def check(self, answer: str, sources: Sequence[Tuple[int, str]]) -> dict:
+        """Per-sentence support of answer against (source_id, text) pairs"""
+        indexed = []
+        for source_id, text in sources:
+            tokens = tokenize(text)
+            indexed.append((source_id, frozenset(tokens), bigrams(tokens)))
+
+        sentences = []
+        for start, end in split_sentences(answer):
+            sentence = answer[start:end]
+            score, source_ids = self.score_sentence(sentence, indexed)
+            sentences.append({
+                "start": start,
+                "end": end,
+                "text": sentence,
+                "score": round(score, 3) if score is not None else None,
+                "supported": score >= self.threshold if score is not None else None,
+                "source_ids": source_ids
+            })
+
+        checked = [sentence for sentence in sentences if sentence["score"] is not None]
+        supported = sum(1 for sentence in checked if sentence["supported"])
+        return {
+            "score": round(sum(sentence["score"] for sentence in checked) / len(checked), 3) if checked else None,
+            "supported_sentences": supported,
+            "unsupported_sentences": len(checked) - supported,
+            "threshold": self.threshold,
+            "sentences": sentences
+        }
+
+    def score_sentence(self, sentence: str, indexed: List[Tuple[int, frozenset, set]]) -> Tuple[Optional[float], List[int]]:
+        """Best support over the sources and the ids of the sources that reach the threshold, best first"""
+        lowered = sentence.lower()
+        if any(marker in lowered for marker in NO_CLAIM_MARKERS):
+            return None, []
+        tokens = tokenize(sentence)
+        terms = set(content_terms(tokens))
+        if len(terms) < self.min_terms:
+            return None, []
+        pairs = bigrams(tokens)
+
+        scores: Dict[int, float] = {}
+        for source_id, source_terms, source_pairs in indexed:
+            coverage = len(terms & source_terms) / len(terms)
+            phrase = len(pairs & source_pairs) / len(pairs) if pairs else coverage
+            scores[source_id] = (1 - self.phrase_weight) * coverage + self.phrase_weight * phrase
+        if not scores:
+            return 0.0, []
+        ranked = sorted(scores, key=lambda source_id: -scores[source_id])
+        return scores[ranked[0]], [source_id for source_id in ranked if scores[source_id] >= self.threshold]
@@ -0,0 +1,59 @@
+import re
+from typing import Iterable, List, Tuple
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Too common to be worth highlighting
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how in is it of on or that the this
+to was were what when where which who why will with do does did can you your
+about its it they them their these those there more also tell me
+""".split())
+
+
+def query_terms(query: str) -> frozenset:
+    """Lowercase query words worth highlighting"""
+    return frozenset(word for word in WORD_PATTERN.findall(query.lower()) if word not in STOPWORDS)
+
+
+def highlight_spans(text: str, terms: Iterable[str]) -> List[Tuple[int, int]]:
+    """Character (start, end) spans of query-term matches; adjacent matches are merged into one span"""
+    terms = frozenset(terms)
+    spans: List[List[int]] = []
+    for match in WORD_PATTERN.finditer(text):
+        if match.group().lower() not in terms:
+            continue
+        if spans and text[spans[-1][1]:match.start()].isspace():
+            spans[-1][1] = match.end()
+        else:
+            spans.append([match.start(), match.end()])
+    return [(start, end) for start, end in spans]
+
+
+def snippet_window(text: str, spans: List[Tuple[int, int]], width: int) -> Tuple[int, int]:
+    """(start, end) of the `width`-character window containing the most highlight spans.
+
+    The window keeps a little leading context before its first match and is
+    trimmed to word boundaries when it doesn't reach the ends of the text.
+    """
+    length = len(text)
+    if length <= width:
+        return 0, length
+
+    best_count, best_start = 0, 0
+    last = 0
+    for first, (span_start, _) in enumerate(spans):
+        while last < len(spans) and spans[last][1] <= span_start + width:
+            last += 1
+        if last - first > best_count:
+            best_count, best_start = last - first, span_start
+
+    start = max(0, min(best_start - width // 5, length - width))
+    end = start + width
+    if start > 0:
+        boundary = text.find(" ", start, best_start if best_count else end)
+        start = boundary + 1 if boundary != -1 else start
+    if end < length:
+        boundary = text.rfind(" ", start, end)
+        end = boundary if boundary > start else end
+    return start, end
@@ -0,0 +1,47 @@
+from typing import List
+from .corpus import tokenize_words
+from .query_cache import query_cache
+
+# Query token sets live in the shared query cache under this model id
+KEYWORD_MODEL_ID = "keyword"
+
+
+def simple_retrieve(query: str, chunks: List[str], k: int = 3, chunk_tokens: List[frozenset] = None,
+                    candidate_ids=None) -> List[tuple]:
+    """Simple keyword-based retrieval with proper scoring.
+
+    Returns (chunk, score, chunk_id) tuples. When candidate_ids is given only
+    those chunks are scored, so filtered searches touch just the subset.
+    """
+    query_words = query_cache.get_or_compute(query, KEYWORD_MODEL_ID, tokenize_words)
+    scored_chunks = []
+
+    ids = range(len(chunks)) if candidate_ids is None else candidate_ids
+    for i in ids:
+        chunk = chunks[i]
+        chunk_words = chunk_tokens[i] if chunk_tokens else tokenize_words(chunk)
+        common_words = query_words.intersection(chunk_words)
+
+        # Calculate similarity score (0 to 1)
+        if query_words:
+            score = len(common_words) / len(query_words)
+        else:
+            score = 0.1  # Default score for empty query
+
+        # Ensure score is between 0 and 1
+        score = max(0.1, min(1.0, score))
+        scored_chunks.append((chunk, score, int(i)))
+
+    # Sort by score and return top k
+    scored_chunks.sort(key=lambda x: x[1], reverse=True)
+    return scored_chunks[:k]
+
+
+def retrieve_from_corpus(query: str, corpus, k: int = 3, candidate_ids=None) -> List[tuple]:
+    """Retriever backend: keyword overlap against the corpus' cached token sets"""
+    return simple_retrieve(query, corpus.chunks, k=k, chunk_tokens=corpus.tokens, candidate_ids=candidate_ids)
+
+
+def warm_up(queries: List[str], top_n: int = 100) -> int:
+    """Precompute token sets for the most frequent historical queries"""
+    return query_cache.warm_up(queries, KEYWORD_MODEL_ID, tokenize_words, top_n)
@@ -0,0 +1,67 @@
+import numpy as np
+from typing import Sequence
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Hashed n-gram vocabulary the projection maps from
+N_FEATURES = 2 ** 18
+# Nonzeros per projection row; each n-gram adds +/-1 to this many output dims
+PROJECTION_DENSITY = 8
+PROJECTION_SEED = 20240601
+
+
+class HashedNgramEmbedder:
+    """Offline embeddings from hashed word and character n-grams.
+
+    Texts are hashed (MurmurHash3, so identical across processes and
+    machines) into word uni/bigram and character 3-5 gram counts, weighted
+    sublinearly and reduced to `dimension` dims by a fixed sparse random
+    projection. Cosine similarity then tracks shared wording and sub-word
+    overlap: not semantic like a sentence-transformer, but it runs on CPU,
+    needs no network or model download, and is vectorized over a batch.
+    Exposes `encode` like a sentence-transformers model, so the FAISS
+    Retriever can use it for queries.
+    """
+
+    def __init__(self, dimension: int = 384, n_features: int = N_FEATURES,
+                 density: int = PROJECTION_DENSITY, seed: int = PROJECTION_SEED):
+        self.dimension = dimension
+        self.n_features = n_features
+        self.model_id = f"hashed-ngram:{dimension}:{n_features}:{density}:{seed}"
+        self.word_vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), alternate_sign=False, norm=None
+        )
+        self.char_vectorizer = HashingVectorizer(
+            n_features=n_features, analyzer="char_wb", ngram_range=(3, 5), alternate_sign=False, norm=None
+        )
+        self.projection = self._projection_matrix(n_features, dimension, density, seed)
+
+    @staticmethod
+    def _projection_matrix(n_features: int, dimension: int, density: int, seed: int) -> sparse.csr_matrix:
+        """Sparse +/-1 projection; PCG64 output is stable across numpy versions and platforms"""
+        rng = np.random.Generator(np.random.PCG64(seed))
+        columns = rng.integers(0, dimension, size=(n_features, density), dtype=np.int32)
+        signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=(n_features, density))
+        rows = np.repeat(np.arange(n_features, dtype=np.int32), density)
+        matrix = sparse.csr_matrix((signs.ravel(), (rows, columns.ravel())), shape=(n_features, dimension))
+        matrix.sum_duplicates()
+        return matrix
+
+    def _features(self, texts: Sequence[str]) -> sparse.csr_matrix:
+        # Word n-grams carry most of the signal; char n-grams catch inflections and typos
+        counts = self.word_vectorizer.transform(texts) * 2.0 + self.char_vectorizer.transform(texts)
+        counts = counts.tocsr()
+        counts.data = np.log1p(counts.data)
+        return counts
+
+    def encode(self, texts: Sequence[str], batch_size: int = 256) -> np.ndarray:
+        """L2-normalized float32 embeddings, one row per text (all-zero for empty text)"""
+        if isinstance(texts, str):
+            texts = [texts]
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            projected = np.asarray((self._features(batch) @ self.projection).todense(), dtype=np.float32)
+            norms = np.linalg.norm(projected, axis=1, keepdims=True)
+            embeddings[start:start + len(batch)] = projected / np.maximum(norms, 1e-12)
+        return embeddings
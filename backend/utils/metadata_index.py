@@ -0,0 +1,164 @@
+import numpy as np
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Operators accepted in a field's filter dict, e.g. {"year": {"gte": 2025}}
+RANGE_OPERATORS = {
+    "gt": lambda value, bound: value > bound,
+    "gte": lambda value, bound: value >= bound,
+    "lt": lambda value, bound: value < bound,
+    "lte": lambda value, bound: value <= bound,
+}
+# Value operators: {"in": [...]}, {"eq": value}, {"not": condition}
+VALUE_OPERATORS = {"in", "eq", "not"}
+
+
+class _Postings:
+    """Chunk ids of one (field, value) pair.
+
+    Kept as a sorted id array while the value is rare, and switched to a
+    packed bitmap (one bit per chunk) once the ids would take more space,
+    so high-cardinality fields such as page or uploaded_at cost a few bytes
+    per chunk instead of a bitmap per distinct value.
+    """
+
+    __slots__ = ("ids", "count", "bits")
+
+    def __init__(self):
+        self.ids = np.empty(4, dtype=np.int32)
+        self.count = 0
+        self.bits: Optional[np.ndarray] = None
+
+    def add(self, chunk_id: int, capacity: int):
+        if self.bits is not None:
+            self.bits[chunk_id >> 3] |= 0x80 >> (chunk_id & 7)
+            return
+        if self.count == len(self.ids):
+            # 4 bytes per id against capacity / 8 bytes for the bitmap
+            if self.count * 32 >= capacity:
+                dense = np.zeros(capacity, dtype=bool)
+                dense[self.ids[:self.count]] = True
+                dense[chunk_id] = True
+                self.bits = np.packbits(dense)
+                self.ids = None
+                return
+            self.ids = np.resize(self.ids, self.count * 2)
+        # Chunk ids arrive in increasing order, so the array stays sorted
+        self.ids[self.count] = chunk_id
+        self.count += 1
+
+    def grow(self, capacity: int):
+        if self.bits is not None:
+            grown = np.zeros(capacity // 8, dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+
+    def mark(self, mask: np.ndarray):
+        """Set the bits of these chunk ids in a boolean mask over the first len(mask) chunks"""
+        if self.bits is not None:
+            mask |= np.unpackbits(self.bits, count=len(mask)).view(bool)
+        else:
+            mask[self.ids[:self.count]] = True
+
+
+class MetadataIndex:
+    """Bitmap index over per-chunk metadata.
+
+    Every (field, value) pair owns the postings of its chunk ids (see
+    _Postings), so a filter expression resolves to a candidate set with a
+    few vectorized AND/OR operations before any scoring happens. List
+    values (e.g. tags) are posted under each element.
+    """
+
+    def __init__(self):
+        self.size = 0
+        # Always a multiple of 8, so packed bitmaps cover whole bytes
+        self._capacity = 0
+        self._postings: Dict[str, Dict[Any, _Postings]] = {}
+
+    def add(self, metadata: Dict[str, Any]) -> int:
+        """Index one chunk's metadata and return its chunk id"""
+        chunk_id = self.size
+        self._ensure_capacity(chunk_id + 1)
+        self.size += 1
+
+        for field, value in metadata.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            field_postings = self._postings.setdefault(field, {})
+            for item in values:
+                if item is None or isinstance(item, (dict, list)):
+                    continue
+                postings = field_postings.get(item)
+                if postings is None:
+                    postings = field_postings[item] = _Postings()
+                postings.add(chunk_id, self._capacity)
+        return chunk_id
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self._capacity:
+            return
+        new_capacity = -(-max(needed, self._capacity * 2, 1024) // 8) * 8
+        for field_postings in self._postings.values():
+            for postings in field_postings.values():
+                postings.grow(new_capacity)
+        self._capacity = new_capacity
+
+    def _field_mask(self, field: str, condition: Any) -> np.ndarray:
+        field_postings = self._postings.get(field, {})
+        mask = np.zeros(self.size, dtype=bool)
+
+        if isinstance(condition, dict):
+            unknown = set(condition) - set(RANGE_OPERATORS) - VALUE_OPERATORS
+            if unknown:
+                raise ValueError(f"Unsupported filter operator for '{field}': {', '.join(sorted(unknown))}")
+            # All operators of one field must hold, e.g. {"gte": 2020, "not": 2021}
+            masks = []
+            if "in" in condition:
+                masks.append(self._field_mask(field, list(condition["in"])))
+            if "eq" in condition:
+                masks.append(self._field_mask(field, condition["eq"]))
+            if "not" in condition:
+                masks.append(~self._field_mask(field, condition["not"]))
+
+            bounds = [(RANGE_OPERATORS[op], bound) for op, bound in condition.items() if op in RANGE_OPERATORS]
+            if bounds or not masks:
+                for value, postings in field_postings.items():
+                    try:
+                        if all(check(value, bound) for check, bound in bounds):
+                            postings.mark(mask)
+                    except TypeError:
+                        continue  # value not comparable with the bound
+                masks.append(mask)
+            mask = masks[0]
+            for other in masks[1:]:
+                mask &= other
+            return mask
+
+        values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+        for value in values:
+            postings = field_postings.get(value)
+            if postings is not None:
+                postings.mark(mask)
+        return mask
+
+    def filter_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """AND together per-field conditions; None means no filtering"""
+        if not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        for field, condition in filters.items():
+            mask &= self._field_mask(field, condition)
+        return mask
+
+    def filter_ids(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Chunk ids matching the filters, or None when no filters are given"""
+        mask = self.filter_mask(filters)
+        if mask is None:
+            return None
+        return np.flatnonzero(mask)
+
+    def values(self, field: str) -> List[Any]:
+        """Distinct indexed values of a field"""
+        return list(self._postings.get(field, {}).keys())
@@ -0,0 +1,261 @@
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import requests
+from .rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Model ids containing these aren't chat-completion models
+NON_CHAT_MODEL_MARKERS = ("whisper", "tts", "guard", "embed")
+
+
+def fetch_models(api_base: str, api_key: str, timeout: float = 10) -> List[dict]:
+    """List the active chat models of an OpenAI-compatible API as {"id", "context_window"} dicts"""
+    response = requests.get(
+        f"{api_base}/models",
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=timeout
+    )
+    response.raise_for_status()
+    return [
+        {"id": model["id"], "context_window": model.get("context_window")}
+        for model in response.json().get("data", [])
+        if model.get("id") and model.get("active", True)
+        and not any(marker in model["id"].lower() for marker in NON_CHAT_MODEL_MARKERS)
+    ]
+
+
+class ModelStats:
+    """Per-model latency (EWMA) and failure tracking with a simple circuit breaker"""
+
+    def __init__(self, context_window: Optional[int] = None, alpha: float = 0.3):
+        self.context_window = context_window
+        self.alpha = alpha
+        self.latency_ms: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_success(self, latency_ms: float):
+        self.latency_ms = latency_ms if self.latency_ms is None else (
+            self.alpha * latency_ms + (1 - self.alpha) * self.latency_ms
+        )
+        self.successes += 1
+        self.consecutive_failures = 0
+
+    def record_failure(self, max_failures: int, cooldown_seconds: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= max_failures:
+            self.cooldown_until = time.monotonic() + cooldown_seconds
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def fits(self, tokens: int) -> bool:
+        return self.context_window is None or tokens <= self.context_window
+
+
+class ModelRouter:
+    """Routes LLM calls to the fastest healthy model that fits the prompt.
+
+    Candidates are the preferred models (or every discovered chat model when
+    no preference is given) whose context window fits the request. Healthy
+    models that haven't been measured yet come first (in preference order) so
+    each gets tried, then measured ones by observed latency, then ones whose
+    last call failed; models in failure cooldown are kept only as a last
+    resort. A failed call falls back to the next candidate, and with
+    hedge_after_ms set a second candidate is started when the first hasn't
+    answered in time — whichever succeeds first wins. The hedge timer starts
+    when the call starts running, not while it waits for a free worker.
+
+    RateLimitExceeded from the call is the scheduler shedding load, not a
+    model failure: it is re-raised without counting against the model or
+    trying another one. Hedged calls run on a pool of max_workers threads;
+    size it for twice the calls the scheduler lets run at once, so every
+    call can be hedged.
+    """
+
+    def __init__(self, preferred: List[str], discover: Callable[[], List[dict]] = None,
+                 discovery_ttl_seconds: float = 3600, hedge_after_ms: Optional[float] = None,
+                 max_failures: int = 3, cooldown_seconds: float = 30, max_workers: int = 8):
+        self.preferred = list(preferred)
+        self.discover = discover
+        self.discovery_ttl_seconds = discovery_ttl_seconds
+        self.hedge_after_ms = hedge_after_ms
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.models: Dict[str, ModelStats] = {model: ModelStats() for model in self.preferred}
+        self.discovered_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge") if hedge_after_ms else None
+        self.calls = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def refresh(self, force: bool = False):
+        """Re-discover models when the list is stale; keeps the current list if discovery fails"""
+        if self.discover is None:
+            return
+        now = time.monotonic()
+        if not force and self.discovered_at is not None and now - self.discovered_at < self.discovery_ttl_seconds:
+            return
+        self.discovered_at = now
+        try:
+            discovered = self.discover()
+        except Exception as e:
+            logger.warning(f"Model discovery failed, keeping {list(self.models)}: {e}")
+            return
+
+        available = {model["id"]: model.get("context_window") for model in discovered}
+        chosen = [model for model in self.preferred if model in available] if self.preferred else sorted(available)
+        if not chosen:
+            logger.warning(f"None of the preferred models {self.preferred} are available, keeping {list(self.models)}")
+            return
+        with self._lock:
+            self.models = {
+                model: self.models.get(model) or ModelStats()
+                for model in chosen
+            }
+            for model in chosen:
+                self.models[model].context_window = available[model]
+        logger.info(f"Routing across models: {chosen}")
+
+    def candidates(self, tokens: int) -> List[str]:
+        """Fallback chain for a request needing `tokens` of context"""
+        with self._lock:
+            fitting = [(model, stats) for model, stats in self.models.items() if stats.fits(tokens)]
+        order = {model: i for i, model in enumerate(self.preferred)}
+
+        def rank(item: Tuple[str, ModelStats]):
+            model, stats = item
+            measured = stats.latency_ms is not None
+            return (not stats.healthy(), stats.consecutive_failures > 0, measured, stats.latency_ms or 0.0,
+                    order.get(model, len(order)), model)
+
+        return [model for model, _ in sorted(fitting, key=rank)]
+
+    def fastest_latency_ms(self) -> Optional[float]:
+        """Observed latency of the fastest healthy model, None until one was measured"""
+        with self._lock:
+            latencies = [stats.latency_ms for stats in self.models.values()
+                         if stats.latency_ms is not None and stats.healthy()]
+        return min(latencies) if latencies else None
+
+    def _timed_call(self, model: str, call: Callable[[str], Any], running: Optional[threading.Event] = None) -> Any:
+        if running is not None:
+            running.set()
+        started = time.perf_counter()
+        try:
+            result = call(model)
+        except RateLimitExceeded:
+            raise
+        except Exception:
+            with self._lock:
+                self.models.setdefault(model, ModelStats()).record_failure(self.max_failures, self.cooldown_seconds)
+            raise
+        with self._lock:
+            self.models.setdefault(model, ModelStats()).record_success((time.perf_counter() - started) * 1000)
+        return result
+
+    def run(self, call: Callable[[str], Any], tokens: int) -> Tuple[str, Any]:
+        """Run call(model) along the fallback chain; returns (model, result) of the first success.
+
+        Raises the last error if every candidate fails.
+        """
+        self.refresh()
+        chain = self.candidates(tokens)
+        if not chain:
+            raise ValueError(f"No configured model fits a request of {tokens} tokens")
+        self.calls += 1
+
+        if self._executor is None:
+            last_error = None
+            for i, model in enumerate(chain):
+                if i:
+                    self.fallbacks += 1
+                    logger.warning(f"Falling back to {model} after: {last_error}")
+                try:
+                    return model, self._timed_call(model, call)
+                except RateLimitExceeded:
+                    raise
+                except Exception as e:
+                    last_error = e
+            raise last_error
+        return self._run_hedged(call, chain)
+
+    def _run_hedged(self, call: Callable[[str], Any], chain: List[str]) -> Tuple[str, Any]:
+        pending = {}
+        remaining = list(chain)
+        hedged = False
+        last_error = None
+
+        def launch():
+            model = remaining.pop(0)
+            running = threading.Event()
+            pending[self._executor.submit(self._timed_call, model, call, running)] = (model, running)
+
+        launch()
+        while pending:
+            can_hedge = not hedged and remaining and len(pending) == 1
+            if can_hedge:
+                # Time the primary from when a worker picks it up
+                running = next(iter(pending.values()))[1]
+                running.wait()
+            done, _ = wait(pending, timeout=self.hedge_after_ms / 1000 if can_hedge else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slow: race a second model against it
+                hedged = True
+                self.hedges += 1
+                launch()
+                continue
+            for future in done:
+                model, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except RateLimitExceeded as e:
+                    # Load shed: no fallback or further hedging; a call already running may still answer
+                    if not pending:
+                        raise
+                    remaining.clear()
+                    last_error = e
+                    continue
+                except Exception as e:
+                    last_error = e
+                    if not pending and remaining:
+                        self.fallbacks += 1
+                        logger.warning(f"Falling back to {remaining[0]} after: {e}")
+                        launch()
+                    continue
+                if hedged and model != chain[0]:
+                    self.hedge_wins += 1
+                # A slower loser keeps running; its latency still updates the stats
+                return model, result
+        raise last_error
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            models = {
+                model: {
+                    "latency_ms": round(stats.latency_ms, 1) if stats.latency_ms is not None else None,
+                    "successes": stats.successes,
+                    "failures": stats.failures,
+                    "healthy": stats.healthy(),
+                    "context_window": stats.context_window
+                }
+                for model, stats in self.models.items()
+            }
+        return {
+            "models": models,
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_after_ms": self.hedge_after_ms
+        }
@@ -0,0 +1,164 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+from .backends import backends
+
+logger = logging.getLogger(__name__)
+
+
+def tesseract_ocr(image: bytes) -> str:
+    """OCR a page image with Tesseract (requires pytesseract, Pillow and the tesseract binary).
+
+    Automatic page segmentation (psm 3) keeps text blocks and columns apart,
+    so multi-column scans come out in reading order rather than interleaved.
+    """
+    import io
+    import pytesseract
+    from PIL import Image
+    return pytesseract.image_to_string(Image.open(io.BytesIO(image)), config="--psm 3")
+
+
+def local_stub_ocr(image: bytes) -> str:
+    """Deterministic stand-in engine for tests and local runs without Tesseract.
+
+    Images starting with b"TEXT:" "contain" the text after the prefix; any
+    other image yields a placeholder naming its hash. OCR_STUB_DELAY_MS
+    simulates the per-page cost of a real engine.
+    """
+    delay_ms = float(os.getenv("OCR_STUB_DELAY_MS", "0"))
+    if delay_ms:
+        time.sleep(delay_ms / 1000)
+    if image.startswith(b"TEXT:"):
+        return image[5:].decode("utf-8", errors="ignore")
+    return f"[unrecognized scan {hashlib.sha256(image).hexdigest()[:12]}]"
+
+
+def run_engine(engine: str, image: bytes) -> str:
+    """Worker-process entry point: resolve the engine backend and OCR one image"""
+    return backends.resolve("ocr", engine)(image)
+
+
+class OCRCache:
+    """OCR results on disk keyed by engine, render settings and page-image hash"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, text: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self._path(key))
+
+
+class OCRStage:
+    """OCR for pages without a text layer, run in a bounded process pool.
+
+    Pages are identified by the hash of their rendered image, so re-ingesting
+    a document only OCRs pages whose content changed. At most `max_workers`
+    pages are OCR'd at once and at most twice that many rendered images are
+    held in memory, however long the document.
+    """
+
+    def __init__(self, engine: str, cache_dir: str = "ocr_cache", max_workers: int = 2, dpi: int = 200):
+        self.engine = engine
+        self.cache = OCRCache(cache_dir)
+        self.max_workers = max_workers
+        self.dpi = dpi
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pages_ocred = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.ocr_seconds = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking the server would copy its threads' locks and the loaded corpus
+                # into every worker; forkserver (spawn where missing) starts clean ones
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            return self._executor
+
+    def cache_key(self, image: bytes) -> str:
+        digest = hashlib.sha256(image).hexdigest()
+        return f"{self.engine}-{self.dpi}-{digest}"
+
+    def ocr_images(self, images: Iterable[Tuple[int, bytes]]) -> Dict[int, str]:
+        """OCR (page number, image bytes) pairs; returns page number -> text.
+
+        `images` may be a lazy generator; it is consumed only as fast as the
+        pool drains. Pages whose OCR fails map to an empty string.
+        """
+        results: Dict[int, str] = {}
+        pending = deque()
+        started = time.perf_counter()
+
+        def collect(block: bool):
+            while pending and (block or pending[0][2].done()):
+                page, key, future = pending.popleft()
+                try:
+                    text = future.result()
+                except Exception as e:
+                    self.failures += 1
+                    logger.warning(f"OCR failed for page {page}: {e}")
+                    results[page] = ""
+                    continue
+                self.cache.put(key, text)
+                self.pages_ocred += 1
+                results[page] = text
+
+        for page, image in images:
+            key = self.cache_key(image)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                results[page] = cached
+                continue
+            pending.append((page, key, self._pool().submit(run_engine, self.engine, image)))
+            collect(block=False)
+            if len(pending) >= self.max_workers * 2:
+                # Bound the rendered images held in memory: wait for the oldest page
+                pending[0][2].exception()
+                collect(block=False)
+        collect(block=True)
+
+        self.ocr_seconds += time.perf_counter() - started
+        return results
+
+    def get_stats(self) -> dict:
+        return {
+            "engine": self.engine,
+            "max_workers": self.max_workers,
+            "dpi": self.dpi,
+            "pages_ocred": self.pages_ocred,
+            "cache_hits": self.cache_hits,
+            "failures": self.failures,
+            "ocr_seconds": round(self.ocr_seconds, 2)
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
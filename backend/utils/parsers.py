@@ -0,0 +1,436 @@
+import csv
+import json
+import logging
+import os
+import re
+import zipfile
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+# Paragraphs longer than this are emitted in pieces so a file without blank
+# lines (or a giant HTML text node) never has to be held in memory whole
+MAX_BLOCK_CHARS = 8000
+READ_SIZE = 64 * 1024
+
+
+class Block(NamedTuple):
+    """A unit of parsed text and its place in the document structure.
+
+    `kind` is one of "heading", "paragraph", "list_item", "table_row", "code"
+    or "record"; headings carry their `level` (1 = top). `meta` holds
+    format-specific positions such as {"row": 12} for CSV rows.
+    """
+    text: str
+    kind: str = "paragraph"
+    page: Optional[int] = None
+    level: int = 0
+    meta: Optional[dict] = None
+
+
+# Extension / MIME type -> document format. "pdf" is parsed by the PDF_PARSER
+# backend; every other format is the "parser" backend of the same name.
+FORMATS_BY_EXTENSION = {
+    ".pdf": "pdf",
+    ".txt": "text",
+    ".md": "markdown",
+    ".markdown": "markdown",
+    ".html": "html",
+    ".htm": "html",
+    ".docx": "docx",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".eml": "email",
+}
+
+FORMATS_BY_MIME_TYPE = {
+    "application/pdf": "pdf",
+    "text/plain": "text",
+    "text/markdown": "markdown",
+    "text/x-markdown": "markdown",
+    "text/html": "html",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "text/csv": "csv",
+    "application/jsonl": "jsonl",
+    "application/x-ndjson": "jsonl",
+    "application/x-jsonlines": "jsonl",
+    "message/rfc822": "email",
+}
+
+
+def detect_format(filename: str, content_type: Optional[str] = None) -> Optional[str]:
+    """Document format of a file by extension, falling back to its MIME type; None if unsupported"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in FORMATS_BY_EXTENSION:
+        return FORMATS_BY_EXTENSION[extension]
+    if content_type:
+        return FORMATS_BY_MIME_TYPE.get(content_type.split(";")[0].strip().lower())
+    return None
+
+
+def split_long(text: str, limit: int = MAX_BLOCK_CHARS) -> Iterator[str]:
+    """Yield `text` in pieces of at most `limit` characters, cut at whitespace where possible"""
+    while len(text) > limit:
+        cut = text.rfind(" ", 0, limit)
+        cut = cut if cut > 0 else limit
+        yield text[:cut]
+        text = text[cut:].lstrip()
+    if text:
+        yield text
+
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def paragraph_blocks(text: str, page: Optional[int] = None) -> Iterator[Block]:
+    """Blocks of text whose paragraphs are separated by blank lines (e.g. a PDF page)"""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = " ".join(paragraph.split())
+        for piece in split_long(paragraph):
+            yield Block(piece, page=page)
+
+
+def describe_row(header: List[str], row: List[str]) -> str:
+    """Render a table row as "column: value" pairs so every row stands on its own"""
+    if not header:
+        return " | ".join(cell for cell in row if cell)
+    pairs = []
+    for i, cell in enumerate(row):
+        if cell:
+            name = header[i] if i < len(header) and header[i] else f"column {i + 1}"
+            pairs.append(f"{name}: {cell}")
+    return " | ".join(pairs)
+
+
+def parse_text(file_path: str) -> Iterator[Block]:
+    """Plain text, one paragraph (blank-line separated) at a time"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        paragraph: List[str] = []
+        size = 0
+        for line in f:
+            line = line.strip()
+            if line:
+                paragraph.append(line)
+                size += len(line) + 1
+            if paragraph and (not line or size > MAX_BLOCK_CHARS):
+                for piece in split_long(" ".join(paragraph)):
+                    yield Block(piece)
+                paragraph, size = [], 0
+        if paragraph:
+            for piece in split_long(" ".join(paragraph)):
+                yield Block(piece)
+
+
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+MARKDOWN_LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+(.*)$")
+MARKDOWN_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+
+
+def parse_markdown(file_path: str) -> Iterator[Block]:
+    """Markdown headings, paragraphs, list items, table rows and fenced code, line by line"""
+    paragraph: List[str] = []
+    code: List[str] = []
+    in_code = False
+    table_header: Optional[List[str]] = None
+
+    def flush_paragraph() -> Iterator[Block]:
+        if paragraph:
+            for piece in split_long(" ".join(paragraph)):
+                yield Block(piece)
+            paragraph.clear()
+
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        for raw_line in f:
+            line = raw_line.rstrip("\n")
+            stripped = line.strip()
+
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                if in_code:
+                    for piece in split_long("\n".join(code)):
+                        yield Block(piece, "code")
+                    code.clear()
+                else:
+                    yield from flush_paragraph()
+                in_code = not in_code
+                continue
+            if in_code:
+                code.append(line)
+                continue
+
+            if stripped.startswith("|"):
+                yield from flush_paragraph()
+                if MARKDOWN_TABLE_SEPARATOR.match(stripped):
+                    continue
+                cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+                if table_header is None:
+                    table_header = cells
+                else:
+                    yield Block(describe_row(table_header, cells), "table_row")
+                continue
+            table_header = None
+
+            heading = MARKDOWN_HEADING.match(stripped)
+            if heading:
+                yield from flush_paragraph()
+                yield Block(heading.group(2), "heading", level=len(heading.group(1)))
+                continue
+
+            item = MARKDOWN_LIST_ITEM.match(line)
+            if item:
+                yield from flush_paragraph()
+                yield Block(item.group(1).strip(), "list_item")
+                continue
+
+            if stripped:
+                paragraph.append(stripped)
+                if sum(len(part) for part in paragraph) > MAX_BLOCK_CHARS:
+                    yield from flush_paragraph()
+            else:
+                yield from flush_paragraph()
+
+    if code:
+        yield Block("\n".join(code), "code")
+    yield from flush_paragraph()
+
+
+class _HTMLBlockParser(HTMLParser):
+    """Collects blocks from HTML fed incrementally; drain `blocks` after each feed"""
+
+    HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+    SKIPPED = {"script", "style", "head", "noscript", "template"}
+    BREAKS = {"p", "div", "section", "article", "blockquote", "pre", "ul", "ol", "table", "br", "hr", "body"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Block] = []
+        self.text: List[str] = []
+        self.skip_depth = 0
+        self.row: Optional[List[str]] = None
+        self.cell: Optional[List[str]] = None
+        self.table_header: Optional[List[str]] = None
+        self.row_is_header = False
+
+    def flush(self, kind: str = "paragraph", level: int = 0):
+        text = " ".join("".join(self.text).split())
+        self.text.clear()
+        for piece in split_long(text):
+            self.blocks.append(Block(piece, kind, level=level))
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self.skip_depth += 1
+        elif self.skip_depth:
+            return
+        elif tag in self.HEADINGS or tag == "li" or tag in self.BREAKS:
+            if self.cell is None:
+                self.flush()
+        elif tag == "tr":
+            self.flush()
+            self.row, self.row_is_header = [], False
+        elif tag in ("td", "th") and self.row is not None:
+            self.cell = []
+            self.row_is_header = self.row_is_header or tag == "th"
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif self.skip_depth:
+            return
+        elif tag in ("td", "th") and self.cell is not None:
+            self.row.append(" ".join("".join(self.cell).split()))
+            self.cell = None
+        elif tag == "tr" and self.row is not None:
+            if self.row_is_header and self.table_header is None:
+                self.table_header = self.row
+            elif any(self.row):
+                self.blocks.append(Block(describe_row(self.table_header or [], self.row), "table_row"))
+            self.row = None
+        elif tag == "table":
+            self.table_header = None
+        elif tag in self.HEADINGS:
+            self.flush("heading", self.HEADINGS[tag])
+        elif tag == "li":
+            self.flush("list_item")
+        elif tag in self.BREAKS and self.cell is None:
+            self.flush()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.cell is not None:
+            self.cell.append(data)
+        else:
+            self.text.append(data)
+            if len(self.text) > 64 and sum(len(part) for part in self.text) > MAX_BLOCK_CHARS:
+                self.flush()
+
+
+def html_blocks(chunks: Iterable[str]) -> Iterator[Block]:
+    """Blocks of an HTML document given as an iterable of text chunks"""
+    parser = _HTMLBlockParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.blocks
+        parser.blocks.clear()
+    parser.close()
+    parser.flush()
+    yield from parser.blocks
+
+
+def parse_html(file_path: str) -> Iterator[Block]:
+    """HTML headings, paragraphs, list items and table rows, read in fixed-size pieces"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        yield from html_blocks(iter(lambda: f.read(READ_SIZE), ""))
+
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_HEADING_STYLE = re.compile(r"^heading\s*(\d)$", re.IGNORECASE)
+
+
+def _docx_paragraph(element) -> Tuple[str, str, int]:
+    """(text, kind, level) of a w:p element"""
+    text = "".join(
+        node.text or "" if node.tag == WORD_NAMESPACE + "t" else "\t" if node.tag == WORD_NAMESPACE + "tab" else "\n"
+        for node in element.iter()
+        if node.tag in (WORD_NAMESPACE + "t", WORD_NAMESPACE + "tab", WORD_NAMESPACE + "br")
+    ).strip()
+    properties = element.find(WORD_NAMESPACE + "pPr")
+    if properties is None:
+        return text, "paragraph", 0
+    style = properties.find(WORD_NAMESPACE + "pStyle")
+    style_name = style.get(WORD_NAMESPACE + "val", "") if style is not None else ""
+    heading = DOCX_HEADING_STYLE.match(style_name)
+    if heading:
+        return text, "heading", int(heading.group(1))
+    if style_name.lower() == "title":
+        return text, "heading", 1
+    if properties.find(WORD_NAMESPACE + "numPr") is not None or style_name.lower().startswith("list"):
+        return text, "list_item", 0
+    return text, "paragraph", 0
+
+
+def parse_docx(file_path: str) -> Iterator[Block]:
+    """Word paragraphs (with heading styles) and table rows, streamed from word/document.xml"""
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as document:
+        table_depth = 0
+        row: Optional[List[str]] = None
+        cell: List[str] = []
+        table_header: Optional[List[str]] = None
+        for event, element in ElementTree.iterparse(document, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == WORD_NAMESPACE + "tbl":
+                    table_depth += 1
+                    if table_depth == 1:
+                        table_header = None
+                elif tag == WORD_NAMESPACE + "tr" and table_depth == 1:
+                    row = []
+                elif tag == WORD_NAMESPACE + "tc" and table_depth == 1:
+                    cell = []
+                continue
+
+            if tag == WORD_NAMESPACE + "p":
+                text, kind, level = _docx_paragraph(element)
+                if table_depth:
+                    cell.append(text)
+                elif text:
+                    for piece in split_long(text):
+                        yield Block(piece, kind, level=level)
+                element.clear()
+            elif tag == WORD_NAMESPACE + "tc" and table_depth == 1 and row is not None:
+                row.append(" ".join(part for part in cell if part))
+            elif tag == WORD_NAMESPACE + "tr" and table_depth == 1 and row is not None:
+                # The first row of a Word table is taken as its header
+                if table_header is None:
+                    table_header = row
+                elif any(row):
+                    yield Block(describe_row(table_header, row), "table_row")
+                row = None
+                element.clear()
+            elif tag == WORD_NAMESPACE + "tbl":
+                table_depth -= 1
+                if not table_depth:
+                    element.clear()
+
+
+def parse_csv(file_path: str) -> Iterator[Block]:
+    """One block per CSV row, described against the header row"""
+    with open(file_path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+        sample = f.read(READ_SIZE)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(f, dialect)
+        header = [name.strip() for name in next(reader, [])]
+        for row_number, row in enumerate(reader, start=1):
+            text = describe_row(header, [cell.strip() for cell in row])
+            if text:
+                yield Block(text, "table_row", meta={"row": row_number})
+
+
+def flatten_record(record, prefix: str = "") -> Iterator[str]:
+    """"key: value" lines of a JSON value, with dotted keys for nested objects"""
+    if isinstance(record, dict):
+        for key, value in record.items():
+            yield from flatten_record(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(record, list) and all(not isinstance(item, (dict, list)) for item in record):
+        if record:
+            yield f"{prefix}: {', '.join(str(item) for item in record)}" if prefix else ", ".join(str(item) for item in record)
+    elif isinstance(record, list):
+        for i, item in enumerate(record):
+            yield from flatten_record(item, f"{prefix}[{i}]")
+    elif record is not None and record != "":
+        yield f"{prefix}: {record}" if prefix else str(record)
+
+
+def parse_jsonl(file_path: str) -> Iterator[Block]:
+    """One block per JSON Lines record; malformed lines are skipped"""
+    skipped = 0
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            text = "\n".join(flatten_record(record))
+            for piece in split_long(text):
+                yield Block(piece, "record", meta={"line": line_number})
+    if skipped:
+        logger.warning(f"Skipped {skipped} malformed lines in {os.path.basename(file_path)}")
+
+
+def parse_email(file_path: str) -> Iterator[Block]:
+    """An RFC 822 message: subject as heading, sender/recipients/date, then the body text"""
+    from email import policy
+    from email.parser import BytesParser
+
+    with open(file_path, "rb") as f:
+        message = BytesParser(policy=policy.default).parse(f)
+
+    subject = str(message.get("subject", "")).strip()
+    if subject:
+        yield Block(subject, "heading", level=1)
+    envelope = [f"{name}: {message[name]}" for name in ("From", "To", "Cc", "Date") if message.get(name)]
+    if envelope:
+        yield Block(" | ".join(envelope))
+
+    body = message.get_body(preferencelist=("plain", "html"))
+    if body is not None:
+        content = body.get_content()
+        if body.get_content_subtype() == "html":
+            yield from html_blocks([content])
+        else:
+            yield from paragraph_blocks(content)
+
+    attachments = [part.get_filename() for part in message.iter_attachments() if part.get_filename()]
+    if attachments:
+        yield Block(f"Attachments: {', '.join(attachments)}")
+
@@ -1,18 +1,48 @@
-import fitz  # PyMuPDF
 import os
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
+from .backends import backends
+from .parsers import detect_format, parse_text
+
+
+def _page_text(page) -> str:
+    """A page's text blocks in reading order, one paragraph each, separated by blank lines"""
+    # get_text("blocks") tuples: (x0, y0, x1, y1, text, block number, type); type 1 is an image
+    blocks = page.get_text("blocks", sort=True)
+    return "\n\n".join(" ".join(block[4].split()) for block in blocks if block[6] == 0 and block[4].strip())
+
+
+def extract_pdf_pages(file_path: str) -> List[Tuple[Optional[int], str]]:
+    """Extract (page number, text) pairs with PyMuPDF, imported on first use.
+
+    Paragraphs (PyMuPDF text blocks) are separated by blank lines so pages
+    can be split into paragraph blocks.
+    """
+    import fitz  # PyMuPDF
+    doc = fitz.open(file_path)
+    try:
+        return [(page_num + 1, _page_text(page)) for page_num, page in enumerate(doc)]
+    finally:
+        doc.close()
+
+
+def render_pdf_pages(file_path: str, page_numbers: Iterable[int], dpi: int = 200) -> Iterator[Tuple[int, bytes]]:
+    """Yield (page number, PNG bytes) for the given 1-based pages, one page at a time"""
+    import fitz  # PyMuPDF
+    doc = fitz.open(file_path)
+    try:
+        for page_num in page_numbers:
+            pixmap = doc[page_num - 1].get_pixmap(dpi=dpi)
+            yield page_num, pixmap.tobytes("png")
+    finally:
+        doc.close()
+
 
 class DocumentParser:
     @staticmethod
     def extract_text_from_pdf(file_path: str) -> str:
         """Extract text from PDF file"""
         try:
-            doc = fitz.open(file_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
+            return "\n\n".join(text for _, text in extract_pdf_pages(file_path))
         except Exception as e:
             raise Exception(f"Error reading PDF: {str(e)}")
     
@@ -20,18 +50,18 @@ class DocumentParser:
     def extract_text_from_txt(file_path: str) -> str:
         """Extract text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            return "\n\n".join(block.text for block in parse_text(file_path))
         except Exception as e:
             raise Exception(f"Error reading TXT file: {str(e)}")
     
     def parse_document(self, file_path: str) -> str:
-        """Parse document based on file extension"""
-        ext = os.path.splitext(file_path)[1].lower()
+        """Parse document based on file extension (see utils/parsers.py for the supported formats)"""
+        document_format = detect_format(file_path)
         
-        if ext == '.pdf':
+        if document_format == 'pdf':
             return self.extract_text_from_pdf(file_path)
-        elif ext == '.txt':
-            return self.extract_text_from_txt(file_path)
+        elif document_format is not None:
+            blocks = backends.resolve("parser", document_format)(file_path)
+            return "\n\n".join(block.text for block in blocks)
         else:
-            raise ValueError(f"Unsupported file format: {ext}")
\ No newline at end of file
+            raise ValueError(f"Unsupported file format: {os.path.splitext(file_path)[1].lower()}")
\ No newline at end of file
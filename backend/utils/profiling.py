@@ -0,0 +1,210 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# The trace of the request being served; run_in_threadpool copies the
+# context, so retrieval code running in worker threads records into it too
+current_trace: ContextVar[Optional["QueryTrace"]] = ContextVar("current_trace", default=None)
+
+
+class QueryTrace:
+    """Stage timings and counters of one query.
+
+    Cheap enough to keep for every request (a perf_counter pair per
+    stage); stages may repeat and are reported in the order they ran.
+    """
+
+    def __init__(self, question: str, profiled: bool = False):
+        self.question = question
+        self.profiled = profiled
+        self.started = time.perf_counter()
+        self.stages: List[List[Any]] = []
+        self.counts: Dict[str, Any] = {}
+        self.total_ms: Optional[float] = None
+        self.stack_samples: Optional[Counter] = None
+        self.coalesced = False
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append([name, round((start - self.started) * 1000, 2),
+                                round((time.perf_counter() - start) * 1000, 2)])
+
+    def count(self, name: str, value: Any):
+        self.counts[name] = value
+
+    def adopt(self, leader: "QueryTrace"):
+        """Take the work stages and counts of the coalesced call this request waited on"""
+        self.coalesced = True
+        self.stages.extend(stage for stage in leader.stages if stage[0] != "parse")
+        self.counts = {**leader.counts, **self.counts}
+
+    def finish(self) -> float:
+        if self.total_ms is None:
+            self.total_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        return self.total_ms
+
+    def stage_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for name, _, elapsed in self.stages:
+            totals[name] = round(totals.get(name, 0.0) + elapsed, 2)
+        return totals
+
+    def to_dict(self) -> dict:
+        report = {
+            "total_ms": self.finish(),
+            "stages": [{"stage": name, "start_ms": start, "elapsed_ms": elapsed} for name, start, elapsed in self.stages],
+            "counts": self.counts
+        }
+        if self.stack_samples is not None:
+            report["stack_samples"] = collapsed_stacks(self.stack_samples)
+        return report
+
+
+@contextmanager
+def trace_stage(name: str):
+    """Time a stage of the current request's trace; a no-op outside a traced request"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+    else:
+        with trace.stage(name):
+            yield
+
+
+def trace_count(name: str, value: Any):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def _frame_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def collapsed_stacks(samples: Counter) -> str:
+    """Samples in the collapsed "frame;frame;frame count" format of py-spy --format raw and flamegraph.pl"""
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a helper thread.
+
+    Wall-clock sampling, so time spent blocked (e.g. waiting on the LLM
+    HTTP call) shows up as well as CPU time.
+    """
+
+    def __init__(self, thread_id: int, interval_s: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_frame_stack(frame)] += 1
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_traced(trace: QueryTrace, sample_stacks: bool, interval_s: float, func, *args):
+    """Run func in the calling (worker) thread, sampling its stack into the trace if asked"""
+    if not sample_stacks:
+        return func(*args)
+    with StackSampler(threading.get_ident(), interval_s) as sampler:
+        try:
+            return func(*args)
+        finally:
+            trace.stack_samples = sampler.samples
+
+
+class QueryProfiler:
+    """Decides which requests are profiled and appends slow queries to a JSONL log.
+
+    A request is profiled when it asks for it (the X-Profile header) or is
+    picked by `sample_rate`. Every traced query slower than
+    `slow_query_ms` is written to `slow_log_path`, one JSON object per line;
+    requests that joined another's call are marked "coalesced" and report
+    that call's stages.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, slow_query_ms: Optional[float] = None,
+                 slow_log_path: Optional[str] = None, stack_interval_ms: float = 5.0):
+        self.sample_rate = sample_rate
+        self.slow_query_ms = slow_query_ms
+        self.slow_log_path = slow_log_path
+        self.stack_interval_s = stack_interval_ms / 1000
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.slow_queries = 0
+
+    def wants_profile(self, header: Optional[str]) -> bool:
+        if header is not None and header.strip().lower() not in ("", "0", "false", "no"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, trace: QueryTrace, corpus_version: int, endpoint: str, status: int = 200):
+        """Finish a trace and log it if it was slow"""
+        total_ms = trace.finish()
+        if trace.profiled:
+            self.profiled += 1
+        if self.slow_query_ms is None or total_ms < self.slow_query_ms:
+            return
+        self.slow_queries += 1
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "endpoint": endpoint,
+            "status": status,
+            "question": trace.question,
+            "corpus_version": corpus_version,
+            "total_ms": total_ms,
+            "stages_ms": trace.stage_totals(),
+            "counts": trace.counts
+        }
+        if trace.coalesced:
+            entry["coalesced"] = True
+        logger.warning(f"Slow query ({total_ms:.0f} ms): {trace.question[:80]!r} {entry['stages_ms']}")
+        if not self.slow_log_path:
+            return
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock, open(self.slow_log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f"Could not write slow query log {self.slow_log_path}: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_query_ms": self.slow_query_ms,
+            "slow_log": self.slow_log_path,
+            "profiled": self.profiled,
+            "slow_queries": self.slow_queries
+        }
@@ -0,0 +1,64 @@
+from typing import List, Optional, Sequence, Tuple, Union
+
+# A context entry is either one string or string parts (e.g. a label and
+# the chunk text itself) that are spliced into the prompt as they are
+ContextEntry = Union[str, Sequence[str]]
+
+RAG_TEMPLATE = """You are a helpful AI assistant. Using ONLY the context provided below from uploaded documents, answer the user's question accurately and concisely.
+
+IMPORTANT RULES:
+1. Answer based STRICTLY on the provided context only
+2. Be accurate and concise
+3. If the context doesn't contain enough information, say "The documents do not contain enough information to answer this question."
+4. Never make up information
+
+CONTEXT:
+{context}
+{history}
+QUESTION: {query}
+
+ANSWER:"""
+
+HISTORY_HEADER = "\nCONVERSATION SO FAR (for resolving follow-up questions):\n"
+
+
+def split_template(template: str, slots: Sequence[str]) -> List[str]:
+    """The literal text around `slots`, which must appear in the template once each, in this order"""
+    literals = []
+    for slot in slots:
+        before, template = template.split("{" + slot + "}", 1)
+        literals.append(before)
+    literals.append(template)
+    return literals
+
+
+# Compiled once: the static text between the slots, and the separator plus
+# "Source n:" label in front of each of the usual number of sources
+RAG_PREFIX, RAG_AFTER_CONTEXT, RAG_AFTER_HISTORY, RAG_SUFFIX = split_template(RAG_TEMPLATE, ("context", "history", "query"))
+SOURCE_LABELS = tuple(("\n\n" if i else "") + f"Source {i + 1}:\n" for i in range(64))
+
+
+def rag_prompt(context: Sequence[ContextEntry], query: str,
+               history: Optional[List[Tuple[str, str]]] = None) -> str:
+    """RAG prompt with numbered sources, condensed conversation history and the question.
+
+    Built with a single join over the static segments and the caller's
+    strings, so chunk texts are copied once, into the prompt itself.
+    """
+    parts = [RAG_PREFIX]
+    for i, entry in enumerate(context):
+        parts.append(SOURCE_LABELS[i] if i < len(SOURCE_LABELS) else f"\n\nSource {i + 1}:\n")
+        if isinstance(entry, str):
+            parts.append(entry)
+        else:
+            parts.extend(entry)
+    parts.append(RAG_AFTER_CONTEXT)
+    if history:
+        parts.append(HISTORY_HEADER)
+        for i, (question, answer) in enumerate(history):
+            parts.extend(("\nQ: " if i else "Q: ", question, "\nA: ", answer))
+        parts.append("\n")
+    parts.append(RAG_AFTER_HISTORY)
+    parts.append(query)
+    parts.append(RAG_SUFFIX)
+    return "".join(parts)
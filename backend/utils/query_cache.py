@@ -0,0 +1,179 @@
+import os
+import json
+import threading
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends and trims are not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """Bounded LRU cache of query vectors keyed by (model id, normalized query).
+
+    Shared by all retriever implementations; each one passes its own model id
+    so dense embeddings, sparse TF-IDF vectors and token sets never collide.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Case- and whitespace-insensitive cache key"""
+        return " ".join(query.lower().split())
+
+    def get(self, query: str, model_id: Hashable) -> Optional[Any]:
+        key = (model_id, self.normalize(query))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, model_id: Hashable, value: Any):
+        key = (model_id, self.normalize(query))
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, query: str, model_id: Hashable, compute: Callable[[str], Any]) -> Any:
+        """Return the cached vector for the query, computing and storing it on a miss"""
+        value = self.get(query, model_id)
+        if value is None:
+            value = compute(query)
+            self.put(query, model_id, value)
+        return value
+
+    def warm_up(self, queries: List[str], model_id: Hashable, compute: Callable[[str], Any], top_n: int = 100) -> int:
+        """Preload the top-N most frequent historical queries"""
+        counts = Counter(self.normalize(q) for q in queries if q.strip())
+        loaded = 0
+        for query, _ in counts.most_common(min(top_n, self.max_size)):
+            key = (model_id, query)
+            with self._lock:
+                if key in self._entries:
+                    continue
+            try:
+                self.put(query, model_id, compute(query))
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"Skipping warm-up query '{query}': {e}")
+        logger.info(f"Warmed query cache with {loaded} queries for {model_id}")
+        return loaded
+
+    def clear(self, model_id: Optional[Hashable] = None):
+        """Drop all entries, or only those of one model"""
+        with self._lock:
+            if model_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == model_id]:
+                    del self._entries[key]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4)
+        }
+
+
+def load_query_history(file_path: str) -> List[str]:
+    """Read past questions from a JSONL query log ({"question": ...} per line)"""
+    if not file_path or not os.path.exists(file_path):
+        return []
+
+    queries = []
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            try:
+                question = json.loads(line).get("question", "")
+            except (ValueError, AttributeError):
+                continue
+            if question:
+                queries.append(question)
+    return queries
+
+
+class QueryHistoryLog:
+    """Buffered JSONL query log, trimmed to its most recent questions.
+
+    `record` only queues the question in memory, so it is safe to call on the
+    event loop; `flush` does the file I/O and belongs in a thread. Once the
+    file grows past twice `max_lines` it is cut back to the last `max_lines`,
+    which also bounds what `load_query_history` reads at startup. Appends and
+    trims hold an flock on the file, so several workers can share it.
+    """
+
+    def __init__(self, file_path: str, max_lines: int = 10000):
+        self.file_path = file_path
+        self.max_lines = max_lines
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._lines = None  # estimated line count, counted on first flush
+
+    def record(self, question: str):
+        with self._lock:
+            self._pending.append(question)
+
+    def flush(self) -> int:
+        """Write the queued questions; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            with open(self.file_path, 'a+', encoding='utf-8') as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if self._lines is None:
+                        f.seek(0)
+                        self._lines = sum(1 for _ in f)
+                    f.write("".join(json.dumps({"question": question}) + "\n" for question in pending))
+                    f.flush()
+                    self._lines += len(pending)
+                    # Other workers append too, so recount before trimming
+                    if self._lines > 2 * self.max_lines:
+                        self._lines = self._trim(f)
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            return len(pending)
+
+    def _trim(self, f) -> int:
+        f.seek(0)
+        lines = f.readlines()
+        if len(lines) > self.max_lines:
+            lines = lines[-self.max_lines:]
+            f.seek(0)
+            f.truncate()
+            f.writelines(lines)
+            f.flush()
+        return len(lines)
+
+
+# Process-wide cache shared across retrievers
+query_cache = QueryCache(max_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")))
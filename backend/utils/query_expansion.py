@@ -0,0 +1,324 @@
+import contextvars
+import itertools
+import json
+import math
+import re
+import threading
+import time
+import logging
+from collections import Counter, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+from .highlight import STOPWORDS, query_terms
+from .profiling import trace_count
+from .reranker import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Small general-purpose synonym groups; extend per deployment with a
+# synonyms file (one comma-separated group per line, or a JSON list of lists)
+DEFAULT_SYNONYMS = [
+    ["cost", "price", "expense", "fee"],
+    ["revenue", "income", "sales", "earnings"],
+    ["profit", "margin", "earnings"],
+    ["increase", "growth", "rise", "gain"],
+    ["decrease", "decline", "drop", "reduction"],
+    ["error", "failure", "fault", "issue", "problem"],
+    ["fix", "resolve", "repair", "solution"],
+    ["method", "approach", "methodology", "technique"],
+    ["result", "finding", "outcome", "conclusion"],
+    ["goal", "objective", "aim", "purpose"],
+    ["risk", "threat", "hazard"],
+    ["customer", "client", "user"],
+    ["employee", "staff", "worker", "personnel"],
+    ["policy", "rule", "guideline", "regulation"],
+    ["summary", "overview", "abstract"],
+    ["recommendation", "suggestion", "proposal"],
+    ["requirement", "prerequisite", "specification"],
+    ["start", "begin", "launch"],
+    ["end", "finish", "complete"],
+    ["buy", "purchase", "acquire"],
+    ["big", "large", "major"],
+    ["small", "minor", "little"],
+]
+
+# Reciprocal rank fusion constant (Cormack et al.); dampens the head of each list
+RRF_K = 60
+REWRITE_LINE = re.compile(r"^\s*(?:[-*•]|\d+[.)])?\s*")
+_df_lock = threading.Lock()
+
+
+def load_synonyms(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """Term -> other terms of its groups, from DEFAULT_SYNONYMS plus an optional file"""
+    groups = [list(group) for group in DEFAULT_SYNONYMS]
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            groups.extend(json.loads(text))
+        else:
+            groups.extend([term.strip() for term in line.split(",") if term.strip()]
+                          for line in text.splitlines() if line.strip() and not line.startswith("#"))
+
+    synonyms: Dict[str, List[str]] = {}
+    for group in groups:
+        group = [term.lower() for term in group]
+        for term in group:
+            related = synonyms.setdefault(term, [])
+            related.extend(other for other in group if other != term and other not in related)
+    return synonyms
+
+
+def document_frequencies(corpus) -> Counter:
+    """Chunk frequency of every word token, kept in `corpus.indexes` and extended as the corpus grows"""
+    with _df_lock:
+        entry = corpus.indexes.get("term_df")
+        if entry is None:
+            entry = corpus.indexes["term_df"] = [Counter(), 0]
+        counts, indexed = entry
+        if indexed < len(corpus):
+            for chunk in itertools.islice(corpus.chunks, indexed, None):
+                counts.update(set(tokenize(chunk)))
+            entry[1] = len(corpus)
+        return counts
+
+
+def ready_document_frequencies(corpus) -> Optional[Counter]:
+    """The document frequencies if they are already built for the whole corpus, else None"""
+    entry = corpus.indexes.get("term_df")
+    if entry is None or entry[1] < len(corpus):
+        return None
+    return entry[0]
+
+
+def fuse_results(result_lists: Sequence[List[tuple]], k: int) -> List[tuple]:
+    """Merge (chunk, score, chunk_id) lists with reciprocal rank fusion, one entry per chunk id.
+
+    Chunks found by several reformulations rise to the top; each keeps its
+    best retrieval score, so downstream thresholds and rerankers see
+    scores on the retriever's scale.
+    """
+    fused: Dict[int, float] = {}
+    best: Dict[int, tuple] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            chunk_id = result[2]
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            if chunk_id not in best or result[1] > best[chunk_id][1]:
+                best[chunk_id] = result
+    order = sorted(fused, key=lambda chunk_id: (-fused[chunk_id], chunk_id))
+    return [best[chunk_id] for chunk_id in order[:k]]
+
+
+class QueryExpander:
+    """Multi-query retrieval: reformulate a question, retrieve for each variant concurrently, fuse.
+
+    Variants come from synonym substitution, pseudo-relevance feedback
+    (terms that characterize the original query's top results) and,
+    optionally, an LLM `rewriter` returning paraphrases. The original
+    query's retrieval always completes; the other retrievals get at most
+    `budget_ms` beyond it, and any still running then are left out of the
+    merge. Questions with more than `max_query_terms` content terms are
+    specific enough already and are retrieved as-is.
+
+    Rewrites are cached per question (up to `rewrite_cache_size`), so a
+    repeated question uses its paraphrases without another LLM call. An
+    uncached rewrite is only started when `rewrite_latency_ms` (the LLM's
+    observed latency, None while unmeasured) fits in the budget; otherwise
+    its result would always arrive too late to be used.
+    """
+
+    def __init__(self, retrieve: Callable, synonyms: Optional[Dict[str, List[str]]] = None,
+                 rewriter: Optional[Callable[[str], List[str]]] = None, budget_ms: float = 50.0,
+                 max_variants: int = 4, max_query_terms: int = 8, feedback_docs: int = 3,
+                 feedback_terms: int = 4, workers: int = 4,
+                 rewrite_latency_ms: Optional[Callable[[], Optional[float]]] = None, rewrite_cache_size: int = 1024):
+        self.retrieve = retrieve
+        self.synonyms = synonyms if synonyms is not None else load_synonyms()
+        self.rewriter = rewriter
+        self.budget_ms = budget_ms
+        self.max_variants = max_variants
+        self.max_query_terms = max_query_terms
+        self.feedback_docs = feedback_docs
+        self.feedback_terms = feedback_terms
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-expansion")
+        # LLM rewrites wait on the network; they get their own threads so a
+        # slow call never delays variant retrievals
+        self.rewrite_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-rewrite") if rewriter else None
+        self.rewrite_latency_ms = rewrite_latency_ms
+        self.rewrite_cache_size = rewrite_cache_size
+        self._rewrites: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._df_builds = set()
+        self.expanded_queries = 0
+        self.variants_retrieved = 0
+        self.variants_dropped = 0
+        self.added_ms_total = 0.0
+        self.rewrites_cached = 0
+        self.rewrites_skipped = 0
+
+    def synonym_variants(self, question: str) -> List[str]:
+        """One variant per synonym rank: the n-th synonym of every replaceable term"""
+        words = tokenize(question)
+        replaceable = [word for word in words if word in self.synonyms and word not in STOPWORDS]
+        if not replaceable:
+            return []
+        variants = []
+        for rank in range(max(len(self.synonyms[word]) for word in replaceable)):
+            swapped = [self.synonyms[word][rank] if word in replaceable and rank < len(self.synonyms[word]) else word
+                       for word in words]
+            variants.append(" ".join(swapped))
+        return variants
+
+    def feedback_variant(self, question: str, results: List[tuple], corpus) -> Optional[str]:
+        """The question plus the terms that best characterize its top results (tf-idf weighted)"""
+        if not results:
+            return None
+        df = self._frequencies(corpus)
+        if df is None:
+            return None
+        n_docs = max(len(corpus), 1)
+        present = query_terms(question)
+        weights: Counter = Counter()
+        for result in results[:self.feedback_docs]:
+            tokens = [token for token in tokenize(result[0])
+                      if len(token) > 2 and not token.isdigit() and token not in STOPWORDS and token not in present]
+            if not tokens:
+                continue
+            for token, count in Counter(tokens).items():
+                weights[token] += count / len(tokens) * math.log(1 + n_docs / (1 + df.get(token, 0)))
+        terms = [term for term, _ in weights.most_common(self.feedback_terms)]
+        return f"{question} {' '.join(terms)}" if terms else None
+
+    def _frequencies(self, corpus) -> Optional[Counter]:
+        # Counting a large corpus takes far longer than the budget, so it is
+        # built in the background and feedback variants wait until it is ready
+        df = ready_document_frequencies(corpus)
+        if df is None:
+            with self._lock:
+                if id(corpus) not in self._df_builds:
+                    self._df_builds.add(id(corpus))
+                    self.executor.submit(self._build_frequencies, corpus)
+        return df
+
+    def _build_frequencies(self, corpus):
+        try:
+            document_frequencies(corpus)
+        finally:
+            with self._lock:
+                self._df_builds.discard(id(corpus))
+
+    def _submit(self, func, *args, executor: Optional[ThreadPoolExecutor] = None):
+        # Copy the request context so the query trace follows the work into the pool
+        return (executor or self.executor).submit(contextvars.copy_context().run, func, *args)
+
+    def _rewrite(self, question: str) -> List[str]:
+        try:
+            rewrites = self.rewriter(question)
+        except Exception as e:
+            logger.warning(f"Query rewrite failed: {e}")
+            return []
+        rewrites = [REWRITE_LINE.sub("", line).strip() for line in rewrites if line.strip()]
+        if rewrites:
+            # Cached even when this request stopped waiting; the next asker gets them at once
+            with self._lock:
+                self._rewrites[question.lower()] = rewrites
+                self._rewrites.move_to_end(question.lower())
+                while len(self._rewrites) > self.rewrite_cache_size:
+                    self._rewrites.popitem(last=False)
+        return rewrites
+
+    def _cached_rewrites(self, question: str) -> Optional[List[str]]:
+        with self._lock:
+            rewrites = self._rewrites.get(question.lower())
+            if rewrites is not None:
+                self._rewrites.move_to_end(question.lower())
+                self.rewrites_cached += 1
+            return rewrites
+
+    def _rewrite_fits_budget(self) -> bool:
+        latency_ms = self.rewrite_latency_ms() if self.rewrite_latency_ms else None
+        if latency_ms is None or latency_ms <= self.budget_ms:
+            return True
+        with self._lock:
+            self.rewrites_skipped += 1
+        return False
+
+    def retrieve_expanded(self, question: str, corpus, k: int, candidate_ids=None) -> List[tuple]:
+        """First-stage retrieval over the question and its reformulations, fused to k results"""
+        if len(query_terms(question)) > self.max_query_terms:
+            return self.retrieve(question, corpus, k=k, candidate_ids=candidate_ids)
+
+        # Everything known up front starts in the pool while the original
+        # query is retrieved in this thread, so it never queues behind variants
+        seen = {question.lower()}
+        variants = {}
+        for variant in self.synonym_variants(question):
+            if len(variants) < self.max_variants and variant.lower() not in seen:
+                seen.add(variant.lower())
+                variants[self._submit(self.retrieve, variant, corpus, k, candidate_ids)] = variant
+        rewrite = None
+        rewrites = self._cached_rewrites(question) if self.rewriter else None
+        if rewrites is not None:
+            for text in rewrites:
+                if len(variants) < self.max_variants and text.lower() not in seen:
+                    seen.add(text.lower())
+                    variants[self._submit(self.retrieve, text, corpus, k, candidate_ids)] = text
+        elif self.rewriter and self._rewrite_fits_budget():
+            rewrite = self._submit(self._rewrite, question, executor=self.rewrite_executor)
+
+        base = self.retrieve(question, corpus, k=k, candidate_ids=candidate_ids)
+        started = time.perf_counter()
+        deadline = started + self.budget_ms / 1000
+
+        feedback = self.feedback_variant(question, base, corpus)
+        if feedback and len(variants) < self.max_variants:
+            seen.add(feedback.lower())
+            variants[self._submit(self.retrieve, feedback, corpus, k, candidate_ids)] = feedback
+
+        pending = set(variants) | ({rewrite} if rewrite else set())
+        results = [base]
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future is rewrite:
+                    for text in future.result():
+                        if len(variants) < self.max_variants and text.lower() not in seen:
+                            seen.add(text.lower())
+                            submitted = self._submit(self.retrieve, text, corpus, k, candidate_ids)
+                            variants[submitted] = text
+                            pending.add(submitted)
+                    continue
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.warning(f"Retrieval for variant {variants[future]!r} failed: {e}")
+        for future in pending:
+            future.cancel()
+
+        added_ms = (time.perf_counter() - started) * 1000
+        dropped = sum(1 for future in pending if future is not rewrite)
+        with self._lock:
+            self.expanded_queries += 1
+            self.variants_retrieved += len(results) - 1
+            self.variants_dropped += dropped
+            self.added_ms_total += added_ms
+        trace_count("expansion_variants", len(results) - 1)
+        trace_count("expansion_dropped", dropped)
+        return fuse_results(results, k)
+
+    def get_stats(self) -> dict:
+        return {
+            "budget_ms": self.budget_ms,
+            "max_variants": self.max_variants,
+            "llm_rewrites": self.rewriter is not None,
+            "rewrites_cached": self.rewrites_cached,
+            "rewrites_skipped": self.rewrites_skipped,
+            "expanded_queries": self.expanded_queries,
+            "variants_retrieved": self.variants_retrieved,
+            "variants_dropped": self.variants_dropped,
+            "avg_added_ms": round(self.added_ms_total / self.expanded_queries, 2) if self.expanded_queries else 0.0
+        }
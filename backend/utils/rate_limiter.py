@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import math
+import re
+import threading
+import time
+import logging
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Queue priorities; lower runs first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse rate-limit reset durations such as "7.66s", "2m59.56s" or "120ms" into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class RateLimitExceeded(Exception):
+    """The request can't be scheduled within its deadline; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: float, message: str = "LLM rate limit reached, please retry later"):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Continuously refilling bucket; the level may go negative after usage corrections"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.rate = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (amounts above capacity wait for a full bucket)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def cap(self, level: float, now: float):
+        """Lower the level to what the server reports as remaining"""
+        self._refill(now)
+        self.level = min(self.level, level)
+
+    def resize(self, capacity: float, period_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period_seconds
+
+
+class LLMScheduler:
+    """Token-bucket scheduler for LLM calls with request and token budgets.
+
+    Callers acquire one request plus an estimated token count before calling
+    the API. Waiting callers are served in priority order; a caller whose
+    estimated wait (including everyone queued ahead of it) would pass its
+    deadline is rejected right away with RateLimitExceeded instead of
+    queueing. Rate-limit response headers and 429s adjust the buckets.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_wait_seconds: float = 10.0):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_wait_seconds = max_wait_seconds
+        self.paused_until = 0.0
+        self._queue = []  # heap of (priority, seq, tokens)
+        self._seq = itertools.count()
+        self._changed = threading.Condition()
+        self.admitted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+
+    def _wait_estimate(self, ticket: tuple, now: float) -> float:
+        ahead = [queued for queued in self._queue if queued < ticket]
+        return max(
+            self.paused_until - now,
+            self.requests.time_until(len(ahead) + 1, now),
+            self.tokens.time_until(sum(queued[2] for queued in ahead) + ticket[2], now)
+        )
+
+    def acquire(self, tokens: int, priority: int = PRIORITIES["normal"], deadline: Optional[float] = None):
+        """Block until the call may proceed; raise RateLimitExceeded if it can't by the deadline.
+
+        `deadline` is a time.monotonic() value; it defaults to max_wait_seconds from now.
+        """
+        started = time.monotonic()
+        if deadline is None:
+            deadline = started + self.max_wait_seconds
+        ticket = (priority, next(self._seq), tokens)
+
+        with self._changed:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_estimate(ticket, now)
+                    if wait <= 0 and self._queue[0] == ticket:
+                        self.requests.consume(1, now)
+                        self.tokens.consume(tokens, now)
+                        self.admitted += 1
+                        self.total_wait_seconds += now - started
+                        return
+                    if now + wait > deadline:
+                        self.rejected += 1
+                        raise RateLimitExceeded(retry_after=wait)
+                    self._changed.wait(timeout=min(max(wait, 0.01), deadline - now))
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._changed.notify_all()
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the real usage of a call is known"""
+        with self._changed:
+            self.tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+            self._changed.notify_all()
+
+    def update_from_headers(self, headers: Mapping[str, str], status_code: int = 200):
+        """Adapt to the server's view of the limits (Groq/OpenAI x-ratelimit-* headers)"""
+        now = time.monotonic()
+        with self._changed:
+            limit_tokens = headers.get("x-ratelimit-limit-tokens")
+            if limit_tokens and float(limit_tokens) != self.tokens.capacity:
+                # Token limits are per minute
+                self.tokens.resize(float(limit_tokens))
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None:
+                self.tokens.cap(float(remaining_tokens), now)
+            # Request limits may cover a whole day, so only honor exhaustion
+            if headers.get("x-ratelimit-remaining-requests") == "0":
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+            if status_code == 429:
+                self.rate_limited += 1
+                retry_after = (parse_duration(headers.get("retry-after"))
+                               or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                               or 1.0)
+                self.paused_until = max(self.paused_until, now + retry_after)
+                logger.warning(f"LLM rate limited, pausing for {retry_after:.1f}s")
+            self._changed.notify_all()
+
+    def concurrency(self, call_seconds: float) -> int:
+        """Most calls that can be in flight at once when each takes at most call_seconds:
+        a full request bucket plus what refills while they run"""
+        return max(1, math.ceil(self.requests.capacity + self.requests.rate * call_seconds))
+
+    def retry_after(self) -> float:
+        """Seconds until a new request could likely be admitted"""
+        now = time.monotonic()
+        with self._changed:
+            return max(self.paused_until - now, self.requests.time_until(1, now))
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._changed:
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                "queued": len(self._queue),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "rate_limited": self.rate_limited,
+                "avg_wait_ms": round(self.total_wait_seconds / self.admitted * 1000, 1) if self.admitted else 0.0,
+                "requests_available": round(self.requests.level, 2),
+                "tokens_available": round(self.tokens.level),
+                "paused_for_s": round(max(0.0, self.paused_until - now), 2)
+            }
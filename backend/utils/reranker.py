@@ -0,0 +1,188 @@
+import math
+import re
+import time
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class ProximityScorer:
+    """Cheap lexical scorer based on term coverage, proximity and phrase matches"""
+    name = "proximity"
+
+    def score(self, query: str, chunks: List[str]) -> List[float]:
+        """Score each chunk against the query (0 to 1)"""
+        query_terms = tokenize(query)
+        if not query_terms:
+            return [0.0] * len(chunks)
+
+        unique_terms = set(query_terms)
+        query_bigrams = set(zip(query_terms, query_terms[1:]))
+        return [self._score_chunk(unique_terms, query_bigrams, chunk) for chunk in chunks]
+
+    def _score_chunk(self, unique_terms: set, query_bigrams: set, chunk: str) -> float:
+        tokens = tokenize(chunk)
+        positions = {}
+        for pos, token in enumerate(tokens):
+            if token in unique_terms:
+                positions.setdefault(token, []).append(pos)
+
+        if not positions:
+            return 0.0
+
+        coverage = len(positions) / len(unique_terms)
+        proximity = self._min_window_ratio(positions)
+
+        phrase = 0.0
+        if query_bigrams:
+            chunk_bigrams = set(zip(tokens, tokens[1:]))
+            phrase = len(query_bigrams & chunk_bigrams) / len(query_bigrams)
+
+        return 0.5 * coverage + 0.3 * proximity + 0.2 * phrase
+
+    @staticmethod
+    def _min_window_ratio(positions: dict) -> float:
+        """Matched terms divided by the smallest token window containing all of them"""
+        if len(positions) == 1:
+            return 1.0
+
+        events = sorted((pos, term) for term, plist in positions.items() for pos in plist)
+        needed = len(positions)
+        counts = {}
+        best = events[-1][0] - events[0][0] + 1
+        left = 0
+        for right_pos, term in events:
+            counts[term] = counts.get(term, 0) + 1
+            while len(counts) == needed:
+                left_pos, left_term = events[left]
+                best = min(best, right_pos - left_pos + 1)
+                counts[left_term] -= 1
+                if counts[left_term] == 0:
+                    del counts[left_term]
+                left += 1
+
+        return needed / best
+
+
+class CrossEncoderScorer:
+    """Local cross-encoder scorer running on CPU (requires sentence-transformers)"""
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        self.model_name = model_name
+        self.model = None
+
+    def _load_model(self):
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, device="cpu")
+            logger.info(f"Loaded cross-encoder {self.model_name}")
+        return self.model
+
+    def warm_up(self):
+        """Load the model and run one prediction so the first query doesn't pay for either"""
+        self._load_model().predict([("warm up", "warm up")])
+
+    def score(self, query: str, chunks: List[str]) -> List[float]:
+        """Score each chunk against the query (0 to 1)"""
+        model = self._load_model()
+        logits = model.predict([(query, chunk) for chunk in chunks])
+        return [1 / (1 + math.exp(-float(logit))) for logit in logits]
+
+
+class Reranker:
+    """Second-stage reranker with a per-query time budget.
+
+    Candidates are scored in small batches; if the budget runs out before
+    every candidate is scored, the first-stage order is returned unchanged.
+    """
+
+    def __init__(self, scorer, candidate_pool: int = 50, time_budget_ms: float = 50.0, batch_size: int = 8):
+        self.scorer = scorer
+        self.candidate_pool = candidate_pool
+        self.time_budget_ms = time_budget_ms
+        self.batch_size = batch_size
+        self.reranked_queries = 0
+        self.budget_fallbacks = 0
+
+    def rerank(self, query: str, candidates: List[Tuple[str, float]], k: int = 3) -> List[Tuple[str, float]]:
+        """Rescore first-stage (chunk, score, ...) candidates and return the top k.
+        
+        Any extra tuple fields (e.g. chunk ids) are carried through unchanged.
+        """
+        candidates = candidates[:self.candidate_pool]
+        if len(candidates) <= 1:
+            return candidates[:k]
+
+        start = time.perf_counter()
+        deadline = start + self.time_budget_ms / 1000
+        chunks = [candidate[0] for candidate in candidates]
+        scores = []
+
+        try:
+            batches_done = 0
+            for i in range(0, len(chunks), self.batch_size):
+                now = time.perf_counter()
+                # Stop early if the next batch would likely overrun the budget
+                if batches_done and now + (now - start) / batches_done > deadline:
+                    return self._fallback(query, candidates, k, "budget exceeded")
+                scores.extend(self.scorer.score(query, chunks[i:i + self.batch_size]))
+                batches_done += 1
+                if time.perf_counter() > deadline:
+                    return self._fallback(query, candidates, k, "budget exceeded")
+        except Exception as e:
+            return self._fallback(query, candidates, k, f"scorer error: {e}")
+
+        self.reranked_queries += 1
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+        return [(chunks[i], float(scores[i])) + tuple(candidates[i][2:]) for i in order[:k]]
+
+    def warm_up(self):
+        """Prepare the scorer ahead of the first query (model loading isn't budgeted)"""
+        warm_up = getattr(self.scorer, "warm_up", None)
+        if warm_up is None:
+            return
+        started = time.perf_counter()
+        try:
+            warm_up()
+        except Exception as e:
+            # Queries then fall back to first-stage order, as on any scorer error
+            logger.warning(f"Could not warm up the {self.scorer.name} scorer: {e}")
+            return
+        logger.info(f"Warmed up {self.scorer.name} scorer in {time.perf_counter() - started:.2f}s")
+
+    def _fallback(self, query: str, candidates: List[Tuple[str, float]], k: int, reason: str) -> List[Tuple[str, float]]:
+        self.budget_fallbacks += 1
+        logger.warning(f"Reranking skipped ({reason}), using first-stage order for: {query}")
+        return candidates[:k]
+
+    def get_stats(self) -> dict:
+        return {
+            "scorer": self.scorer.name,
+            "candidate_pool": self.candidate_pool,
+            "time_budget_ms": self.time_budget_ms,
+            "reranked_queries": self.reranked_queries,
+            "budget_fallbacks": self.budget_fallbacks
+        }
+
+
+def create_reranker(name: str, candidate_pool: int = 50, time_budget_ms: float = 50.0) -> Optional[Reranker]:
+    """Build a reranker by scorer name ("proximity", "cross-encoder" or "none")"""
+    name = (name or "none").lower()
+    if name == "none":
+        return None
+    if name == "proximity":
+        scorer = ProximityScorer()
+    elif name == "cross-encoder":
+        scorer = CrossEncoderScorer()
+    else:
+        raise ValueError(f"Unknown reranker: {name}")
+    return Reranker(scorer, candidate_pool=candidate_pool, time_budget_ms=time_budget_ms)
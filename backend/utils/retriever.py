@@ -1,20 +1,41 @@
 import numpy as np
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import logging
+from .query_cache import QueryCache, query_cache
 
 logger = logging.getLogger(__name__)
 
+# Filtered searches over at most this many candidates are scored directly
+# instead of scanning the whole index with an ID selector
+DIRECT_SCORING_LIMIT = 2048
+
 class Retriever:
-    def __init__(self, embedder):
+    def __init__(self, embedder, rescore_factor: int = 4, cache: Optional[QueryCache] = None):
         self.embedder = embedder
+        # Quantized indexes return k * rescore_factor candidates which are
+        # re-ranked against the full-precision vectors
+        self.rescore_factor = rescore_factor
+        self.cache = cache or query_cache
+    
+    @property
+    def model_id(self) -> str:
+        # Read per query: the embedder switches space if a remote build falls back to local
+        return getattr(self.embedder, 'model_id', type(self.embedder).__name__)
+    
+    def _encode_query(self, query: str) -> List[float]:
+        if hasattr(self.embedder, 'encode_queries'):
+            # Same backend that embedded the corpus
+            embedding = self.embedder.encode_queries([query])
+        else:
+            embedding = self.embedder.embedding_model.encode([query])
+        return embedding[0].tolist()
     
     def get_query_embedding(self, query: str) -> List[float]:
         """Generate embedding for query"""
         try:
             if hasattr(self.embedder, 'embedding_model'):
-                # Using sentence-transformers
-                embedding = self.embedder.embedding_model.encode([query])
-                return embedding[0].tolist()
+                # Using sentence-transformers, cached per normalized query
+                return self.cache.get_or_compute(query, self.model_id, self._encode_query)
             else:
                 # Fallback: simple TF-IDF or other approach
                 # For now, return a dummy embedding to avoid errors
@@ -25,12 +46,18 @@ class Retriever:
             # Return a simple fallback embedding
             return [0.1] * 384
     
-    def retrieve_similar_chunks(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
-        """Retrieve top-k most similar chunks"""
+    def warm_up(self, queries: List[str], top_n: int = 100) -> int:
+        """Precompute embeddings for the most frequent historical queries"""
+        if not hasattr(self.embedder, 'embedding_model'):
+            return 0
+        return self.cache.warm_up(queries, self.model_id, self._encode_query, top_n)
+    
+    def retrieve_similar_chunks(self, query: str, k: int = 3, candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Retrieve top-k most similar chunks, optionally restricted to candidate_ids"""
         try:
             # Check if using TF-IDF approach
             if hasattr(self.embedder, 'retrieve_similar_chunks'):
-                return self.embedder.retrieve_similar_chunks(query, k)
+                return self.embedder.retrieve_similar_chunks(query, k, candidate_ids=candidate_ids)
             
             # Using FAISS approach
             if self.embedder.index is None or not self.embedder.chunks:
@@ -53,16 +80,43 @@ class Retriever:
                 return []
             
             # Search for similar chunks
-            distances, indices = self.embedder.index.search(query_vector, k)
+            quantized = getattr(self.embedder, 'vector_dtype', 'float32') != 'float32'
+            shortlist_size = k * self.rescore_factor if quantized else k
+            
+            if candidate_ids is not None and len(candidate_ids) <= DIRECT_SCORING_LIMIT:
+                # Small filtered subsets: exact distances for just those rows
+                indices = np.asarray(candidate_ids, dtype=np.int64)
+                if len(indices) == 0:
+                    return []
+                distances = self.embedder.rescore(query_vector[0], indices)
+                order = np.argsort(distances)[:k]
+                distances, indices = distances[order], indices[order]
+                quantized = False
+            elif candidate_ids is not None:
+                import faiss
+                selector = faiss.IDSelectorBatch(np.asarray(candidate_ids, dtype=np.int64))
+                params = faiss.SearchParameters(sel=selector)
+                distances, indices = self.embedder.index.search(query_vector, shortlist_size, params=params)
+                distances, indices = distances[0], indices[0]
+            else:
+                distances, indices = self.embedder.index.search(query_vector, shortlist_size)
+                distances, indices = distances[0], indices[0]
+            
+            if quantized:
+                valid = indices >= 0
+                indices = indices[valid]
+                distances = self.embedder.rescore(query_vector[0], indices)
+                order = np.argsort(distances)[:k]
+                distances, indices = distances[order], indices[order]
             
             # Get chunks and their similarity scores
             results = []
-            for i, idx in enumerate(indices[0]):
+            for i, idx in enumerate(indices):
                 if 0 <= idx < len(self.embedder.chunks):
                     chunk = self.embedder.chunks[idx]
                     # Convert distance to similarity score (ensure it's a float)
                     try:
-                        similarity = float(1 / (1 + distances[0][i]))
+                        similarity = float(1 / (1 + distances[i]))
                     except (ValueError, TypeError, ZeroDivisionError):
                         similarity = 0.5  # Default similarity
                     results.append((chunk, similarity))
@@ -0,0 +1,142 @@
+import os
+import heapq
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import numpy as np
+from .profiling import trace_count
+from .simple_retriever import SimpleRetriever, corpus_index, top_k
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedIndex:
+    """A TF-IDF index split into contiguous row blocks that are searched in parallel.
+
+    Every shard holds its own copy of its rows of the count matrix (so the
+    counts are held twice while the plain index is kept) and is scored
+    against the query vector of the whole index, so similarities use the
+    corpus-wide IDF and the merged top-k has the unsharded scores. Shards are scored on a thread pool: the
+    sparse product and the top-k partition release the GIL, so the threads
+    use separate cores. The caller's thread scores the first shard itself.
+    """
+
+    def __init__(self, index: SimpleRetriever, n_shards: int, executor: Optional[ThreadPoolExecutor] = None):
+        self.index = index
+        counts, self.idf, doc_norms = index.weights()
+        n_rows = counts.shape[0]
+        self.n_rows = n_rows
+        self.n_shards = max(1, min(n_shards, n_rows))
+        # First row of every shard, then the total
+        self.starts = np.linspace(0, n_rows, self.n_shards + 1).astype(np.int64)
+        self.shards = []
+        for start, end in zip(self.starts[:-1], self.starts[1:]):
+            # Row slicing copies, so every shard's rows are contiguous in its own arrays
+            self.shards.append((int(start), counts[start:end], doc_norms[start:end]))
+        self.executor = executor
+
+    def _search_shard(self, shard: int, query_vec, query_norm: float, k: int,
+                      candidate_ids: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        start, counts, doc_norms = self.shards[shard]
+        if candidate_ids is not None:
+            rows = candidate_ids - start
+            counts = counts[rows]
+            doc_norms = doc_norms[rows]
+        similarities, top_indices = top_k(counts, doc_norms, query_vec, query_norm, k)
+        if candidate_ids is None:
+            return [(float(similarities[i]), start + int(i)) for i in top_indices]
+        return [(float(similarities[i]), int(candidate_ids[i])) for i in top_indices]
+
+    def search(self, query: str, k: int = 3, candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (chunk id, cosine similarity) pairs merged from every shard's top-k"""
+        if not self.n_rows:
+            return []
+        query_vec, query_norm = self.index.query_vector(query, self.idf)
+        if query_norm == 0:
+            ids = range(self.n_rows) if candidate_ids is None else candidate_ids
+            return [(int(i), 0.0) for i in list(ids)[:k]]
+
+        # Scatter: each shard scores only the candidates in its row range
+        if candidate_ids is None:
+            work = [(shard, None) for shard in range(self.n_shards)]
+        else:
+            if len(candidate_ids) == 0:
+                return []
+            ids = np.sort(np.asarray(candidate_ids, dtype=np.int64))
+            bounds = np.searchsorted(ids, self.starts)
+            work = [(shard, ids[bounds[shard]:bounds[shard + 1]]) for shard in range(self.n_shards)
+                    if bounds[shard + 1] > bounds[shard]]
+
+        futures = []
+        if self.executor is not None:
+            futures = [self.executor.submit(self._search_shard, shard, query_vec, query_norm, k, ids)
+                       for shard, ids in work[1:]]
+            work = work[:1]
+        partials = [self._search_shard(shard, query_vec, query_norm, k, ids) for shard, ids in work]
+        partials.extend(future.result() for future in futures)
+        trace_count("index_shards_searched", len(partials))
+
+        # Gather: the k best of the per-shard top-k lists; ties across shards go to the lower chunk id
+        best = heapq.nlargest(k, (hit for partial in partials for hit in partial), key=lambda hit: (hit[0], -hit[1]))
+        return [(chunk_id, similarity) for similarity, chunk_id in best]
+
+
+class IndexSharding:
+    """Retriever backend that searches each corpus' TF-IDF index as parallel shards.
+
+    The sharded index is built on first search of a corpus and rebuilt when
+    the corpus grew. Corpora smaller than min_shard_chunks per shard get
+    fewer shards (down to the plain index), since below that the hand-off
+    to the pool costs more than the split saves.
+    """
+
+    def __init__(self, n_shards: int, threads: Optional[int] = None, min_shard_chunks: int = 10000):
+        self.n_shards = n_shards
+        self.threads = threads or os.cpu_count() or 1
+        self.min_shard_chunks = min_shard_chunks
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="index-shard") \
+            if self.threads > 1 else None
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.builds = 0
+        self.build_ms_total = 0.0
+
+    def shard_count(self, n_chunks: int) -> int:
+        return max(1, min(self.n_shards, n_chunks // max(1, self.min_shard_chunks)))
+
+    def sharded_index(self, corpus):
+        """The corpus' sharded index, or its plain TF-IDF index if it is too small to split"""
+        index = corpus_index(corpus)
+        n_shards = self.shard_count(len(index.chunks))
+        if n_shards == 1:
+            return index
+        sharded = corpus.indexes.get("tfidf_shards")
+        if sharded is None or sharded.n_rows != len(index.chunks):
+            with self._lock:
+                sharded = corpus.indexes.get("tfidf_shards")
+                if sharded is None or sharded.n_rows != len(index.chunks):
+                    started = time.perf_counter()
+                    sharded = corpus.indexes["tfidf_shards"] = ShardedIndex(index, n_shards, self.executor)
+                    self.builds += 1
+                    self.build_ms_total += (time.perf_counter() - started) * 1000
+                    logger.info(f"Split TF-IDF index of {sharded.n_rows} chunks into {sharded.n_shards} shards")
+        return sharded
+
+    def retrieve(self, query: str, corpus, k: int = 3, candidate_ids=None) -> List[Tuple[str, float, int]]:
+        index = self.sharded_index(corpus)
+        self.searches += 1
+        return [(corpus.chunks[chunk_id], similarity, chunk_id) for chunk_id, similarity in index.search(query, k, candidate_ids)]
+
+    def get_stats(self, corpus) -> dict:
+        sharded = corpus.indexes.get("tfidf_shards")
+        return {
+            "max_shards": self.n_shards,
+            "shards": sharded.n_shards if sharded is not None else 1,
+            "threads": self.threads,
+            "min_shard_chunks": self.min_shard_chunks,
+            "searches": self.searches,
+            "builds": self.builds,
+            "avg_build_ms": round(self.build_ms_total / self.builds, 2) if self.builds else 0.0
+        }
@@ -1,55 +1,254 @@
+import io
+import threading
 import numpy as np
-from typing import List, Tuple
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import List, Optional, Tuple
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
 import logging
+from .query_cache import QueryCache, query_cache
 
 logger = logging.getLogger(__name__)
 
+# Hashed vocabulary size; there is no fitted vocabulary to cap
+N_FEATURES = 2 ** 20
+
+
+def top_k(counts, doc_norms: np.ndarray, query_vec: np.ndarray, query_norm: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Cosine similarities of the count rows to query_vec and the row positions of the k best, best first.
+
+    Both the sparse product and the partition run in compiled code without
+    the GIL, so row blocks can be scored on parallel threads.
+    """
+    dots = counts @ query_vec
+    norms = doc_norms * query_norm
+    similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    # Get top-k chunks without sorting every similarity
+    k = min(k, len(similarities))
+    if k <= 0:
+        return similarities, np.empty(0, dtype=np.int64)
+    top_indices = np.argpartition(-similarities, k - 1)[:k]
+    top_indices = top_indices[np.argsort(-similarities[top_indices])]
+    return similarities, top_indices
+
+
 class SimpleRetriever:
-    def __init__(self, chunks: List[str]):
-        self.chunks = chunks
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        self.tfidf_matrix = None
-        
+    def __init__(self, chunks: List[str], cache: Optional[QueryCache] = None, n_features: int = N_FEATURES):
+        self.chunks = []
+        self.n_features = n_features
+        # Stateless hashing of raw term counts; IDF weighting is applied at query time
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            stop_words='english',
+            alternate_sign=False,
+            norm=None
+        )
+        self._blocks = []  # CSR row blocks appended since the last stack
+        self._counts = None  # CSR term counts, one row per chunk
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.idf = None
+        self.doc_norms = None
+        self._weights_stale = True
+        # Guards the count blocks and weights; queries run on many threads
+        self._lock = threading.Lock()
+        self.cache = cache or query_cache
+        # Hashed query counts don't depend on the corpus, so cached query
+        # vectors stay valid as chunks are added
+        self.model_id = f"hashing-tfidf:{n_features}"
+
         if chunks:
-            self._fit_vectorizer()
-    
-    def _fit_vectorizer(self):
-        """Fit the TF-IDF vectorizer with the chunks"""
+            self.add_chunks(chunks)
+
+    def add_chunks(self, chunks: List[str]):
+        """Append chunks as new rows without refitting existing ones"""
+        if not chunks:
+            return
         try:
-            self.tfidf_matrix = self.vectorizer.fit_transform(self.chunks)
-            logger.info(f"TF-IDF vectorizer fitted with {len(self.chunks)} chunks")
+            counts = self.vectorizer.transform(chunks).tocsr()
+            counts.sum_duplicates()
+            with self._lock:
+                self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+                self._blocks.append(counts)
+                self.chunks.extend(chunks)
+                self._weights_stale = True
+            logger.info(f"Added {len(chunks)} chunks to TF-IDF index ({len(self.chunks)} total)")
         except Exception as e:
-            logger.error(f"Error fitting TF-IDF vectorizer: {e}")
-    
-    def retrieve_similar_chunks(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
-        """Retrieve similar chunks using TF-IDF cosine similarity"""
+            logger.error(f"Error adding chunks to TF-IDF index: {e}")
+
+    @property
+    def tfidf_matrix(self):
+        """Raw term-count matrix (CSR); IDF weights are kept separately"""
+        if self._blocks:
+            with self._lock:
+                self._stack_blocks()
+        return self._counts
+
+    def _stack_blocks(self):
+        # Caller holds self._lock
+        if self._blocks:
+            blocks = [self._counts] + self._blocks if self._counts is not None else self._blocks
+            self._counts = sparse.vstack(blocks, format='csr')
+            self._blocks = []
+
+    def _refresh_weights(self):
+        """Recompute IDF and document norms lazily after the corpus changed.
+
+        Double-checked under the lock, so concurrent first queries compute
+        the weights once and the others wait for them.
+        """
+        with self._lock:
+            if not self._weights_stale:
+                return
+            self._stack_blocks()
+            counts = self._counts
+            n_docs = counts.shape[0]
+            # Same smoothed IDF as sklearn's TfidfVectorizer
+            idf = np.log((1 + n_docs) / (1 + self.doc_freq)) + 1
+            self.doc_norms = np.sqrt(counts.power(2) @ (idf ** 2))
+            self.idf = idf
+            self._weights_stale = False
+
+    def weights(self) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+        """(term counts, IDF, document norms), refreshed if stale and taken together"""
+        if self._weights_stale:
+            self._refresh_weights()
+        with self._lock:
+            return self._counts, self.idf, self.doc_norms
+
+    def export_counts(self) -> bytes:
+        """The term-count matrix as .npz bytes, for corpus snapshots"""
+        buffer = io.BytesIO()
+        sparse.save_npz(buffer, self.tfidf_matrix, compressed=False)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_counts(cls, chunks: List[str], data: bytes, n_features: int = N_FEATURES) -> "SimpleRetriever":
+        """Rebuild an index from export_counts() output without re-hashing the chunks"""
+        counts = sparse.load_npz(io.BytesIO(data)).tocsr()
+        if counts.shape != (len(chunks), n_features):
+            raise ValueError(f"Count matrix shape {counts.shape} does not match {len(chunks)} chunks")
+        index = cls([], n_features=n_features)
+        index.chunks = list(chunks)
+        index._counts = counts
+        index.doc_freq = np.bincount(counts.indices, minlength=n_features)
+        return index
+
+    def _transform_query(self, query: str):
+        return self.vectorizer.transform([query]).tocsr()
+
+    def warm_up(self, queries: List[str], top_n: int = 100) -> int:
+        """Precompute hashed vectors for the most frequent historical queries"""
+        return self.cache.warm_up(queries, self.model_id, self._transform_query, top_n)
+
+    def query_vector(self, query: str, idf: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+        """(dense n_features query vector, query norm) to dot with the raw count rows.
+
+        The norm is 0 for queries with no indexed terms. A dense vector makes
+        the product a plain CSR mat-vec, about twice as fast as a product
+        with a sparse column; allocating it is a zeroed 8 MB page mapping.
+        Pass the IDF from weights() to pair the vector with those counts.
+        """
+        if idf is None:
+            idf = self.weights()[1]
+
+        # Hash the query and apply IDF weights
+        query_counts = self.cache.get_or_compute(query, self.model_id, self._transform_query)
+        idf = idf[query_counts.indices]
+        query_weights = query_counts.data * idf
+        query_norm = np.linalg.norm(query_weights)
+
+        # Sparse dot product: doc weight is count * idf, so each query
+        # term contributes count * idf^2 * query weight
+        query_vec = np.zeros(self.n_features)
+        query_vec[query_counts.indices] = query_weights * idf
+        return query_vec, query_norm
+
+    def search(self, query: str, k: int = 3, candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (chunk id, cosine similarity) pairs; only candidate_ids are scored if given"""
+        if not self.chunks:
+            return []
+
+        counts, idf, doc_norms = self.weights()
+        query_vec, query_norm = self.query_vector(query, idf)
+        if query_norm == 0:
+            ids = range(counts.shape[0]) if candidate_ids is None else candidate_ids
+            return [(int(i), 0.0) for i in list(ids)[:k]]
+
+        if candidate_ids is not None:
+            if len(candidate_ids) == 0:
+                return []
+            row_ids = np.asarray(candidate_ids)
+            counts = counts[row_ids]
+            doc_norms = doc_norms[row_ids]
+        else:
+            row_ids = None
+
+        similarities, top_indices = top_k(counts, doc_norms, query_vec, query_norm, k)
+        return [
+            (int(idx if row_ids is None else row_ids[idx]), float(similarities[idx]))
+            for idx in top_indices
+        ]
+
+    def retrieve_similar_chunks(self, query: str, k: int = 3, candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Retrieve similar chunks using TF-IDF cosine similarity.
+
+        When candidate_ids is given (e.g. from a metadata filter), only those
+        rows are scored.
+        """
         try:
-            if self.tfidf_matrix is None or not self.chunks:
+            if not self.chunks:
                 logger.error("No TF-IDF matrix or chunks available")
                 return []
-            
-            # Transform query to TF-IDF
-            query_vec = self.vectorizer.transform([query])
-            
-            # Calculate cosine similarities
-            similarities = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-            
-            # Get top-k chunks
-            top_indices = similarities.argsort()[-k:][::-1]
-            
-            results = []
-            for idx in top_indices:
-                if 0 <= idx < len(self.chunks):
-                    chunk = self.chunks[idx]
-                    similarity = float(similarities[idx])  # Ensure it's a float
-                    results.append((chunk, similarity))
-            
+
+            results = [(self.chunks[chunk_id], similarity) for chunk_id, similarity in self.search(query, k, candidate_ids)]
             logger.info(f"Retrieved {len(results)} chunks using TF-IDF")
             return results
-            
+
         except Exception as e:
             logger.error(f"Error in TF-IDF retrieval: {e}")
             # Fallback: return first k chunks
-            return [(chunk, 0.5) for chunk in self.chunks[:k]]
\ No newline at end of file
+            return [(chunk, 0.5) for chunk in self.chunks[:k]]
+
+
+_index_lock = threading.Lock()
+
+
+def corpus_index(corpus) -> SimpleRetriever:
+    """The corpus' TF-IDF index, built on first use and extended if the corpus grew.
+
+    Building is double-checked under a lock, so concurrent first queries
+    hash the corpus once.
+    """
+    index = corpus.indexes.get("tfidf")
+    if index is not None and len(index.chunks) >= len(corpus):
+        return index
+    with _index_lock:
+        index = corpus.indexes.get("tfidf")
+        if index is None:
+            index = SimpleRetriever(corpus.chunks)
+            if not isinstance(corpus.chunks, list):
+                # Tiered corpora (utils/tiered_store.py) keep their texts in shards; don't pin a copy here
+                index.chunks = corpus.chunks
+            corpus.indexes["tfidf"] = index
+        elif len(index.chunks) < len(corpus):
+            index.add_chunks(corpus.chunks[len(index.chunks):])
+    return index
+
+
+def warm_up(queries: List[str], top_n: int = 100) -> int:
+    """Precompute hashed vectors for the most frequent historical queries.
+
+    Hashed query counts don't depend on the corpus, so this works before
+    any index is built.
+    """
+    return SimpleRetriever([]).warm_up(queries, top_n)
+
+
+def retrieve_from_corpus(query: str, corpus, k: int = 3, candidate_ids=None) -> List[Tuple[str, float, int]]:
+    """Retriever backend: TF-IDF over a corpus, indexed on first use.
+
+    The index is kept in `corpus.indexes` and extended incrementally if the
+    corpus grew since it was built.
+    """
+    index = corpus_index(corpus)
+    return [(corpus.chunks[chunk_id], similarity, chunk_id) for chunk_id, similarity in index.search(query, k, candidate_ids)]
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBroadcast:
+    """Fans one async stream out to any number of subscribers.
+
+    Items are buffered, so a subscriber that attaches mid-stream first
+    replays what was already produced and then follows live.
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                async with self._changed:
+                    self.items.append(item)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.items) > position or self.done)
+                new_items = self.items[position:]
+                finished = self.done
+            for item in new_items:
+                yield item
+            position += len(new_items)
+            if finished and position == len(self.items):
+                if self.error:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Single-flight deduplication of concurrent identical work.
+
+    The first caller for a key starts the computation as its own task; callers
+    arriving while it runs await the same task instead of repeating it. The
+    task is shielded, so a disconnecting caller doesn't cancel it for the rest.
+    Keys are forgotten as soon as the work finishes, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, StreamBroadcast] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the result of compute(), shared with concurrent callers of the same key"""
+        task = self._calls.get(key)
+        if task is None:
+            self.started += 1
+            task = self._calls[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda finished: self._forget(self._calls, key, finished))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Subscribe to the in-progress stream for key, starting produce() if there is none"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.started += 1
+            broadcast = self._streams[key] = StreamBroadcast(produce())
+            broadcast.task.add_done_callback(lambda finished: self._forget(self._streams, key, broadcast))
+        else:
+            self.coalesced += 1
+        return broadcast.subscribe()
+
+    @staticmethod
+    def _forget(registry: Dict[Hashable, Any], key: Hashable, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
+        if isinstance(entry, asyncio.Future) and not entry.cancelled() and entry.exception():
+            logger.warning(f"Shared computation failed: {entry.exception()}")
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "started": self.started,
+            "coalesced": self.coalesced
+        }
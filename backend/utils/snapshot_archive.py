@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import tarfile
+import tempfile
+import time
+import logging
+from typing import Any, BinaryIO, Dict, Iterable, Tuple
+from .corpus import ChunkLocation, Corpus
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "rag-corpus-snapshot"
+# Bump when the member layout changes; restore refuses newer versions
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Members larger than this are staged on disk while their checksum is computed
+SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class SnapshotError(ValueError):
+    """The archive is not a readable snapshot (wrong format, version or checksum)"""
+
+
+def _chunk_records(corpus: Corpus, sections: BinaryIO) -> Iterable[bytes]:
+    """Chunk records, writing the section records to `sections` in step.
+
+    Each section is written when the first chunk pointing at it is, so a
+    tiered corpus (utils/tiered_store.py) reads every shard once for all
+    three columns instead of once per column.
+    """
+    section_texts = iter(corpus.sections)
+    written = 0
+    for text, metadata, location in zip(corpus.chunks, corpus.metadata, corpus.locations):
+        while location.section_id is not None and written <= location.section_id:
+            sections.write(_section_record(next(section_texts)))
+            written += 1
+        yield json.dumps({
+            "text": text,
+            "metadata": metadata,
+            "location": {
+                "heading_path": list(location.heading_path),
+                "page_start": location.page_start,
+                "page_end": location.page_end,
+                "section_id": location.section_id
+            }
+        }, ensure_ascii=False).encode("utf-8") + b"\n"
+    for text in section_texts:
+        sections.write(_section_record(text))
+
+
+def _section_record(text: str) -> bytes:
+    return json.dumps(text, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _lexical_indexes(corpus: Corpus) -> Dict[str, bytes]:
+    """Serialized retriever indexes worth shipping instead of rebuilding.
+
+    Keyword token sets are recomputed from the chunk text on restore (a
+    split per chunk); the hashed TF-IDF count matrix is stored when it was
+    built, so replicas skip re-vectorizing the whole corpus.
+    """
+    indexes = {}
+    tfidf = corpus.indexes.get("tfidf")
+    if tfidf is not None and len(tfidf.chunks) == len(corpus):
+        indexes["tfidf"] = tfidf.export_counts()
+    return indexes
+
+
+def write_snapshot(corpus: Corpus, fileobj: BinaryIO, corpus_version: int = 0) -> Dict[str, Any]:
+    """Write the corpus as a gzip-compressed tar stream and return its manifest.
+
+    Members are written in restore order (chunks, sections, indexes) with
+    the manifest last; it records the SHA-256 and size of every member.
+    """
+    members = {}
+    with tarfile.open(fileobj=fileobj, mode="w|gz") as archive:
+        def add_member(name: str, pieces: Iterable[bytes]):
+            digest = hashlib.sha256()
+            size = 0
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as staged:
+                for piece in pieces:
+                    digest.update(piece)
+                    size += len(piece)
+                    staged.write(piece)
+                staged.seek(0)
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = int(time.time())
+                archive.addfile(info, staged)
+            members[name] = {"sha256": digest.hexdigest(), "bytes": size}
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as sections:
+            add_member("chunks.jsonl", _chunk_records(corpus, sections))
+            sections.seek(0)
+            add_member("sections.jsonl", iter(lambda: sections.read(SPOOL_BYTES), b""))
+        indexes = _lexical_indexes(corpus)
+        for name, data in indexes.items():
+            add_member(f"indexes/{name}.npz", [data])
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "corpus_version": corpus_version,
+            "chunks": len(corpus),
+            "sections": len(corpus.sections),
+            "indexes": sorted(indexes),
+            "members": members
+        }
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        archive.addfile(info, io.BytesIO(data))
+    return manifest
+
+
+def _read_lines(stream, digest) -> Iterable[Any]:
+    for line in stream:
+        digest.update(line)
+        yield json.loads(line)
+
+
+def read_snapshot(fileobj: BinaryIO) -> Tuple[Corpus, Dict[str, Any]]:
+    """Rebuild a corpus from a snapshot stream; raises SnapshotError if it doesn't verify.
+
+    The archive is read front to back without seeking, so `fileobj` may be
+    an upload or a pipe. Chunks are added to the new corpus as they are
+    decompressed; the corpus is only returned once every member matched the
+    manifest's checksums.
+    """
+    corpus = Corpus()
+    digests: Dict[str, Any] = {}
+    sizes: Dict[str, int] = {}
+    index_data: Dict[str, bytes] = {}
+    manifest = None
+
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as archive:
+            for member in archive:
+                stream = archive.extractfile(member)
+                if stream is None:
+                    continue
+                digest = digests[member.name] = hashlib.sha256()
+                sizes[member.name] = member.size
+
+                if member.name == MANIFEST_NAME:
+                    manifest = json.loads(stream.read())
+                elif member.name == "chunks.jsonl":
+                    for record in _read_lines(stream, digest):
+                        location = record["location"]
+                        corpus.add_chunks([record["text"]], record["metadata"], [ChunkLocation(
+                            tuple(location["heading_path"]), location["page_start"],
+                            location["page_end"], location["section_id"]
+                        )])
+                elif member.name == "sections.jsonl":
+                    for text in _read_lines(stream, digest):
+                        corpus.add_section(text)
+                elif member.name.startswith("indexes/") and member.name.endswith(".npz"):
+                    data = stream.read()
+                    digest.update(data)
+                    index_data[member.name[len("indexes/"):-len(".npz")]] = data
+                else:
+                    logger.warning(f"Ignoring unknown snapshot member {member.name}")
+    except (tarfile.TarError, OSError, EOFError) as e:
+        raise SnapshotError(f"Unreadable snapshot archive: {e}")
+    except (ValueError, KeyError, TypeError) as e:
+        raise SnapshotError(f"Malformed snapshot record: {e}")
+
+    if manifest is None:
+        raise SnapshotError("Snapshot has no manifest")
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Not a corpus snapshot: {manifest.get('format')}")
+    if manifest.get("format_version", 0) > SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot format v{manifest['format_version']} is newer than supported v{SNAPSHOT_FORMAT_VERSION}")
+
+    for name, expected in manifest["members"].items():
+        if name not in digests:
+            raise SnapshotError(f"Snapshot member {name} is missing")
+        if sizes[name] != expected["bytes"] or digests[name].hexdigest() != expected["sha256"]:
+            raise SnapshotError(f"Checksum mismatch for snapshot member {name}")
+    if len(corpus) != manifest["chunks"] or len(corpus.sections) != manifest["sections"]:
+        raise SnapshotError("Snapshot chunk count does not match its manifest")
+
+    if "tfidf" in index_data:
+        from .simple_retriever import SimpleRetriever
+        corpus.indexes["tfidf"] = SimpleRetriever.from_counts(corpus.chunks, index_data["tfidf"])
+    return corpus, manifest
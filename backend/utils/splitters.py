@@ -0,0 +1,145 @@
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from .parsers import Block
+
+
+def chunk_text(text: str, chunk_size: int = 500) -> List[str]:
+    """Split text into chunks"""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for word in words:
+        if current_length + len(word) > chunk_size and current_chunk:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+            current_length = len(word)
+        else:
+            current_chunk.append(word)
+            current_length += len(word) + 1  # +1 for space
+
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+
+    return chunks
+
+
+_recursive_splitters: Dict[Tuple[int, int], object] = {}
+
+
+def recursive_chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """Split text with LangChain's RecursiveCharacterTextSplitter (imported on first use)"""
+    key = (chunk_size, chunk_overlap)
+    splitter = _recursive_splitters.get(key)
+    if splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = _recursive_splitters[key] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len
+        )
+    return splitter.split_text(text)
+
+
+class StructuredChunk(NamedTuple):
+    text: str
+    page_start: Optional[int]
+    page_end: Optional[int]
+
+
+class Section(NamedTuple):
+    """Consecutive blocks under one heading path: the parent text sent to the
+    LLM for small-to-big retrieval, and the small child chunks that are indexed"""
+    text: str
+    heading_path: Tuple[str, ...]
+    page_start: Optional[int]
+    page_end: Optional[int]
+    chunks: List[StructuredChunk]
+
+
+def _page_range(blocks: List[Block]) -> Tuple[Optional[int], Optional[int]]:
+    pages = [block.page for block in blocks if block.page is not None]
+    return (min(pages), max(pages)) if pages else (None, None)
+
+
+def _block_line(block: Block) -> str:
+    return f"- {block.text}" if block.kind == "list_item" else block.text
+
+
+def _child_chunks(blocks: List[Block], chunk_size: int, split: Callable[..., List[str]]) -> Iterator[StructuredChunk]:
+    """Pack whole blocks into chunks of up to `chunk_size` characters.
+
+    Table rows are never packed together with prose, and only a block that
+    is longer than `chunk_size` on its own is cut (by `split`).
+    """
+    pending: List[Block] = []
+    size = 0
+
+    def emit() -> Iterator[StructuredChunk]:
+        if pending:
+            yield StructuredChunk("\n".join(_block_line(block) for block in pending), *_page_range(pending))
+            pending.clear()
+
+    for block in blocks:
+        if len(block.text) > chunk_size:
+            yield from emit()
+            size = 0
+            for piece in split(block.text, chunk_size):
+                yield StructuredChunk(piece, block.page, block.page)
+            continue
+        switches_kind = pending and (pending[-1].kind == "table_row") != (block.kind == "table_row")
+        if pending and (switches_kind or size + len(block.text) > chunk_size):
+            yield from emit()
+            size = 0
+        pending.append(block)
+        size += len(block.text) + 1
+    yield from emit()
+
+
+def chunk_blocks(blocks: Iterable[Block], chunk_size: int = 500, section_size: int = 2000,
+                 split: Callable[..., List[str]] = chunk_text) -> Iterator[Section]:
+    """Structure-aware chunking of parsed blocks (see utils/parsers.py).
+
+    Headings open a new section and set its heading path; a section longer
+    than `section_size` characters continues in another section with the
+    same path, cut between blocks (blocks longer than a section are split
+    first, so parent texts stay bounded). Sections are yielded as soon as they are
+    complete, so a document is chunked in a single streaming pass.
+
+    Every child chunk starts with a line holding its heading path
+    ("Report > Results"), so the retrievers index the headings too and a
+    chunk that only says "it grew 12%" still matches a search for the
+    section's topic.
+    """
+    heading_path: List[Tuple[int, str]] = []
+    pending: List[Block] = []
+    size = 0
+
+    def emit() -> Iterator[Section]:
+        if pending:
+            path = tuple(text for _, text in heading_path)
+            text = "\n".join(_block_line(block) for block in pending)
+            chunks = list(_child_chunks(pending, chunk_size, split))
+            if path:
+                heading = " > ".join(path)
+                chunks = [chunk._replace(text=f"{heading}\n{chunk.text}") for chunk in chunks]
+            yield Section(text, path, *_page_range(pending), chunks)
+            pending.clear()
+
+    for block in blocks:
+        if block.kind == "heading":
+            yield from emit()
+            size = 0
+            while heading_path and heading_path[-1][0] >= block.level:
+                heading_path.pop()
+            heading_path.append((block.level, block.text))
+            continue
+        # A block longer than a whole section (e.g. text without paragraph breaks) is cut up first
+        pieces = split(block.text, section_size) if len(block.text) > section_size else [block.text]
+        for piece in pieces:
+            if pending and size + len(piece) > section_size:
+                yield from emit()
+                size = 0
+            pending.append(block._replace(text=piece))
+            size += len(piece) + 1
+    yield from emit()
@@ -0,0 +1,381 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+import logging
+from bisect import bisect_right
+from collections import Counter
+from collections.abc import Sequence
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from .highlight import STOPWORDS
+from .profiling import trace_count
+from .reranker import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Positions of the corpus columns in a shard payload
+CHUNKS, TOKENS, METADATA, SECTIONS = range(4)
+
+
+class TieredSequence(Sequence):
+    """One corpus column (chunks, tokens, metadata or sections) whose items live in a store's shards.
+
+    Indexing loads the item's shard if it is cold, which promotes it;
+    iterating reads shard by shard without promoting, so bulk passes
+    (index builds, snapshot exports) don't flush the hot set. Pickles as a
+    plain list.
+    """
+
+    def __init__(self, store: "TieredStore", field: int, starts: List[int]):
+        self.store = store
+        self.field = field
+        self.starts = starts  # first item of every shard, then the total
+        self._len = starts[-1]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("corpus index out of range")
+        shard = bisect_right(self.starts, i) - 1
+        return self.store.shard(shard)[self.field][i - self.starts[shard]]
+
+    def __iter__(self):
+        for shard in range(len(self.starts) - 1):
+            yield from self.store.peek(shard, self.field)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+class TieredStore:
+    """A published corpus cut into shards of consecutive chunks, most of them on disk.
+
+    Each shard's chunk texts, metadata and parent sections are written
+    zlib-compressed to `directory` once; at most `hot_shards` are held in
+    memory. The routing index (per shard, how many chunks contain each
+    term) stays resident and is what `route` uses to pick the shards a
+    query can match; it is kept as one term -> id vocabulary plus sorted
+    term id and count arrays per shard (CSR layout), not a dict per shard. Shards are ranked for eviction by access heat, a hit
+    count that halves every `half_life_s` seconds, with the most recent
+    uploads ranked above older ones at equal heat.
+    """
+
+    def __init__(self, corpus, directory: str, shard_chunks: int, hot_shards: int,
+                 route_shards: int, half_life_s: float):
+        self.tokenizer = corpus.tokenizer
+        self.directory = directory
+        self.shard_chunks = shard_chunks
+        self.hot_shards = hot_shards
+        self.route_shards = route_shards
+        self.half_life_s = half_life_s
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, directory, True)
+
+        n = len(corpus)
+        self.chunk_starts = list(range(0, n, shard_chunks)) + [n]
+        self.n_shards = len(self.chunk_starts) - 1
+        # A section belongs to the shard holding its first chunk
+        self.section_starts = [0]
+        for shard in range(1, self.n_shards):
+            first = next((location.section_id for location in
+                          corpus.locations[self.chunk_starts[shard]:self.chunk_starts[shard + 1]]
+                          if location.section_id is not None), None)
+            self.section_starts.append(max(self.section_starts[-1], first if first is not None else 0))
+        self.section_starts.append(max(self.section_starts[-1], len(corpus.sections)))
+
+        self.vocabulary: Dict[str, int] = {}
+        term_ids, term_counts, term_starts = [], [], [0]
+        recency = []
+        self.disk_bytes = 0
+        for shard in range(self.n_shards):
+            start, end = self.chunk_starts[shard], self.chunk_starts[shard + 1]
+            counts = Counter()
+            for chunk in corpus.chunks[start:end]:
+                counts.update(set(tokenize(chunk)))
+            ids = np.fromiter((self.vocabulary.setdefault(term, len(self.vocabulary)) for term in counts),
+                              dtype=np.int32, count=len(counts))
+            order = np.argsort(ids)
+            term_ids.append(ids[order])
+            term_counts.append(np.fromiter(counts.values(), dtype=np.int32, count=len(counts))[order])
+            term_starts.append(term_starts[-1] + len(counts))
+            recency.append(max((str(metadata.get("uploaded_at", "")) for metadata in corpus.metadata[start:end]), default=""))
+            payload = (corpus.chunks[start:end], corpus.metadata[start:end],
+                       corpus.sections[self.section_starts[shard]:self.section_starts[shard + 1]])
+            data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 6)
+            with open(self._path(shard), "wb") as f:
+                f.write(data)
+            self.disk_bytes += len(data)
+        # Shard s holds the counts of term ids term_ids[term_starts[s]:term_starts[s + 1]]
+        self.term_starts = np.array(term_starts, dtype=np.int64)
+        self.term_ids = np.concatenate(term_ids) if term_ids else np.empty(0, dtype=np.int32)
+        self.term_counts = np.concatenate(term_counts) if term_counts else np.empty(0, dtype=np.int32)
+        totals = np.bincount(self.term_ids, weights=self.term_counts, minlength=len(self.vocabulary))
+        self.idf = np.log1p(n / np.maximum(totals, 1))
+
+        # Newest uploads first (later shards first within an upload)
+        by_recency = sorted(range(self.n_shards), key=lambda shard: (recency[shard], shard), reverse=True)
+        self.recency_rank = {shard: rank for rank, shard in enumerate(by_recency)}
+        self.heat = [0.0] * self.n_shards
+        self.touched = [0.0] * self.n_shards
+        self.hits = [0] * self.n_shards
+        self._resident: Dict[int, tuple] = {}
+        # The last cold shard read by peek(), so bulk passes reading several
+        # columns in step (snapshot exports) read each shard once
+        self._peeked: Optional[tuple] = None
+        for shard in by_recency[:hot_shards]:
+            start, end = self.chunk_starts[shard], self.chunk_starts[shard + 1]
+            self._resident[shard] = (corpus.chunks[start:end], corpus.tokens[start:end], corpus.metadata[start:end],
+                                     corpus.sections[self.section_starts[shard]:self.section_starts[shard + 1]])
+
+        self.promotions = 0
+        self.demotions = 0
+        self.faults = 0
+        self.load_ms_total = 0.0
+        self.routed_queries = 0
+        self.cold_searched = 0
+        self.cold_skipped = 0
+
+    def _path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:05d}.z")
+
+    def install(self, corpus):
+        """Swap the corpus columns for tiered sequences; the full in-memory lists are released"""
+        chunks = TieredSequence(self, CHUNKS, self.chunk_starts)
+        corpus.chunks = chunks
+        corpus.tokens = TieredSequence(self, TOKENS, self.chunk_starts)
+        corpus.metadata = TieredSequence(self, METADATA, self.chunk_starts)
+        corpus.sections = TieredSequence(self, SECTIONS, self.section_starts)
+        tfidf = corpus.indexes.get("tfidf")
+        if tfidf is not None:
+            tfidf.chunks = chunks
+
+    def _read(self, shard: int) -> tuple:
+        """(chunks, metadata, sections) of a shard from disk"""
+        with open(self._path(shard), "rb") as f:
+            return pickle.loads(zlib.decompress(f.read()))
+
+    def _load(self, shard: int) -> tuple:
+        chunks, metadata, sections = self._read(shard)
+        return chunks, [self.tokenizer(chunk) for chunk in chunks], metadata, sections
+
+    def peek(self, shard: int, field: int) -> list:
+        """One column of a shard without changing its tier; cold chunks are only tokenized for TOKENS"""
+        payload = self._resident.get(shard)
+        if payload is not None:
+            return payload[field]
+        peeked = self._peeked
+        if peeked is not None and peeked[0] == shard:
+            chunks, metadata, sections = peeked[1]
+        else:
+            chunks, metadata, sections = self._read(shard)
+            self._peeked = (shard, (chunks, metadata, sections))
+        if field == TOKENS:
+            return [self.tokenizer(chunk) for chunk in chunks]
+        return (chunks, None, metadata, sections)[field]
+
+    def shard(self, shard: int) -> tuple:
+        """A shard's payload, promoting it if it is cold"""
+        payload = self._resident.get(shard)
+        if payload is None:
+            with self._lock:
+                payload = self._resident.get(shard)
+                if payload is None:
+                    self.faults += 1
+                    payload = self._promote(shard, protected=(shard,))
+        return payload
+
+    def _current_heat(self, shard: int, now: float) -> float:
+        return self.heat[shard] * 0.5 ** ((now - self.touched[shard]) / self.half_life_s)
+
+    def _touch(self, shard: int, now: float):
+        self.heat[shard] = self._current_heat(shard, now) + 1
+        self.touched[shard] = now
+        self.hits[shard] += 1
+
+    def _promote(self, shard: int, protected) -> tuple:
+        # Caller holds the lock
+        started = time.perf_counter()
+        payload = self._load(shard)
+        self._resident[shard] = payload
+        self.promotions += 1
+        self.load_ms_total += (time.perf_counter() - started) * 1000
+        now = time.monotonic()
+        while len(self._resident) > self.hot_shards:
+            evictable = [resident for resident in self._resident if resident not in protected]
+            if not evictable:
+                break
+            coldest = min(evictable, key=lambda resident: (self._current_heat(resident, now), -self.recency_rank[resident]))
+            del self._resident[coldest]
+            self.demotions += 1
+        return payload
+
+    def score_shards(self, query: str, shards) -> Dict[int, float]:
+        """Routing score of each shard holding any query term: idf-weighted share of its chunks containing them"""
+        words = set(tokenize(query))
+        terms = [term for term in words - STOPWORDS if term in self.vocabulary] or \
+                [term for term in words if term in self.vocabulary]
+        if not terms:
+            return {}
+        query_ids = np.array(sorted(self.vocabulary[term] for term in terms), dtype=np.int32)
+        scores = {}
+        for shard in shards:
+            start, end = self.term_starts[shard], self.term_starts[shard + 1]
+            ids = self.term_ids[start:end]
+            positions = np.minimum(np.searchsorted(ids, query_ids), max(len(ids) - 1, 0))
+            found = ids[positions] == query_ids if len(ids) else np.zeros(len(query_ids), dtype=bool)
+            score = float(self.idf[query_ids[found]] @ self.term_counts[start:end][positions[found]])
+            if score:
+                scores[shard] = score / (self.chunk_starts[shard + 1] - self.chunk_starts[shard])
+        return scores
+
+    def route(self, query: str, candidate_ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Chunk ids to search: those of every resident shard matching the query plus the best-matching cold shards.
+
+        At most `route_shards` cold shards are loaded (and promoted) per
+        query; other matching cold shards are skipped, which is where
+        tiering trades recall on old, rarely hit data for memory. Every
+        matching shard counts a hit, searched or not, so a cold shard that
+        keeps matching heats up until it is promoted.
+        """
+        if candidate_ids is not None:
+            candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+            candidate_shards = np.unique(np.searchsorted(self.chunk_starts, candidate_ids, side="right") - 1)
+        else:
+            candidate_shards = range(self.n_shards)
+        scores = self.score_shards(query, candidate_shards)
+
+        with self._lock:
+            now = time.monotonic()
+            for shard in scores:
+                self._touch(shard, now)
+            hot = [shard for shard in scores if shard in self._resident]
+            cold = sorted((shard for shard in scores if shard not in self._resident), key=lambda shard: -scores[shard])
+            if len(self._resident) >= self.hot_shards:
+                # Once memory is full a cold shard must match better than the
+                # matching hot shards, or be hit more often than the coldest
+                # resident one, to displace anything; otherwise queries whose
+                # terms are everywhere would cycle shards through memory
+                weakest = min((scores[shard] for shard in hot), default=0.0)
+                coldest = min(self._current_heat(shard, now) for shard in self._resident)
+                cold = [shard for shard in cold if scores[shard] > weakest or self._current_heat(shard, now) > coldest]
+            loaded = cold[:self.route_shards]
+            skipped = len(scores) - len(hot) - len(loaded)
+            selected = hot + loaded
+            for shard in loaded:
+                self._promote(shard, protected=loaded)
+            # Promotions may have demoted some of the matching hot shards
+            selected = [shard for shard in selected if shard in self._resident]
+            self.routed_queries += 1
+            self.cold_searched += len(loaded)
+            self.cold_skipped += skipped
+        trace_count("tier_cold_loads", len(loaded))
+        trace_count("tier_cold_skipped", skipped)
+
+        selected.sort()
+        if candidate_ids is not None:
+            shard_of = np.searchsorted(self.chunk_starts, candidate_ids, side="right") - 1
+            return candidate_ids[np.isin(shard_of, selected)]
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.chunk_starts[shard], self.chunk_starts[shard + 1]) for shard in selected])
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        resident = sorted(self._resident)
+        hottest = sorted(range(self.n_shards), key=lambda shard: -self._current_heat(shard, now))[:10]
+        return {
+            "state": "tiered",
+            "shards": self.n_shards,
+            "shard_chunks": self.shard_chunks,
+            "hot_capacity": self.hot_shards,
+            "resident_shards": resident,
+            "resident_chunks": sum(self.chunk_starts[shard + 1] - self.chunk_starts[shard] for shard in resident),
+            "disk_bytes": self.disk_bytes,
+            "routing_terms": len(self.vocabulary),
+            "routing_entries": len(self.term_ids),
+            "promotions": self.promotions,
+            "demotions": self.demotions,
+            "faults": self.faults,
+            "avg_load_ms": round(self.load_ms_total / self.promotions, 2) if self.promotions else 0.0,
+            "routed_queries": self.routed_queries,
+            "cold_shards_searched": self.cold_searched,
+            "cold_shards_skipped": self.cold_skipped,
+            "hottest": [{"shard": shard, "heat": round(self._current_heat(shard, now), 2), "hits": self.hits[shard],
+                         "resident": shard in self._resident} for shard in hottest if self.hits[shard]]
+        }
+
+
+class CorpusTiering:
+    """Tiers each published corpus in the background on first use and routes retrieval through it.
+
+    Published corpora are never modified, so a store is built once per
+    corpus (in each worker); until it is ready, queries search the corpus
+    as it is. Corpora of at most `hot_shards` shards stay fully in memory.
+    """
+
+    def __init__(self, directory: str, shard_chunks: int = 2048, hot_shards: int = 8,
+                 route_shards: int = 2, half_life_s: float = 600.0):
+        self.directory = directory
+        self.shard_chunks = shard_chunks
+        self.hot_shards = hot_shards
+        self.route_shards = route_shards
+        self.half_life_s = half_life_s
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def store(self, corpus) -> Optional[TieredStore]:
+        """The corpus' tiered store, or None while it is being built or if the corpus is small"""
+        if "tiers" in corpus.indexes:
+            return corpus.indexes["tiers"]
+        with self._lock:
+            if "tiers" in corpus.indexes:
+                return corpus.indexes["tiers"]
+            corpus.indexes["tiers"] = None
+            if len(corpus) <= self.shard_chunks * self.hot_shards:
+                return None
+            corpus.indexes["tiers_building"] = True
+        threading.Thread(target=self._build, args=(corpus,), name="corpus-tiering", daemon=True).start()
+        return None
+
+    def _build(self, corpus):
+        started = time.perf_counter()
+        directory = tempfile.mkdtemp(prefix=f"corpus-{os.getpid()}-", dir=self.directory)
+        try:
+            store = TieredStore(corpus, directory, self.shard_chunks, self.hot_shards,
+                                self.route_shards, self.half_life_s)
+            store.install(corpus)
+            corpus.indexes["tiers"] = store
+            logger.info(f"Tiered {len(corpus)} chunks into {store.n_shards} shards "
+                        f"({store.disk_bytes} bytes on disk) in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            shutil.rmtree(directory, ignore_errors=True)
+            logger.error(f"Corpus tiering failed, keeping everything in memory: {e}")
+        finally:
+            corpus.indexes.pop("tiers_building", None)
+
+    def wrap(self, retrieve: Callable) -> Callable:
+        """A retriever backend that searches only the shards each query is routed to"""
+        def tiered_retrieve(query: str, corpus, k: int = 3, candidate_ids=None):
+            store = self.store(corpus)
+            if store is not None:
+                candidate_ids = store.route(query, candidate_ids)
+            return retrieve(query, corpus, k=k, candidate_ids=candidate_ids)
+        return tiered_retrieve
+
+    def get_stats(self, corpus) -> dict:
+        store = corpus.indexes.get("tiers")
+        if store is not None:
+            return store.get_stats()
+        return {"state": "building" if corpus.indexes.get("tiers_building") else "in_memory",
+                "shard_chunks": self.shard_chunks, "hot_capacity": self.hot_shards}
@@ -1,9 +1,121 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import os
+import json
 import time
+import html
 
 # Configuration
-API_BASE_URL = "http://localhost:8000"
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000").rstrip("/")
+
+# (connect, read) timeouts in seconds. Status calls fail fast so a slow
+# backend never blocks a rerun; answers are streamed, so the read timeout
+# only bounds the gap between tokens.
+STATUS_TIMEOUT = (2, 3)
+REQUEST_TIMEOUT = (3, 30)
+QUERY_TIMEOUT = (3, 120)
+UPLOAD_TIMEOUT = (3, 600)
+
+@st.cache_resource
+def api_session() -> requests.Session:
+    """One pooled HTTP session shared by every rerun, so requests reuse keep-alive connections"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_health() -> dict:
+    """Backend health and round-trip time, cached briefly so reruns don't each ping the backend"""
+    started = time.perf_counter()
+    try:
+        response = api_session().get(f"{API_BASE_URL}/health", timeout=STATUS_TIMEOUT)
+        online = response.status_code == 200
+    except requests.RequestException:
+        online = False
+    return {"online": online, "latency_ms": (time.perf_counter() - started) * 1000}
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_stats() -> dict:
+    """Corpus summary from /stats (empty if the backend is unreachable)"""
+    try:
+        response = api_session().get(f"{API_BASE_URL}/stats", timeout=STATUS_TIMEOUT)
+        return response.json() if response.status_code == 200 else {}
+    except requests.RequestException:
+        return {}
+
+def error_detail(response: requests.Response) -> str:
+    try:
+        return response.json().get('detail', 'Unknown error')
+    except ValueError:
+        return response.text or f"HTTP {response.status_code}"
+
+class ChunkUnavailable(Exception):
+    """The backend couldn't return a chunk (e.g. 409 after a re-upload)"""
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_chunk_text(chunk_id: int, corpus_version: int) -> str:
+    """Chunk text from the backend; raises on failure, and st.cache_data never caches exceptions"""
+    response = api_session().get(f"{API_BASE_URL}/chunks/{chunk_id}", params={"version": corpus_version},
+                                 timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise ChunkUnavailable(error_detail(response))
+    return response.json()['content']
+
+def fetch_chunk(chunk_id: int, corpus_version: int) -> str:
+    """Full text of a source chunk, fetched only when a source is expanded; a warning if it can't be loaded"""
+    try:
+        return fetch_chunk_text(chunk_id, corpus_version)
+    except ChunkUnavailable as e:
+        return f"⚠️ {e}"
+    except requests.RequestException as e:
+        return f"⚠️ Could not load chunk: {e}"
+    except (ValueError, KeyError):
+        return "⚠️ Could not load chunk: unexpected response from the backend"
+
+def stream_in_session(question: str) -> requests.Response:
+    """POST /query/stream within the server-side conversation, starting a new one if it expired.
+    
+    Returns the open streaming response (or the failed /sessions response);
+    the caller reads its NDJSON events and must close it. Raises ValueError
+    or KeyError if the backend answers /sessions with something unexpected.
+    """
+    session = api_session()
+    for _ in range(2):
+        if st.session_state.session_id is None:
+            created = session.post(f"{API_BASE_URL}/sessions", timeout=REQUEST_TIMEOUT)
+            if created.status_code != 200:
+                return created
+            st.session_state.session_id = created.json()["session_id"]
+        response = session.post(f"{API_BASE_URL}/query/stream", stream=True, timeout=QUERY_TIMEOUT,
+                                json={"question": question, "session_id": st.session_state.session_id})
+        if response.status_code != 404 or not error_detail(response).startswith("Session"):
+            return response
+        response.close()
+        st.session_state.session_id = None
+    return response
+
+def format_latency(timings: dict) -> str:
+    parts = []
+    if timings.get('first_token_s') is not None:
+        parts.append(f"first token {timings['first_token_s']:.2f}s")
+    parts.append(f"total {timings['total_s']:.2f}s")
+    return "⏱️ " + " · ".join(parts)
+
+def render_snippet(src: dict) -> str:
+    """Snippet HTML with query-term highlights (offsets are relative to the full chunk)"""
+    text, offset = src['snippet'], src['snippet_start']
+    parts, position = [], 0
+    for start, end in src.get('highlights', []):
+        start, end = start - offset, end - offset
+        parts.append(html.escape(text[position:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        position = end
+    parts.append(html.escape(text[position:]))
+    prefix = "… " if src['snippet_start'] > 0 else ""
+    suffix = " …" if src['snippet_end'] < src['content_length'] else ""
+    return f"<div style='white-space: pre-wrap'>{prefix}{''.join(parts)}{suffix}</div>"
 
 # Streamlit Page Setup
 st.set_page_config(
@@ -75,6 +187,8 @@ if 'processing_status' not in st.session_state:
     st.session_state.processing_status = "No documents uploaded"
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = None
 
 # --- Header ---
 st.markdown("<div class='main-title'>📚 RAG Knowledge Base</div>", unsafe_allow_html=True)
@@ -84,8 +198,8 @@ st.markdown("<div class='subtext'>Upload your documents and ask anything about t
 with st.sidebar:
     st.header("📁 Upload Documents")
     uploaded_files = st.file_uploader(
-        "Select PDF or TXT files",
-        type=['pdf', 'txt'],
+        "Select documents (PDF, TXT, Markdown, HTML, DOCX, CSV, JSONL or email)",
+        type=['pdf', 'txt', 'md', 'markdown', 'html', 'htm', 'docx', 'csv', 'jsonl', 'ndjson', 'eml'],
         accept_multiple_files=True
     )
 
@@ -93,28 +207,34 @@ with st.sidebar:
         with st.spinner("Processing documents..."):
             files = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
             try:
-                response = requests.post(f"{API_BASE_URL}/upload", files=files)
+                response = api_session().post(f"{API_BASE_URL}/upload", files=files, timeout=UPLOAD_TIMEOUT)
                 if response.status_code == 200:
                     result = response.json()
                     st.session_state.documents_uploaded = True
                     st.session_state.processing_status = f"✅ {result['message']}"
+                    fetch_stats.clear()
                     st.success("Documents processed successfully!")
                 else:
-                    st.error(f"Error: {response.json().get('detail', 'Unknown error')}")
+                    st.error(f"Error: {error_detail(response)}")
             except Exception as e:
                 st.error(f"❌ Cannot connect to backend: {str(e)}")
 
     st.markdown("---")
     st.header("🧠 System Status")
 
-    try:
-        health_response = requests.get(f"{API_BASE_URL}/health")
-        if health_response.status_code == 200:
-            st.success("Backend: Online ✅")
-        else:
-            st.error("Backend: Offline ❌")
-    except:
+    health = fetch_health()
+    if health["online"]:
+        st.success(f"Backend: Online ✅ ({health['latency_ms']:.0f} ms)")
+        stats = fetch_stats()
+        if stats.get("documents_processed"):
+            # Documents uploaded earlier (or by another user) can be queried too
+            st.session_state.documents_uploaded = True
+            st.caption(f"{stats['documents_processed']} chunks indexed · "
+                       f"corpus v{stats.get('corpus', {}).get('version', '?')}")
+    else:
         st.error("Backend connection failed.")
+    if st.session_state.chat_history:
+        st.caption("Last answer " + format_latency(st.session_state.chat_history[-1]['latency']))
 
 # --- Main Layout ---
 col1, col2 = st.columns([2, 1])
@@ -135,24 +255,59 @@ with col1:
 
         if clear_button:
             st.session_state.chat_history = []
+            if st.session_state.session_id:
+                try:
+                    api_session().delete(f"{API_BASE_URL}/sessions/{st.session_state.session_id}",
+                                         timeout=REQUEST_TIMEOUT)
+                except requests.RequestException:
+                    pass  # the session expires on its own
+                st.session_state.session_id = None
             st.rerun()
 
         if ask_button and question:
-            with st.spinner("Generating answer..."):
-                try:
-                    response = requests.post(f"{API_BASE_URL}/query", json={"question": question})
-                    if response.status_code == 200:
-                        result = response.json()
-                        st.session_state.chat_history.append({
-                            "question": question,
-                            "answer": result['answer'],
-                            "sources": result['sources'],
-                            "timestamp": time.time()
-                        })
+            # Tokens are rendered as they arrive; the finished answer moves to the chat history
+            answer_placeholder = st.empty()
+            started = time.perf_counter()
+            first_token_s = None
+            try:
+                with st.spinner("Searching documents..."):
+                    response = stream_in_session(question)
+                with response:
+                    if response.status_code != 200:
+                        st.error(f"Error: {error_detail(response)}")
                     else:
-                        st.error(f"Error: {response.json().get('detail', 'Unknown error')}")
-                except Exception as e:
-                    st.error(f"❌ Connection error: {str(e)}")
+                        sources, corpus_version, answer, failed = [], None, "", False
+                        for line in response.iter_lines():
+                            if not line:
+                                continue
+                            event = json.loads(line)
+                            if event['type'] == 'sources':
+                                sources, corpus_version = event['sources'], event.get('corpus_version')
+                            elif event['type'] == 'token':
+                                if first_token_s is None:
+                                    first_token_s = time.perf_counter() - started
+                                answer += event['text']
+                                answer_placeholder.markdown(f"🤖 {answer}▌")
+                            elif event['type'] == 'error':
+                                failed = True
+                                st.error(f"Error: {event['detail']}")
+                        answer_placeholder.empty()
+                        if not failed:
+                            st.session_state.chat_history.append({
+                                "question": question,
+                                "answer": answer,
+                                "sources": sources,
+                                "corpus_version": corpus_version,
+                                "latency": {"first_token_s": first_token_s, "total_s": time.perf_counter() - started},
+                                "timestamp": time.time()
+                            })
+            except (ValueError, KeyError, TypeError):
+                # Malformed /sessions reply or NDJSON event (e.g. a proxy error page)
+                answer_placeholder.empty()
+                st.error("❌ Unexpected response from the backend")
+            except requests.RequestException as e:
+                answer_placeholder.empty()
+                st.error(f"❌ Connection error: {str(e)}")
 
     st.markdown("---")
     st.subheader("🗂️ Chat History")
@@ -167,10 +322,14 @@ with col1:
                 <div class='answer-text'>🤖 {chat['answer']}</div>
             </div>
             """, unsafe_allow_html=True)
+            st.caption(format_latency(chat['latency']))
             if chat['sources']:
                 with st.expander("📚 Sources"):
                     for src in chat['sources']:
-                        st.text(f"{src['content']}\n")
+                        st.markdown(render_snippet(src), unsafe_allow_html=True)
+                        if src['snippet_end'] - src['snippet_start'] < src['content_length']:
+                            if st.toggle("Show full text", key=f"full-{chat['timestamp']}-{src['chunk_id']}"):
+                                st.text(fetch_chunk(src['chunk_id'], chat['corpus_version']))
 
 # --- Example Prompts ---
 with col2: